@@ -118,10 +118,52 @@ export async function sendChatMessage(message: string, conversationHistory: Chat
   }
 }
 
-// Get all leads
-export async function getLeads() {
+export interface Lead extends LeadInfo {
+  id: number;
+  created_at: string;
+  conversation_id?: string | null;
+  conversation?: string;
+}
+
+export interface LeadPage {
+  items: Lead[];
+  next_cursor: string | null;
+}
+
+export interface LeadFilters {
+  limit?: number;
+  cursor?: string;
+  created_from?: string;
+  created_to?: string;
+  has_email?: boolean;
+  has_phone?: boolean;
+  interest?: string;
+  program?: string[];
+  include_conversation?: boolean;
+}
+
+export interface ProgramFacet {
+  program: string;
+  count: number;
+}
+
+function leadQueryString(filters: LeadFilters): string {
+  const params = new URLSearchParams();
+  Object.entries(filters).forEach(([key, value]) => {
+    if (Array.isArray(value)) {
+      value.forEach((item) => params.append(key, item));
+    } else if (value !== undefined && value !== '') {
+      params.set(key, String(value));
+    }
+  });
+  const query = params.toString();
+  return query ? `?${query}` : '';
+}
+
+// Get one page of leads, newest first; pass next_cursor back as `cursor` for the next page
+export async function getLeads(filters: LeadFilters = {}): Promise<LeadPage> {
   try {
-    const response = await safeFetch('/leads', {
+    const response = await safeFetch(`/leads${leadQueryString(filters)}`, {
       method: 'GET'
     });
     
@@ -132,6 +174,54 @@ export async function getLeads() {
     return await response.json();
   } catch (error) {
     console.error("Leads fetch error:", error);
+    return { items: [], next_cursor: null };
+  }
+}
+
+export interface ConversationMessage extends ChatMessage {
+  seq: number;
+  token_count: number;
+  created_at: string;
+}
+
+export interface MessagePage {
+  conversation_id: string | null;
+  items: ConversationMessage[];
+  next_after_seq: number | null;
+}
+
+// Get one page of a lead's conversation, oldest first; pass next_after_seq back as `afterSeq` for the next page
+export async function getLeadMessages(leadId: number, afterSeq: number = -1, limit: number = 50): Promise<MessagePage> {
+  try {
+    const response = await safeFetch(`/leads/${leadId}/messages?after_seq=${afterSeq}&limit=${limit}`, {
+      method: 'GET'
+    });
+    
+    if (!response.ok) {
+      throw new Error(`Failed to fetch messages: ${response.status}`);
+    }
+    
+    return await response.json();
+  } catch (error) {
+    console.error("Messages fetch error:", error);
+    return { conversation_id: null, items: [], next_after_seq: null };
+  }
+}
+
+// Number of leads per program among the leads matching the filters
+export async function getLeadFacets(filters: LeadFilters = {}): Promise<ProgramFacet[]> {
+  try {
+    const response = await safeFetch(`/leads/facets${leadQueryString(filters)}`, {
+      method: 'GET'
+    });
+    
+    if (!response.ok) {
+      throw new Error(`Failed to fetch lead facets: ${response.status}`);
+    }
+    
+    return await response.json();
+  } catch (error) {
+    console.error("Lead facets fetch error:", error);
     return [];
   }
-} 
\ No newline at end of file
+}
@@ -2,54 +2,97 @@ import os
 import openai
 import json
 import httpx
-from typing import Dict, List, Optional, Union, Any
-import re
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union, Any
 import time
+import asyncio
 from openai import OpenAIError
 
-# Function to initialize OpenAI client with API key
-def get_openai_client():
+from .history import HistoryManager
+from .intent_router import IntentRouter
+from .response_cache import ResponseCache
+from .circuit_breaker import CircuitOpenError, OPEN, openai_breaker
+from .conversation_cache import history_prefix_keys, message_parts
+from . import metrics, tracing
+from .prompt_builder import PromptBuilder, PromptSegment
+from .lead_state import (
+    LeadCollectionState, LeadStateCache, LEAD_FIELDS, LEAD_INFO_PATTERN,
+    NAME_VALUE_PATTERN, EMAIL_PATTERN, PHONE_PATTERNS, match_programs, merge_interests
+)
+
+# Connection pool of the shared OpenAI client; every chat turn and extraction call goes through it
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+# Idle connections stay open this long, so turns a minute apart still skip the TLS handshake
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "60"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "90"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "10"))
+OPENAI_SDK_MAX_RETRIES = int(os.getenv("OPENAI_SDK_MAX_RETRIES", "2"))
+# HTTP/2 multiplexes concurrent calls over one connection; needs the h2 package (pip install httpx[http2])
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "false").lower() in ("1", "true", "yes")
+
+_openai_client = None
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def create_openai_client() -> openai.AsyncOpenAI:
+    """A new AsyncOpenAI client over its own tuned connection pool"""
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("OPENAI_API_KEY environment variable is not set")
     
-    # Print diagnostic info
-    print(f"DIAGNOSTIC: API key prefix: {api_key[:5]}...")
-    print(f"DIAGNOSTIC: API key length: {len(api_key)}")
-    
-    # Try with multiple configurations
+    http2 = OPENAI_HTTP2
+    if http2 and not http2_available():
+        print("DIAGNOSTIC: OPENAI_HTTP2 is set but h2 is not installed, using HTTP/1.1")
+        http2 = False
+    print(f"DIAGNOSTIC: Creating OpenAI client (HTTP/{'2' if http2 else '1.1'}, "
+          f"{OPENAI_MAX_CONNECTIONS} connections, {OPENAI_MAX_KEEPALIVE_CONNECTIONS} kept alive)")
+    http_client = httpx.AsyncClient(
+        http2=http2,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_SECONDS
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+    )
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS),
+        max_retries=OPENAI_SDK_MAX_RETRIES,
+        http_client=http_client
+    )
+
+def get_async_openai_client() -> openai.AsyncOpenAI:
+    """The application-wide OpenAI client, created on first use and shared by every caller"""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = create_openai_client()
+    return _openai_client
+
+async def warm_up_openai_client(client: openai.AsyncOpenAI, timeout: float = OPENAI_CONNECT_TIMEOUT_SECONDS):
+    """
+    Open a pooled connection (DNS, TCP and TLS) with a cheap models list, so the
+    first user request doesn't pay for connection setup. Failures are logged only.
+    """
+    started = time.perf_counter()
     try:
-        print("DIAGNOSTIC: Creating OpenAI client with standard configuration")
-        return openai.OpenAI(
-            api_key=api_key,
-            timeout=90.0,  # Increased timeout for slow connections
-            max_retries=2,  # Built-in retries
-        )
+        await client.with_options(max_retries=0, timeout=timeout).models.list()
+        print(f"DIAGNOSTIC: OpenAI connection warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
     except Exception as e:
-        print(f"DIAGNOSTIC: Standard client creation failed: {str(e)}")
-        
-        # Try with httpx configuration
-        try:
-            print("DIAGNOSTIC: Creating OpenAI client with custom transport")
-            transport = httpx.HTTPTransport(
-                verify=True,  # SSL verification
-                http1=True,   # Allow HTTP/1.1
-                http2=False   # Disable HTTP/2
-            )
-            client = httpx.Client(transport=transport)
-            
-            return openai.OpenAI(
-                api_key=api_key,
-                timeout=120.0,
-                http_client=client
-            )
-        except Exception as inner_e:
-            print(f"DIAGNOSTIC: Custom transport client creation failed: {str(inner_e)}")
-            # Still return a client even with potential issues
-            return openai.OpenAI(
-                api_key=api_key,
-                timeout=120.0
-            )
+        print(f"DIAGNOSTIC: OpenAI warm-up failed ({type(e).__name__}: {str(e)}), connecting on first use")
+
+async def close_openai_client():
+    """Close the shared client's connection pool; the next get_async_openai_client() makes a new one"""
+    global _openai_client
+    if _openai_client is not None:
+        client, _openai_client = _openai_client, None
+        await client.close()
 
 # System prompt that defines the charity lead capture agent's behavior
 SYSTEM_PROMPT = """You are a friendly and helpful assistant for Kura Cares Charity, a not-for-profit organization in New Zealand. 
@@ -129,49 +172,201 @@ Important guidelines:
 When providing information about the charity, emphasize its impact on communities, success stories, and how contributions make a difference.
 """
 
-class LeadCaptureAgent:
+# Instructions for the separate, structured lead extraction step
+LEAD_EXTRACTION_PROMPT = """You extract contact details for Kura Cares Charity from a chat excerpt.
+Return a JSON object with exactly these keys: "name", "email", "phone", "interests".
+Use the visitor's own words, only include details the visitor gave about themselves,
+and use null for anything that is not known. "interests" is a comma-separated list of
+the programmes or ways of helping the visitor is interested in.
+Details captured earlier in the conversation are given under KNOWN; keep them unless
+the visitor corrects them."""
+
+# Older replies may still carry an inline lead-info trailer, which is stripped from output
+LEAD_INFO_OPEN = "[LEAD_INFO]"
+LEAD_INFO_CLOSE = "[/LEAD_INFO]"
+
+class LeadInfoStreamFilter:
+    """
+    Incrementally strips the [LEAD_INFO]...[/LEAD_INFO] block from streamed text.
+    
+    Text that could be the start of the opening marker is held back until it can be
+    decided, so users never see any part of the trailer.
+    """
     def __init__(self):
-        self.client = get_openai_client()
+        self.message = ""  # Visible text emitted so far
+        self.lead_info = None
+        self._pending = ""
+        self._block = None  # Raw block contents while inside [LEAD_INFO]
+    
+    def feed(self, text: str) -> str:
+        """Add a streamed chunk and return the part that is safe to show"""
+        visible = ""
+        if self._block is None:
+            self._pending += text
+        else:
+            self._block += text
+        
+        while True:
+            if self._block is not None:
+                end = self._block.find(LEAD_INFO_CLOSE)
+                if end == -1:
+                    break
+                self._parse_block(self._block[:end])
+                self._pending = self._block[end + len(LEAD_INFO_CLOSE):]
+                self._block = None
+            
+            start = self._pending.find(LEAD_INFO_OPEN)
+            if start == -1:
+                break
+            visible += self._pending[:start]
+            self._block = self._pending[start + len(LEAD_INFO_OPEN):]
+            self._pending = ""
+        
+        if self._block is None:
+            # Hold back the longest suffix that could still grow into the opening marker
+            hold = 0
+            for size in range(min(len(self._pending), len(LEAD_INFO_OPEN) - 1), 0, -1):
+                if LEAD_INFO_OPEN.startswith(self._pending[-size:]):
+                    hold = size
+                    break
+            visible += self._pending[:len(self._pending) - hold]
+            self._pending = self._pending[len(self._pending) - hold:]
+        
+        self.message += visible
+        return visible
+    
+    def close(self) -> str:
+        """Flush held-back text at the end of the stream; an unterminated block is dropped"""
+        visible = self._pending if self._block is None else ""
+        self._pending = ""
+        self._block = None
+        self.message += visible
+        return visible
+    
+    def _parse_block(self, block: str):
+        try:
+            self.lead_info = json.loads(block)
+        except json.JSONDecodeError:
+            pass
+
+# Reply used when the model can't be reached; chat() swaps it for a fallback answer
+CONNECTION_ERROR_MESSAGE = "I'm sorry, I'm having trouble connecting right now. Please try again later."
+
+class LeadCaptureAgent:
+    def __init__(self, client: Optional[openai.AsyncOpenAI] = None):
+        self.client = client or get_async_openai_client()
         self.model = "gpt-3.5-turbo"  # Can be upgraded to gpt-4 for better results
         self.max_retries = 3  # Number of times to retry API calls
         self.retry_delay = 2  # Seconds to wait between retries
-        self.openai_available = True  # Track if OpenAI is available
+        self.breaker = openai_breaker  # Process-wide circuit breaker over the OpenAI API
+        self.lead_states = LeadStateCache()  # Per-conversation lead-collection state
+        self.history_manager = HistoryManager()  # Keeps the prompt within the token budget
+        self.response_cache = ResponseCache()  # Replies to repeat FAQ turns
+        self.intent_router = IntentRouter()  # Templated answers for common FAQ intents
+        self.prompt_builder = PromptBuilder(SYSTEM_PROMPT)  # Static prompt segments, built once
+        self.extraction_prompt = PromptSegment("system", LEAD_EXTRACTION_PROMPT)
+    
+    @property
+    def openai_available(self) -> bool:
+        """False while the OpenAI circuit breaker is open"""
+        return self.breaker.state != OPEN
     
-    def chat(self, user_message: str, conversation_history: List[Any] = None) -> Dict:
+    async def check_openai(self) -> Optional[str]:
+        """Health check: the circuit isn't open and the API answers a cheap models list"""
+        if not self.openai_available:
+            raise CircuitOpenError("OpenAI circuit is open")
+        # Outside the breaker, so probe failures don't trip it; no SDK retries either
+        await self.client.with_options(max_retries=0).models.list()
+        return None
+    
+    async def chat(self, user_message: str, conversation_history: List[Any] = None, conversation_id: Optional[str] = None) -> Dict:
         """
         Process a user message and generate a response while trying to capture lead information.
         
+        The OpenAI call and retry backoff are awaited, so a slow completion only suspends
+        this request. Cancelling the awaiting task (e.g. when the client disconnects)
+        aborts the in-flight API call and any pending retry.
+        
         Args:
             user_message: The latest message from the user
             conversation_history: Previous messages in the conversation
+            conversation_id: Stable id for the conversation (e.g. a session id), used to
+                reuse the lead-collection state from earlier turns
             
         Returns:
-            Dict containing the assistant's response and any captured lead information
+            Dict containing the assistant's response, any captured lead information,
+            the path that answered the turn ("intent", "cache", "llm" or "fallback")
+            and the turn's lead state, for extract_lead_info
         """
-        result = self._chat_with_retry(user_message, conversation_history)
+        conversation_history = conversation_history or []
+        lead_state, prefix_keys = self._resolve_turn(conversation_history, conversation_id)
+        
+        # High-confidence FAQ turns are answered locally without calling the model
+        routed = self._route_intent(user_message, conversation_history, conversation_id, lead_state)
+        if routed is not None:
+            metrics.CHAT_TURNS.labels("intent").inc()
+            routed["path"] = "intent"
+            routed["lead_state"] = lead_state
+            return routed
+        
+        # Repeat FAQ turns are answered from the response cache
+        cache_key = self._response_cache_key(user_message, conversation_history, conversation_id, lead_state)
+        cached_message = self.response_cache.get(cache_key) if cache_key else None
+        if cached_message is not None:
+            metrics.CHAT_TURNS.labels("cache").inc()
+            result = {"message": cached_message, "captured_lead_info": None, "path": "cache"}
+        elif not self.openai_available:
+            # OpenAI is failing, don't add to its load; go straight to the fallback
+            result = {"message": CONNECTION_ERROR_MESSAGE, "captured_lead_info": None}
+        else:
+            result = await self._chat_with_retry(user_message, conversation_history, conversation_id,
+                                                 lead_state, prefix_keys)
         
         # If we got a connection error response, try using the fallback system
         if "I'm having trouble connecting right now" in result["message"]:
             print("DIAGNOSTIC: Using fallback response system")
-            fallback_response = self._get_fallback_response(user_message, conversation_history)
+            metrics.CHAT_TURNS.labels("fallback").inc()
+            with tracing.span("fallback"):
+                fallback_response = self._get_fallback_response(user_message, conversation_history, conversation_id, lead_state)
             if fallback_response:
+                fallback_response["path"] = "fallback"
+                fallback_response["lead_state"] = lead_state
                 return fallback_response
+            result["path"] = "fallback"
+        elif cached_message is None:
+            metrics.CHAT_TURNS.labels("llm").inc()
+            result["path"] = "llm"
+        
+        if cache_key and cached_message is None:
+            self.response_cache.put(cache_key, result["message"])
+        
+        # Lead extraction runs after the reply (see extract_lead_info); meanwhile
+        # report what the cheap local scan already found
+        if not result.get("captured_lead_info"):
+            result["captured_lead_info"] = self._local_lead_info(user_message, conversation_history, conversation_id, lead_state) or None
         
+        result["lead_state"] = lead_state
         return result
     
-    def _chat_with_retry(self, user_message: str, conversation_history: List[Any] = None) -> Dict:
+    async def _chat_with_retry(self, user_message: str, conversation_history: List[Any] = None, conversation_id: Optional[str] = None,
+                               lead_state: Optional[LeadCollectionState] = None, prefix_keys: Optional[List[str]] = None) -> Dict:
         """Implements retry logic for API calls"""
         retries = 0
         last_error = None
         
-        print("DIAGNOSTIC: Starting chat processing")
+        print(f"DIAGNOSTIC: Starting chat processing (request {tracing.current_request_id()})")
         
         while retries < self.max_retries:
             try:
                 print(f"DIAGNOSTIC: Attempt {retries+1} - Starting API call")
-                result = self._process_chat(user_message, conversation_history)
+                with tracing.span("llm.attempt", attempt=retries + 1):
+                    result = await self._process_chat(user_message, conversation_history, conversation_id,
+                                                      lead_state, prefix_keys)
                 print("DIAGNOSTIC: API call successful")
                 return result
+            except CircuitOpenError:
+                print("DIAGNOSTIC: OpenAI circuit is open, skipping remaining attempts")
+                break
             except Exception as e:
                 retries += 1
                 last_error = str(e)
@@ -185,66 +380,193 @@ class LeadCaptureAgent:
                 if retries < self.max_retries:
                     sleep_time = self.retry_delay * (2 ** (retries - 1))
                     print(f"DIAGNOSTIC: Retrying in {sleep_time} seconds...")
-                    time.sleep(sleep_time)
+                    metrics.OPENAI_RETRIES.inc()
+                    await asyncio.sleep(sleep_time)
         
         print(f"DIAGNOSTIC: All retries failed. Last error: {last_error}")
         return {
-            "message": f"I'm sorry, I'm having trouble connecting right now. Please try again later.",
+            "message": CONNECTION_ERROR_MESSAGE,
             "captured_lead_info": None
         }
     
-    def _process_chat(self, user_message: str, conversation_history: List[Any] = None) -> Dict:
-        """Core chat processing logic"""
-        if conversation_history is None:
-            conversation_history = []
-        
-        # Prepare the messages for the OpenAI API
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    async def chat_stream(self, user_message: str, conversation_history: List[Any] = None, conversation_id: Optional[str] = None) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Stream a response token by token, holding back any [LEAD_INFO] trailer.
         
-        # Add conversation history - convert ChatMessage objects to dictionaries if needed
-        for msg in conversation_history:
-            # Check if it's already a dict or if it's a ChatMessage object
-            if isinstance(msg, dict):
-                messages.append(msg)
-            else:
-                # Convert ChatMessage to dict (assuming it has role and content attributes)
-                messages.append({"role": msg.role, "content": msg.content})
-        
-        # Add the latest user message
-        messages.append({"role": "user", "content": user_message})
-        
-        # Analyze current conversation to determine what information we already have
-        collected_info = self._analyze_conversation(conversation_history)
-        
-        # Create a reminder for the model about what information still needs to be collected
-        reminder_prompt = self._create_collection_reminder(collected_info)
-        if reminder_prompt:
-            messages.append({
-                "role": "system", 
-                "content": reminder_prompt
-            })
-        
-        # Add a special instruction to extract lead info
-        extract_info_prompt = """
-        After responding to the user, extract any lead information you've gathered in this conversation.
-        If you've identified any of the following, include them in JSON format:
-        - name
-        - email
-        - phone
-        - interests
-        
-        Format it as: [LEAD_INFO]{"name": "...", "email": "...", "phone": "...", "interests": "..."}[/LEAD_INFO]
-        Only include fields where you have information. Place this at the very end of your response, 
-        separate from your regular message.
+        Yields (event, data) tuples:
+            ("token", {"content": ...})     - visible text as it arrives
+            ("lead_info", {...} or None)    - lead information found so far, once the reply is complete
+            ("done", {"message": ..., "path": ..., "lead_state": ...})  - the full visible reply,
+                                                the path that answered it and the lead state, as in chat()
         """
+        conversation_history = conversation_history or []
+        lead_state, prefix_keys = self._resolve_turn(conversation_history, conversation_id)
+        
+        routed = self._route_intent(user_message, conversation_history, conversation_id, lead_state)
+        if routed is not None:
+            metrics.CHAT_TURNS.labels("intent").inc()
+            yield "token", {"content": routed["message"]}
+            yield "lead_info", routed["captured_lead_info"]
+            yield "done", {"message": routed["message"], "path": "intent", "lead_state": lead_state}
+            return
+        
+        cache_key = self._response_cache_key(user_message, conversation_history, conversation_id, lead_state)
+        cached_message = self.response_cache.get(cache_key) if cache_key else None
+        if cached_message is not None:
+            metrics.CHAT_TURNS.labels("cache").inc()
+            yield "token", {"content": cached_message}
+            yield "lead_info", self._local_lead_info(user_message, conversation_history, conversation_id, lead_state) or None
+            yield "done", {"message": cached_message, "path": "cache", "lead_state": lead_state}
+            return
+        
+        stream = await self._open_stream_with_retry(user_message, conversation_history, conversation_id,
+                                                    lead_state, prefix_keys)
+        
+        if stream is None:
+            # Every attempt failed before the first token, answer from the fallback system
+            print("DIAGNOSTIC: Using fallback response system")
+            metrics.CHAT_TURNS.labels("fallback").inc()
+            with tracing.span("fallback"):
+                fallback_response = self._get_fallback_response(user_message, conversation_history, conversation_id, lead_state)
+            yield "token", {"content": fallback_response["message"]}
+            yield "lead_info", fallback_response["captured_lead_info"]
+            yield "done", {"message": fallback_response["message"], "path": "fallback", "lead_state": lead_state}
+            return
+        
+        metrics.CHAT_TURNS.labels("llm").inc()
+        lead_filter = LeadInfoStreamFilter()
+        stream_completed = False
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    # The usage-only chunk sent last when include_usage is set
+                    self._report_usage(getattr(chunk, "usage", None))
+                    continue
+                content = chunk.choices[0].delta.content
+                if not content:
+                    continue
+                visible = lead_filter.feed(content)
+                if visible:
+                    yield "token", {"content": visible}
+            stream_completed = True
+        except Exception as e:
+            # Tokens already sent can't be retried, so finish with what we have
+            print(f"DIAGNOSTIC: Stream interrupted: {str(e)}")
+        finally:
+            await stream.close()
+
+        visible = lead_filter.close()
+        if visible:
+            yield "token", {"content": visible}
+        
+        message = lead_filter.message.strip()
+        if cache_key and message and stream_completed:
+            self.response_cache.put(cache_key, message)
+        
+        lead_info = lead_filter.lead_info or self._local_lead_info(user_message, conversation_history, conversation_id, lead_state) or None
+        yield "lead_info", lead_info
+        yield "done", {"message": message, "path": "llm", "lead_state": lead_state}
+    
+    async def _open_stream_with_retry(self, user_message: str, conversation_history: List[Any] = None, conversation_id: Optional[str] = None,
+                                      lead_state: Optional[LeadCollectionState] = None, prefix_keys: Optional[List[str]] = None):
+        """Open a streaming completion, retrying with the same backoff as _chat_with_retry"""
+        messages = self._build_messages(user_message, conversation_history, conversation_id, lead_state, prefix_keys)
         
-        messages.append({
-            "role": "system", 
-            "content": extract_info_prompt
-        })
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                print(f"DIAGNOSTIC: Attempt {attempt} - Opening completion stream")
+                with tracing.span("llm.attempt", attempt=attempt):
+                    return await self._create_completion(
+                        model=self.model,
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=800,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+            except CircuitOpenError:
+                print("DIAGNOSTIC: OpenAI circuit is open, skipping remaining attempts")
+                break
+            except Exception as e:
+                print(f"DIAGNOSTIC: Stream error: {str(e)}")
+                print(f"DIAGNOSTIC: Error type: {type(e).__name__}")
+                if attempt < self.max_retries:
+                    sleep_time = self.retry_delay * (2 ** (attempt - 1))
+                    print(f"DIAGNOSTIC: Retrying in {sleep_time} seconds...")
+                    metrics.OPENAI_RETRIES.inc()
+                    await asyncio.sleep(sleep_time)
+        
+        print("DIAGNOSTIC: All stream attempts failed")
+        return None
+    
+    def _build_messages(self, user_message: str, conversation_history: List[Any] = None, conversation_id: Optional[str] = None,
+                        lead_state: Optional[LeadCollectionState] = None, prefix_keys: Optional[List[str]] = None) -> List[Dict]:
+        """Assemble the message list sent to the OpenAI API"""
+        started = time.perf_counter()
+        with tracing.span("prompt_build", history_messages=len(conversation_history or [])) as build_span:
+            if conversation_history is None:
+                conversation_history = []
+        
+            # Analyze current conversation to determine what information we already have
+            if lead_state is None:
+                lead_state = self._get_lead_state(conversation_history, conversation_id, prefix_keys)
+            collected_info = dict(lead_state.collected)
+        
+            # Static prefix, then the conversation, then this turn; see PromptBuilder
+            window = self.history_manager.build_window(
+                conversation_history, lead_state.values(), conversation_id, prefix_keys
+            )
+            messages = self.prompt_builder.build(window, user_message, collected_info)
+            
+            if build_span.recording:
+                build_span.set_attribute("messages", len(messages))
+                build_span.set_attribute("static_prefix_tokens", self.prompt_builder.prefix.tokens)
+                build_span.set_attribute("estimated_prompt_tokens", self.prompt_builder.count_tokens(messages))
+        metrics.PROMPT_ASSEMBLY.observe(time.perf_counter() - started)
+        return messages
+    
+    async def _create_completion(self, **kwargs):
+        """Call the chat completions API through the circuit breaker"""
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("OpenAI circuit is open")
+        started = time.monotonic()
+        try:
+            with tracing.span("openai.chat_completion", model=kwargs.get("model"), stream=bool(kwargs.get("stream"))) as call_span:
+                response = await self.client.chat.completions.create(**kwargs)
+                self._report_usage(getattr(response, "usage", None), call_span)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            elapsed = time.monotonic() - started
+            self.breaker.record_failure(elapsed)
+            metrics.LLM_CALL.observe(elapsed)
+            raise
+        elapsed = time.monotonic() - started
+        self.breaker.record_success(elapsed)
+        # For streams this is the time to open the stream; usage arrives with the last chunk
+        metrics.LLM_CALL.observe(elapsed)
+        return response
+    
+    def _report_usage(self, usage, call_span=tracing.NOOP_SPAN):
+        """Record a response's token usage, split into prompt tokens served from the provider's cache and the rest"""
+        if usage is None:
+            return
+        cached, uncached = metrics.record_usage(usage)
+        call_span.set_attribute("prompt_tokens", usage.prompt_tokens)
+        call_span.set_attribute("cached_prompt_tokens", cached)
+        call_span.set_attribute("uncached_prompt_tokens", uncached)
+        call_span.set_attribute("completion_tokens", usage.completion_tokens)
+        print(f"DIAGNOSTIC: Prompt tokens {usage.prompt_tokens} ({cached} cached, {uncached} uncached), "
+              f"completion tokens {usage.completion_tokens}")
+    
+    async def _process_chat(self, user_message: str, conversation_history: List[Any] = None, conversation_id: Optional[str] = None,
+                            lead_state: Optional[LeadCollectionState] = None, prefix_keys: Optional[List[str]] = None) -> Dict:
+        """Core chat processing logic"""
+        messages = self._build_messages(user_message, conversation_history, conversation_id, lead_state, prefix_keys)
         
         # Get response from OpenAI
-        response = self.client.chat.completions.create(
+        response = await self._create_completion(
             model=self.model,
             messages=messages,
             temperature=0.7,
@@ -252,151 +574,171 @@ class LeadCaptureAgent:
         )
         
         # Extract the assistant's message
+        parse_started = time.perf_counter()
         assistant_message = response.choices[0].message.content
         
-        # Extract lead info JSON if present
-        lead_info = None
-        pattern = r'\[LEAD_INFO\](.*?)\[\/LEAD_INFO\]'
-        match = re.search(pattern, assistant_message, re.DOTALL)
-        
-        if match:
-            try:
-                lead_info_str = match.group(1)
-                lead_info = json.loads(lead_info_str)
-                # Remove the lead info section from the response
-                assistant_message = re.sub(pattern, '', assistant_message, flags=re.DOTALL).strip()
-            except json.JSONDecodeError:
-                lead_info = None
+        with tracing.span("lead_parse") as parse_span:
+            # Extract lead info JSON if present
+            lead_info = None
+            match = LEAD_INFO_PATTERN.search(assistant_message)
+            
+            if match:
+                try:
+                    lead_info_str = match.group(1)
+                    lead_info = json.loads(lead_info_str)
+                    # Remove the lead info section from the response
+                    assistant_message = LEAD_INFO_PATTERN.sub('', assistant_message).strip()
+                except json.JSONDecodeError:
+                    lead_info = None
+            parse_span.set_attribute("lead_info", lead_info is not None)
+        metrics.LEAD_PARSE.observe(time.perf_counter() - parse_started)
         
         return {
             "message": assistant_message,
             "captured_lead_info": lead_info
         }
     
-    def _analyze_conversation(self, conversation_history: List[Any]) -> Dict[str, bool]:
-        """Analyze conversation history to determine what lead information has already been collected"""
-        collected_info = {
-            "name": False,
-            "email": False,
-            "phone": False,
-            "interests": False
-        }
+    async def extract_lead_info(self, user_message: str, assistant_message: str,
+                                conversation_history: List[Any] = None, conversation_id: Optional[str] = None,
+                                lead_state: Optional[LeadCollectionState] = None) -> Dict:
+        """
+        Extract lead information for a completed turn as a separate, cheap JSON-mode call.
         
-        # Simple pattern matching for each type of information
-        name_patterns = [r'\b[A-Z][a-z]+ [A-Z][a-z]+\b', r'My name is ([A-Za-z ]+)', r'I\'m ([A-Za-z ]+)', r'call me ([A-Za-z ]+)']
-        email_patterns = [r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b']
-        phone_patterns = [r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b', r'\b\+\d{1,3}[-.]?\d{3}[-.]?\d{3}[-.]?\d{4}\b']
+        Meant to run in the background after the reply has been sent. Only the
+        details known so far and the latest exchange are sent, so the cost stays
+        flat as the conversation grows. Falls back to the local pattern scan if the
+        API call fails. Pass the lead_state chat() returned for the turn, so the history
+        isn't scanned again.
+        """
+        local_info = self._local_lead_info(user_message, conversation_history, conversation_id, lead_state)
+        
+        # The assistant question the user was answering gives short replies their meaning
+        previous_question = ""
+        for msg in reversed(conversation_history or []):
+            role, content = message_parts(msg)
+            if role == "assistant":
+                previous_question = content
+                break
+        
+        excerpt = (
+            f"KNOWN: {json.dumps(local_info)}\n\n"
+            f"Assistant: {previous_question}\n"
+            f"Visitor: {user_message}\n"
+            f"Assistant: {assistant_message}"
+        )
         
-        # Check for captured lead info in previous assistant messages
-        for msg in conversation_history:
-            content = ""
-            if isinstance(msg, dict):
-                content = msg.get("content", "")
-            else:
-                content = msg.content if hasattr(msg, "content") else ""
-            
-            # Check for lead info patterns in user messages
-            if isinstance(msg, dict) and msg.get("role") == "user" or (hasattr(msg, "role") and msg.role == "user"):
-                for pattern in name_patterns:
-                    if re.search(pattern, content):
-                        collected_info["name"] = True
-                        break
-                
-                for pattern in email_patterns:
-                    if re.search(pattern, content):
-                        collected_info["email"] = True
-                        break
-                        
-                for pattern in phone_patterns:
-                    if re.search(pattern, content):
-                        collected_info["phone"] = True
-                        break
-            
-            # Check if "interests" is mentioned in content
-            if "interest" in content.lower() or "program" in content.lower():
-                collected_info["interests"] = True
-            
-            # Check for [LEAD_INFO] sections in assistant messages
-            if isinstance(msg, dict) and msg.get("role") == "assistant" or (hasattr(msg, "role") and msg.role == "assistant"):
-                pattern = r'\[LEAD_INFO\](.*?)\[\/LEAD_INFO\]'
-                match = re.search(pattern, content, re.DOTALL)
-                if match:
-                    try:
-                        lead_info_str = match.group(1)
-                        lead_info = json.loads(lead_info_str)
-                        if lead_info.get("name"):
-                            collected_info["name"] = True
-                        if lead_info.get("email"):
-                            collected_info["email"] = True
-                        if lead_info.get("phone"):
-                            collected_info["phone"] = True
-                        if lead_info.get("interests"):
-                            collected_info["interests"] = True
-                    except json.JSONDecodeError:
-                        pass
-        
-        return collected_info
+        try:
+            response = await self._create_completion(
+                model=self.model,
+                messages=[
+                    self.extraction_prompt.message,
+                    {"role": "user", "content": excerpt}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0,
+                max_tokens=150
+            )
+            extracted = json.loads(response.choices[0].message.content or "{}")
+        except Exception as e:
+            print(f"DIAGNOSTIC: Lead extraction failed, using local scan: {str(e)}")
+            return local_info
+        
+        lead_info = dict(local_info)
+        if isinstance(extracted, dict):
+            for field in LEAD_FIELDS:
+                value = extracted.get(field)
+                if isinstance(value, str) and value.strip():
+                    lead_info[field] = value.strip()
+        return lead_info
     
-    def _create_collection_reminder(self, collected_info: Dict[str, bool]) -> str:
-        """Create a reminder prompt based on what information still needs to be collected"""
-        missing_info = []
-        
-        if not collected_info["name"]:
-            missing_info.append("name (try to ask for their name naturally)")
-        if not collected_info["email"]:
-            missing_info.append("email address (ask when discussing updates or newsletter)")
-        if not collected_info["phone"]:
-            missing_info.append("phone number (ask when discussing volunteer opportunities)")
-        if not collected_info["interests"]:
-            missing_info.append("areas of interest (ask what programs they're most interested in)")
-        
-        if missing_info:
-            reminder = f"""
-Remember to collect the following information in your response if appropriate:
-{', '.join(missing_info)}
-
-Ask for just ONE piece of missing information in your next response, in a natural and conversational way.
-"""
-            return reminder
-        
-        return ""
+    def _route_intent(self, user_message: str, conversation_history: List[Any] = None, conversation_id: Optional[str] = None,
+                      lead_state: Optional[LeadCollectionState] = None) -> Optional[Dict]:
+        """Answer the turn from the intent router's templates if it is confident enough"""
+        if lead_state is None:
+            lead_state = self._get_lead_state(conversation_history, conversation_id)
+        routed = self.intent_router.route(user_message, lead_state)
+        if routed is None:
+            return None
+        print(f"DIAGNOSTIC: Answered by intent router ({routed['intent']}, confidence {routed['confidence']:.2f})")
+        
+        lead_info = self._local_lead_info(user_message, conversation_history, conversation_id, lead_state)
+        if routed["interest"]:
+            interests = lead_info.get("interests")
+            if not interests:
+                lead_info["interests"] = routed["interest"]
+            elif routed["interest"] not in interests:
+                lead_info["interests"] = f"{interests}, {routed['interest']}"
+        return {
+            "message": routed["message"],
+            "captured_lead_info": lead_info or None
+        }
     
-    def _get_fallback_response(self, user_message: str, conversation_history: List[Any] = None) -> Dict:
-        """
-        Generate a fallback response when OpenAI API is unavailable
-        This uses pattern matching to provide basic answers to common questions
-        """
-        user_message = user_message.lower()
+    def _response_cache_key(self, user_message: str, conversation_history: List[Any] = None, conversation_id: Optional[str] = None,
+                            lead_state: Optional[LeadCollectionState] = None) -> Optional[str]:
+        """Response cache key for this turn, None if it must not be cached"""
+        if lead_state is None:
+            lead_state = self._get_lead_state(conversation_history, conversation_id)
+        return self.response_cache.make_key(user_message, conversation_history, lead_state)
+    
+    def _local_lead_info(self, user_message: str, conversation_history: List[Any] = None, conversation_id: Optional[str] = None,
+                         lead_state: Optional[LeadCollectionState] = None) -> Dict:
+        """Lead details found by pattern matching the history and the current message"""
         lead_info = {}
         
-        # Try to extract lead info from conversation
+        # Preserve any lead info we've already collected
         if conversation_history:
-            collected_info = self._analyze_conversation(conversation_history)
-            # Preserve any lead info we've already collected
-            if collected_info["name"]:
-                lead_info["name"] = self._find_name_in_conversation(conversation_history)
-            if collected_info["email"]:
-                lead_info["email"] = self._find_email_in_conversation(conversation_history)
-            if collected_info["phone"]:
-                lead_info["phone"] = self._find_phone_in_conversation(conversation_history)
-            if collected_info["interests"]:
-                lead_info["interests"] = self._find_interests_in_conversation(conversation_history)
+            state = lead_state or self._get_lead_state(conversation_history, conversation_id)
+            lead_info = {field: value for field, value in state.values().items() if value}
         
         # Check for name in the current message
-        name_match = re.search(r'my name is ([A-Za-z ]+)', user_message, re.IGNORECASE)
+        name_match = NAME_VALUE_PATTERN.search(user_message)
         if name_match:
             lead_info["name"] = name_match.group(1)
         
         # Check for email in the current message
-        email_match = re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', user_message)
+        email_match = EMAIL_PATTERN.search(user_message)
         if email_match:
             lead_info["email"] = email_match.group(0)
         
         # Check for phone in the current message
-        phone_match = re.search(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b', user_message)
+        phone_match = PHONE_PATTERNS[0].search(user_message)
         if phone_match:
             lead_info["phone"] = phone_match.group(0)
         
+        # Programs the visitor mentions in the current message
+        programs = match_programs(user_message)
+        if programs:
+            lead_info["interests"] = merge_interests(lead_info.get("interests"), ", ".join(programs))
+        
+        return lead_info
+    
+    def _analyze_conversation(self, conversation_history: List[Any], conversation_id: Optional[str] = None) -> Dict[str, bool]:
+        """Determine what lead information has already been collected in the conversation"""
+        return dict(self._get_lead_state(conversation_history, conversation_id).collected)
+    
+    def _get_lead_state(self, conversation_history: List[Any], conversation_id: Optional[str] = None,
+                        prefix_keys: Optional[List[str]] = None) -> LeadCollectionState:
+        """Cached lead-collection state; only messages added since the last turn are scanned"""
+        return self.lead_states.get_state(conversation_history, conversation_id, prefix_keys)
+    
+    def _resolve_turn(self, conversation_history: List[Any], conversation_id: Optional[str] = None) -> Tuple[LeadCollectionState, Optional[List[str]]]:
+        """
+        Lead state and history prefix keys for a turn, worked out once and passed to
+        every step of it. Without a conversation id the caches are keyed on hashes of
+        the history, so this is the turn's only pass over it.
+        """
+        prefix_keys = history_prefix_keys(conversation_history) if conversation_id is None else None
+        return self._get_lead_state(conversation_history, conversation_id, prefix_keys), prefix_keys
+    
+    def _get_fallback_response(self, user_message: str, conversation_history: List[Any] = None, conversation_id: Optional[str] = None,
+                               lead_state: Optional[LeadCollectionState] = None) -> Dict:
+        """
+        Generate a fallback response when OpenAI API is unavailable
+        This uses pattern matching to provide basic answers to common questions
+        """
+        lead_info = self._local_lead_info(user_message, conversation_history, conversation_id, lead_state)
+        user_message = user_message.lower()
+        
         # Pattern match responses based on user message
         if any(greeting in user_message for greeting in ["hello", "hi", "hey", "greetings"]):
             return {
@@ -463,51 +805,16 @@ Ask for just ONE piece of missing information in your next response, in a natura
     
     def _find_name_in_conversation(self, conversation_history):
         """Extract name from conversation history"""
-        for msg in conversation_history:
-            content = msg.content if hasattr(msg, "content") else msg.get("content", "")
-            if msg.role if hasattr(msg, "role") else msg.get("role", "") == "user":
-                name_match = re.search(r'my name is ([A-Za-z ]+)', content, re.IGNORECASE)
-                if name_match:
-                    return name_match.group(1)
-        return None
+        return LeadCollectionState.from_history(conversation_history).name
     
     def _find_email_in_conversation(self, conversation_history):
         """Extract email from conversation history"""
-        for msg in conversation_history:
-            content = msg.content if hasattr(msg, "content") else msg.get("content", "")
-            if msg.role if hasattr(msg, "role") else msg.get("role", "") == "user":
-                email_match = re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', content)
-                if email_match:
-                    return email_match.group(0)
-        return None
+        return LeadCollectionState.from_history(conversation_history).email
     
     def _find_phone_in_conversation(self, conversation_history):
         """Extract phone from conversation history"""
-        for msg in conversation_history:
-            content = msg.content if hasattr(msg, "content") else msg.get("content", "")
-            if msg.role if hasattr(msg, "role") else msg.get("role", "") == "user":
-                phone_match = re.search(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b', content)
-                if phone_match:
-                    return phone_match.group(0)
-        return None
+        return LeadCollectionState.from_history(conversation_history).phone
     
     def _find_interests_in_conversation(self, conversation_history):
         """Extract interests from conversation history"""
-        interests = []
-        keywords = {
-            "Community Fitness": ["fitness", "exercise", "workout", "bootcamp"],
-            "Whānau Hotaka": ["financial", "finance", "money", "budget", "hotaka"],
-            "Future Wahine": ["wahine", "women", "girl", "female", "young women"],
-            "Positive Pathways": ["youth", "boy", "rangatahi", "risk", "school"],
-            "$20 Boss": ["entrepreneur", "business", "boss", "startup"],
-            "O-Beast": ["health", "weight", "obesity", "nutrition", "gym"]
-        }
-        
-        for msg in conversation_history:
-            content = msg.content.lower() if hasattr(msg, "content") else msg.get("content", "").lower()
-            for program, terms in keywords.items():
-                if any(term in content for term in terms):
-                    if program not in interests:
-                        interests.append(program)
-        
-        return ", ".join(interests) if interests else None 
\ No newline at end of file
+        return LeadCollectionState.from_history(conversation_history).interests
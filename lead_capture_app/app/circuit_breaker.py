@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+# Outcomes older than this no longer count towards the error/slow-call rates
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+# Calls needed in the window before the breaker may trip
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+# Calls slower than this count as slow, and too many slow calls also trip the breaker
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "20"))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("BREAKER_SLOW_CALL_RATE", "0.8"))
+# How long the breaker stays open before letting a probe call through
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_MAX_CALLS = int(os.getenv("BREAKER_HALF_OPEN_MAX_CALLS", "1"))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker over an upstream dependency.
+
+    While closed, outcomes are tracked over a sliding time window; the breaker
+    opens when the error rate or the slow-call rate crosses its threshold. While
+    open, calls are refused so callers can fall back immediately. After
+    BREAKER_OPEN_SECONDS a limited number of probe calls are let through
+    (half-open): a success closes the breaker, a failure opens it again.
+    """
+    def __init__(self, name: str,
+                 window_seconds: float = BREAKER_WINDOW_SECONDS,
+                 min_calls: int = BREAKER_MIN_CALLS,
+                 error_rate: float = BREAKER_ERROR_RATE,
+                 slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+                 slow_call_rate: float = BREAKER_SLOW_CALL_RATE,
+                 open_seconds: float = BREAKER_OPEN_SECONDS,
+                 half_open_max_calls: int = BREAKER_HALF_OPEN_MAX_CALLS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._outcomes = deque()  # (timestamp, failed, slow)
+        self._lock = threading.Lock()
+        self.times_opened = 0
+        self.rejected_calls = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Whether a call may go upstream now; callers must record its outcome"""
+        with self._lock:
+            now = time.monotonic()
+            self._maybe_half_open(now)
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                return True
+            self.rejected_calls += 1
+            return False
+
+    def release(self):
+        """Give back a permitted call that ended without an outcome (e.g. it was cancelled)"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+
+    def record_success(self, latency: float):
+        self._record(failed=False, latency=latency)
+
+    def record_failure(self, latency: float):
+        self._record(failed=True, latency=latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._maybe_half_open(now)
+            self._trim(now)
+            calls = len(self._outcomes)
+            failures = sum(1 for _, failed, _ in self._outcomes if failed)
+            slow = sum(1 for _, _, is_slow in self._outcomes if is_slow)
+            return {
+                "state": self._state,
+                "window_calls": calls,
+                "window_error_rate": round(failures / calls, 4) if calls else 0.0,
+                "window_slow_call_rate": round(slow / calls, 4) if calls else 0.0,
+                "times_opened": self.times_opened,
+                "rejected_calls": self.rejected_calls,
+                "seconds_until_probe": round(max(0.0, self._opened_at + self.open_seconds - now), 1) if self._state == OPEN else 0.0
+            }
+
+    def _record(self, failed: bool, latency: float):
+        with self._lock:
+            now = time.monotonic()
+            slow = latency >= self.slow_call_seconds
+
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                if failed or slow:
+                    self._open(now)
+                else:
+                    print(f"DIAGNOSTIC: Circuit '{self.name}' closed after successful probe")
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                return
+            if self._state == OPEN:
+                # A call that started before the breaker opened; nothing to learn from it
+                return
+
+            self._outcomes.append((now, failed, slow))
+            self._trim(now)
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for _, was_failed, _ in self._outcomes if was_failed)
+            slow_calls = sum(1 for _, _, was_slow in self._outcomes if was_slow)
+            if failures / calls >= self.error_rate or slow_calls / calls >= self.slow_call_rate:
+                self._open(now)
+
+    def _open(self, now: float):
+        print(f"DIAGNOSTIC: Circuit '{self.name}' opened")
+        self._state = OPEN
+        self._opened_at = now
+        self._half_open_in_flight = 0
+        self._outcomes.clear()
+        self.times_opened += 1
+
+    def _maybe_half_open(self, now: float):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._half_open_in_flight = 0
+
+    def _trim(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+# Shared by every request in the process
+openai_breaker = CircuitBreaker("openai")
@@ -0,0 +1,71 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+def message_parts(msg: Any) -> Tuple[str, str]:
+    """Return (role, content) for either a dict or a ChatMessage"""
+    if isinstance(msg, dict):
+        return msg.get("role", ""), msg.get("content", "") or ""
+    return getattr(msg, "role", ""), getattr(msg, "content", "") or ""
+
+def history_prefix_keys(conversation_history: List[Any]) -> List[str]:
+    """Chained hashes of a history: entry i identifies the first i messages"""
+    digest = hashlib.sha1()
+    keys = ["prefix:" + digest.hexdigest()]
+    for msg in conversation_history:
+        role, content = message_parts(msg)
+        digest.update(role.encode("utf-8") + b"\x00" + content.encode("utf-8") + b"\x01")
+        keys.append("prefix:" + digest.copy().hexdigest())
+    return keys
+
+class ConversationCache:
+    """
+    LRU of per-conversation values that each cover the first `message_count`
+    messages of a history.
+
+    Entries are keyed by conversation identity (a session id) when one is known,
+    otherwise by a hash of the history prefix they cover, so stateless clients
+    that resend the full history still hit the previous turn's entry.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def find(self, conversation_history: List[Any], length: int, conversation_id: Optional[str] = None,
+             prefix_keys: Optional[List[str]] = None):
+        """
+        Return (key, value) where key identifies history[:length] and value is the
+        cached entry covering the longest prefix of it, or None. Pass the history's
+        prefix_keys if the caller already has them, to save hashing it again.
+        """
+        if conversation_id is not None:
+            key = f"id:{conversation_id}"
+            value = self._lookup(key)
+            if value is not None and value.message_count > length:
+                value = None
+            return key, value
+
+        if prefix_keys is None:
+            prefix_keys = history_prefix_keys(conversation_history[:length])
+        # Longest cached prefix wins; usually the previous turn's entry
+        for covered in range(length, -1, -1):
+            value = self._lookup(prefix_keys[covered])
+            if value is not None:
+                return prefix_keys[length], value
+        return prefix_keys[length], None
+
+    def store(self, key: str, value: Any):
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def _lookup(self, key: str):
+        with self._lock:
+            value = self._values.get(key)
+            if value is not None:
+                self._values.move_to_end(key)
+            return value
@@ -0,0 +1,73 @@
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, select
+
+from .conversation_cache import message_parts
+from .database import ConversationMessage, dialect_insert, message_row
+
+# Largest page of messages the API will return
+MESSAGE_PAGE_MAX_SIZE = 200
+
+async def append_messages(db, conversation_id: str, messages: List, start_seq: int, skip_existing: bool = True):
+    """
+    Append messages at start_seq onwards. Positions already stored are left alone,
+    or, with skip_existing=False, raise IntegrityError so the caller can retry.
+    """
+    rows = []
+    for offset, msg in enumerate(messages):
+        role, content = message_parts(msg)
+        rows.append(message_row(conversation_id, start_seq + offset, role, content))
+    if rows:
+        if skip_existing:
+            statement = dialect_insert(ConversationMessage).on_conflict_do_nothing(
+                index_elements=[ConversationMessage.conversation_id, ConversationMessage.seq]
+            )
+        else:
+            statement = insert(ConversationMessage)
+        await db.execute(statement, rows)
+
+async def last_message(db, conversation_id: str) -> Tuple[int, Optional[str]]:
+    """Number of stored messages and the content of the last one"""
+    result = await db.execute(
+        select(ConversationMessage.seq, ConversationMessage.content)
+        .where(ConversationMessage.conversation_id == conversation_id)
+        .order_by(ConversationMessage.seq.desc())
+        .limit(1)
+    )
+    row = result.first()
+    if row is None:
+        return 0, None
+    return row.seq + 1, row.content
+
+async def sync_history(db, conversation_id: str, history: List) -> bool:
+    """
+    Bring a stored conversation up to date with a client-held history by
+    appending only the messages it doesn't have yet. Returns False, writing
+    nothing, if the stored conversation is not a prefix of the history.
+    """
+    stored_count, stored_last = await last_message(db, conversation_id)
+    if stored_count > len(history):
+        return False
+    if stored_count and message_parts(history[stored_count - 1])[1] != stored_last:
+        return False
+    await append_messages(db, conversation_id, history[stored_count:], stored_count)
+    return True
+
+async def load_messages(db, conversation_id: str, start_seq: int = 0) -> List[Dict]:
+    """Messages from position start_seq onwards, in order"""
+    result = await db.execute(
+        select(ConversationMessage.role, ConversationMessage.content)
+        .where(ConversationMessage.conversation_id == conversation_id, ConversationMessage.seq >= start_seq)
+        .order_by(ConversationMessage.seq)
+    )
+    return [{"role": role, "content": content} for role, content in result.all()]
+
+def message_page_query(conversation_id: str, after_seq: int, limit: int):
+    """Messages after `after_seq`, in order; one extra row tells the caller there is more"""
+    return (
+        select(ConversationMessage.seq, ConversationMessage.role, ConversationMessage.content,
+               ConversationMessage.token_count, ConversationMessage.created_at)
+        .where(ConversationMessage.conversation_id == conversation_id, ConversationMessage.seq > after_seq)
+        .order_by(ConversationMessage.seq)
+        .limit(limit + 1)
+    )
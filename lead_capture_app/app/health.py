@@ -0,0 +1,122 @@
+import asyncio
+import os
+import time
+import traceback
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+
+from .database import async_engine
+
+# How often each dependency is checked in the background
+HEALTH_DB_INTERVAL_SECONDS = float(os.getenv("HEALTH_DB_INTERVAL_SECONDS", "10"))
+HEALTH_OPENAI_INTERVAL_SECONDS = float(os.getenv("HEALTH_OPENAI_INTERVAL_SECONDS", "60"))
+# A single check taking longer than this counts as failed
+HEALTH_CHECK_TIMEOUT_SECONDS = float(os.getenv("HEALTH_CHECK_TIMEOUT_SECONDS", "5"))
+# A result older than this many intervals means the prober itself is stuck
+HEALTH_STALE_INTERVALS = 3
+
+class DependencyCheck:
+    """Latest result of one background health check"""
+    def __init__(self, name: str, check: Callable[[], Awaitable[Optional[str]]], interval: float, required: bool):
+        self.name = name
+        self.check = check
+        self.interval = interval
+        self.required = required
+        self.healthy = False
+        self.detail = "not checked yet"
+        self.checked_at = None  # time.monotonic() of the last result
+        self.checked_at_wall = None
+        self.latency_ms = None
+
+    @property
+    def fresh(self) -> bool:
+        return self.checked_at is not None and time.monotonic() - self.checked_at <= self.interval * HEALTH_STALE_INTERVALS
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy and self.fresh,
+            "required": self.required,
+            "detail": self.detail if self.fresh or self.checked_at is None else f"stale: {self.detail}",
+            "checked_at": self.checked_at_wall,
+            "latency_ms": self.latency_ms
+        }
+
+class HealthProber:
+    """
+    Keeps the status of the app's dependencies up to date in the background.
+
+    Each check runs on its own interval with a timeout, and probes only read the
+    stored results, so /livez and /readyz cost microseconds however often the
+    load balancer calls them. The app is ready once every required check has a
+    fresh, passing result.
+    """
+    def __init__(self):
+        self.checks = {}  # name -> DependencyCheck
+        self._tasks = []
+        self._stopping = None
+
+    def add_check(self, name: str, check: Callable[[], Awaitable[Optional[str]]], interval: float, required: bool = True):
+        """Register a coroutine function that raises, or returns an optional detail string, when called"""
+        self.checks[name] = DependencyCheck(name, check, interval, required)
+
+    def start(self):
+        if not self._tasks:
+            self._stopping = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._run(dependency)) for dependency in self.checks.values()]
+
+    async def stop(self):
+        if not self._tasks:
+            return
+        # The event ends the loops even if a cancel lands as a check completes and is lost
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def ready(self) -> bool:
+        return all(dependency.healthy and dependency.fresh
+                   for dependency in self.checks.values() if dependency.required)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: dependency.snapshot() for name, dependency in self.checks.items()}
+
+    async def run_check(self, dependency: DependencyCheck):
+        started = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(dependency.check(), timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+            healthy = True
+        except asyncio.TimeoutError:
+            detail = f"timed out after {HEALTH_CHECK_TIMEOUT_SECONDS}s"
+            healthy = False
+        except Exception as e:
+            detail = f"error: {str(e)}"
+            healthy = False
+        if healthy != dependency.healthy and dependency.checked_at is not None:
+            print(f"DIAGNOSTIC: Health check {dependency.name} is now {'healthy' if healthy else 'failing'} ({detail or 'ok'})")
+        dependency.healthy = healthy
+        dependency.detail = detail or "healthy"
+        dependency.latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        dependency.checked_at = time.monotonic()
+        dependency.checked_at_wall = time.time()
+
+    async def _run(self, dependency: DependencyCheck):
+        while not self._stopping.is_set():
+            try:
+                await self.run_check(dependency)
+            except Exception as e:
+                print(f"DIAGNOSTIC: Health check {dependency.name} crashed: {str(e)}")
+                print(traceback.format_exc())
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=dependency.interval)
+            except asyncio.TimeoutError:
+                pass
+
+async def check_database() -> Optional[str]:
+    async with async_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+    return None
+
+health_prober = HealthProber()
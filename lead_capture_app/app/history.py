@@ -0,0 +1,173 @@
+import os
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from .conversation_cache import ConversationCache, message_parts
+from .lead_state import LEAD_INFO_PATTERN
+
+# Token budget for the conversation history sent with each request (system prompt excluded)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+# Budget for the rolling summary of older turns, taken out of the history budget
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "400"))
+# Most recent messages that are always sent verbatim, whatever the budget
+MIN_RECENT_MESSAGES = int(os.getenv("MIN_RECENT_MESSAGES", "4"))
+# The summary/verbatim split moves in steps of this many messages, so the summary and the
+# messages after it stay the same (and provider-cacheable) for several turns at a time
+SUMMARY_BLOCK_MESSAGES = int(os.getenv("SUMMARY_BLOCK_MESSAGES", "8"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "5000"))
+
+# Fixed per-message overhead of the chat format (role and separators)
+MESSAGE_TOKEN_OVERHEAD = 4
+# Longest excerpt of a single message kept in the summary
+SUMMARY_LINE_CHARS = 160
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+# tiktoken is optional; without it we fall back to the ~4 characters per token rule of thumb
+_encoding = None
+_encoding_loaded = False
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        except Exception as e:
+            print(f"DIAGNOSTIC: tiktoken unavailable ({type(e).__name__}), estimating token counts")
+    return _encoding
+
+@lru_cache(maxsize=20000)
+def count_tokens(text: str) -> int:
+    """Token count of a piece of text, cached so repeated messages are only counted once"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+def count_message_tokens(msg: Any) -> int:
+    role, content = message_parts(msg)
+    return count_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+
+@lru_cache(maxsize=20000)
+def summarize_message(role: str, content: str) -> str:
+    """One-line excerpt of a message: its first sentence, clipped"""
+    text = LEAD_INFO_PATTERN.sub("", content)
+    text = " ".join(text.split())
+    text = SENTENCE_END.split(text, 1)[0]
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS - 3].rstrip() + "..."
+    speaker = "User" if role == "user" else "Assistant"
+    return f"{speaker}: {text}"
+
+class RollingSummary:
+    """Summary lines for the first `message_count` messages, oldest dropped beyond the budget"""
+    def __init__(self, token_budget: int):
+        self.token_budget = token_budget
+        self.message_count = 0
+        self.lines = deque()
+        self.tokens = 0
+
+    def copy(self) -> "RollingSummary":
+        summary = RollingSummary(self.token_budget)
+        summary.message_count = self.message_count
+        summary.lines = deque(self.lines)
+        summary.tokens = self.tokens
+        return summary
+
+    def update(self, messages: List[Any]):
+        for msg in messages:
+            role, content = message_parts(msg)
+            self.message_count += 1
+            if role not in ("user", "assistant") or not content.strip():
+                continue
+            line = summarize_message(role, content)
+            line_tokens = count_tokens(line) + 1
+            self.lines.append((line, line_tokens))
+            self.tokens += line_tokens
+            while self.tokens > self.token_budget and self.lines:
+                _, dropped = self.lines.popleft()
+                self.tokens -= dropped
+
+    def text(self) -> str:
+        return "\n".join(line for line, _ in self.lines)
+
+class HistoryManager:
+    """
+    Fits the conversation history into a token budget.
+
+    The most recent messages are sent verbatim; older ones are folded into a
+    rolling summary that is cached per conversation, and lead details already
+    captured are pinned into the summary message so they are never lost. The
+    split between the two only moves in blocks of summary_block messages, so
+    between moves the window grows at the end like the conversation does.
+    """
+    def __init__(self, token_budget: int = HISTORY_TOKEN_BUDGET,
+                 summary_budget: int = SUMMARY_TOKEN_BUDGET,
+                 min_recent: int = MIN_RECENT_MESSAGES,
+                 summary_block: int = SUMMARY_BLOCK_MESSAGES):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.min_recent = min_recent
+        self.summary_block = max(1, summary_block)
+        self.summaries = ConversationCache(SUMMARY_CACHE_SIZE)
+
+    def build_window(self, conversation_history: List[Any], lead_values: Optional[Dict[str, Optional[str]]] = None,
+                     conversation_id: Optional[str] = None, prefix_keys: Optional[List[str]] = None) -> List[Dict]:
+        """Return the messages to send in place of the full history"""
+        conversation_history = conversation_history or []
+        split = self._split_point(conversation_history)
+
+        window = []
+        if split > 0:
+            summary = self._get_summary(conversation_history, split, conversation_id, prefix_keys)
+            window.append({"role": "system", "content": self._summary_message(summary, lead_values)})
+
+        for msg in conversation_history[split:]:
+            if isinstance(msg, dict):
+                window.append(msg)
+            else:
+                window.append({"role": msg.role, "content": msg.content})
+        return window
+
+    def _split_point(self, conversation_history: List[Any]) -> int:
+        """Index of the first message sent verbatim"""
+        counts = [count_message_tokens(msg) for msg in conversation_history]
+        if sum(counts) <= self.token_budget:
+            # Everything fits, no need to summarize
+            return 0
+
+        recent_budget = self.token_budget - self.summary_budget
+        total = 0
+        split = len(counts)
+        while split > 0:
+            tokens = counts[split - 1]
+            if total + tokens > recent_budget and len(counts) - split >= self.min_recent:
+                break
+            total += tokens
+            split -= 1
+        # Summarize up to the next block boundary, which later turns will share; unless
+        # that would leave fewer than min_recent messages verbatim
+        boundary = -(-split // self.summary_block) * self.summary_block
+        if boundary <= len(counts) - self.min_recent:
+            return boundary
+        return split
+
+    def _get_summary(self, conversation_history: List[Any], split: int, conversation_id: Optional[str],
+                     prefix_keys: Optional[List[str]] = None) -> RollingSummary:
+        key, cached = self.summaries.find(conversation_history, split, conversation_id, prefix_keys)
+        summary = cached.copy() if cached is not None else RollingSummary(self.summary_budget)
+        summary.update(conversation_history[summary.message_count:split])
+        self.summaries.store(key, summary)
+        return summary
+
+    def _summary_message(self, summary: RollingSummary, lead_values: Optional[Dict[str, Optional[str]]]) -> str:
+        parts = ["Summary of the earlier conversation (older messages are not shown):", summary.text()]
+        pinned = [f"- {field}: {value}" for field, value in (lead_values or {}).items() if value]
+        if pinned:
+            parts.append("Lead details already captured:")
+            parts.extend(pinned)
+        return "\n".join(parts)
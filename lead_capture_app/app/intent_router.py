@@ -0,0 +1,253 @@
+import os
+import re
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from .lead_state import LeadCollectionState, mentions_name
+from .response_cache import contains_personal_data
+
+# Set INTENT_ROUTER_ENABLED=false to send every turn to the model
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+# Minimum confidence before a turn is answered from a template
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.75"))
+# Comma-separated intent names to switch off, e.g. "donation,greeting"
+INTENT_ROUTER_DISABLED_INTENTS = {
+    name.strip() for name in os.getenv("INTENT_ROUTER_DISABLED_INTENTS", "").split(",") if name.strip()
+}
+# Longer messages are usually real questions, which the model handles better
+INTENT_MAX_WORDS = int(os.getenv("INTENT_MAX_WORDS", "20"))
+
+# "I don't want to donate" must not get the donation pitch; negated turns go to the model
+NEGATION_PATTERN = re.compile(
+    r"\b(?:no|not|never|don't|dont|doesn't|won't|can't|cannot|stop|quit|unsubscribe|rather not)\b"
+)
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over a fixed keyword list.
+
+    Built once; find() reports every keyword occurrence in a single pass over
+    the text, however many keywords there are.
+    """
+    def __init__(self, keywords: List[str]):
+        self.keywords = keywords
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for index, keyword in enumerate(keywords):
+            state = 0
+            for char in keyword:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state].append(index)
+
+        # Breadth-first pass to fill in failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> List[Tuple[int, int, int]]:
+        """Return (start, end, keyword_index) for every occurrence"""
+        matches = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for index in self._output[state]:
+                end = position + 1
+                matches.append((end - len(self.keywords[index]), end, index))
+        return matches
+
+class Intent:
+    """An FAQ intent: trigger keywords with weights and a templated answer"""
+    def __init__(self, name: str, keywords: Dict[str, float], template: str,
+                 asks: Tuple[str, ...] = ("name", "email"), interest: Optional[str] = None,
+                 max_words: Optional[int] = None):
+        self.name = name
+        self.keywords = keywords
+        self.template = template
+        self.asks = asks  # Lead fields to ask for, in order of preference
+        self.interest = interest  # Program recorded as an interest when this intent fires
+        self.max_words = max_words
+
+# Follow-up questions, matching the collection strategies in SYSTEM_PROMPT
+FOLLOW_UPS = {
+    "name": "May I know your name so I can address you properly?",
+    "email": "Would you like to receive updates about our programs? I'd be happy to add your email to our newsletter.",
+    "phone": "For volunteer opportunities, we can keep you updated via text. Would you mind sharing your phone number?",
+    "interests": "Which of our programs interests you the most?"
+}
+DEFAULT_FOLLOW_UP = "Is there anything else you'd like to know about our programs or how you can get involved?"
+
+INTENTS = [
+    Intent(
+        "greeting",
+        {"hi": 1.0, "hello": 1.0, "hey": 1.0, "kia ora": 1.0, "greetings": 1.0, "good morning": 1.0, "good afternoon": 1.0},
+        "Kia ora! I'm here to tell you about Kura Cares Charity and how we support Māori and Pacific communities in South Auckland. {follow_up}",
+        asks=("name",),
+        max_words=4
+    ),
+    Intent(
+        "program_list",
+        {"what programs": 1.0, "which programs": 1.0, "what programmes": 1.0, "which programmes": 1.0,
+         "programs do you offer": 1.0, "programmes do you offer": 1.0, "what services": 1.0,
+         "what do you offer": 1.0, "programs": 0.5, "programmes": 0.5, "services": 0.4, "offer": 0.3},
+        "We offer several free programs: Community Fitness (seasonal boot camps), Whānau Hotaka (financial literacy), Future Wahine (mentorship for young wahine aged 15-18), Positive Pathways (youth mentoring), $20 Boss (entrepreneurship for rangatahi) and O-Beast (a 10-week health journey). {follow_up}",
+        asks=("interests", "name")
+    ),
+    Intent(
+        "donation",
+        {"donate": 1.0, "donation": 1.0, "donations": 1.0, "donating": 1.0, "make a gift": 1.0, "give money": 1.0,
+         "support": 0.3},
+        "Thank you for your interest in supporting Kura Cares! Your donations help us make a real difference in our communities. {follow_up}",
+        asks=("email", "name")
+    ),
+    Intent(
+        "volunteer",
+        {"volunteer": 1.0, "volunteering": 1.0, "get involved": 0.8, "help out": 0.6, "join": 0.4},
+        "We appreciate your interest in volunteering with Kura Cares! Volunteers are essential to our mission, and we have opportunities across our programs. {follow_up}",
+        asks=("phone", "name")
+    ),
+    Intent(
+        "program_community_fitness",
+        {"community fitness": 1.0, "boot camp": 0.8, "bootcamp": 0.8, "fitness programme": 1.0, "fitness program": 1.0},
+        "Our Community Fitness Programme offers free seasonal boot camps in Papakura, Manurewa and Henderson, run with Auckland Council and local boards. Sessions are open to all fitness levels and bring whānau together to embrace Hauora through exercise. {follow_up}",
+        asks=("email", "name"),
+        interest="Community Fitness"
+    ),
+    Intent(
+        "program_whanau_hotaka",
+        {"whānau hotaka": 1.0, "whanau hotaka": 1.0, "hotaka": 1.0, "financial literacy": 0.8},
+        "Whānau Hotaka is our free 12-week financial well-being course, equipping whānau in Papakura and South Auckland with essential financial skills. It's also available through the Whānau Hotaka Online App/Portal anywhere in Aotearoa. {follow_up}",
+        asks=("email", "name"),
+        interest="Whānau Hotaka"
+    ),
+    Intent(
+        "program_future_wahine",
+        {"future wahine": 1.0, "wahine": 0.8},
+        "Our Future Wahine Programme supports young wahine aged 15-18 with mentorship that fosters leadership, resilience and well-being, including help with challenges like anxiety and depression. It has supported over 40 wahine so far and is working towards NCEA accreditation. {follow_up}",
+        asks=("name", "email"),
+        interest="Future Wahine"
+    ),
+    Intent(
+        "program_positive_pathways",
+        {"positive pathways": 1.0},
+        "Positive Pathways mentors at-risk rangatahi, especially boys who may be struggling in school, with practical skills, guidance and holistic support to build confidence. It is working towards NCEA accreditation. {follow_up}",
+        asks=("name", "email"),
+        interest="Positive Pathways"
+    ),
+    Intent(
+        "program_20_boss",
+        {"$20 boss": 1.0, "20 boss": 1.0},
+        "The $20 Boss Program empowers young people with entrepreneurial skills, with a focus on leadership and financial literacy to shape future success for rangatahi. {follow_up}",
+        asks=("name", "email"),
+        interest="$20 Boss"
+    ),
+    Intent(
+        "program_o_beast",
+        {"o-beast": 1.0, "obeast": 1.0, "o beast": 1.0},
+        "O-Beast is a free 10-week journey for South Aucklanders weighing over 150kg, with gym access, nutrition support and a strong community. It has helped people quit vaping, overcome struggles and even prevent suicide. {follow_up}",
+        asks=("name", "phone"),
+        interest="O-Beast"
+    ),
+]
+
+class IntentRouter:
+    """
+    Answers high-confidence FAQ turns from templates before the model is called.
+
+    All intent keywords are compiled into one automaton at startup, so routing
+    is a single pass over the message. Ambiguous, long or negated turns, and
+    turns where the visitor gives their name or contact details, go to the
+    model as usual.
+    """
+    def __init__(self, intents: List[Intent] = None, threshold: float = INTENT_CONFIDENCE_THRESHOLD,
+                 enabled: bool = INTENT_ROUTER_ENABLED, disabled_intents=None):
+        intents = INTENTS if intents is None else intents
+        if disabled_intents is None:
+            disabled_intents = INTENT_ROUTER_DISABLED_INTENTS
+        self.intents = [intent for intent in intents if intent.name not in disabled_intents]
+        self.threshold = threshold
+        self.enabled = enabled
+
+        keywords = []
+        self._keyword_targets = []  # keyword index -> (intent index, weight)
+        for intent_index, intent in enumerate(self.intents):
+            for keyword, weight in intent.keywords.items():
+                keywords.append(keyword)
+                self._keyword_targets.append((intent_index, weight))
+        self._automaton = KeywordAutomaton(keywords)
+
+    def classify(self, user_message: str) -> Optional[Tuple[Intent, float]]:
+        """Best-matching intent and its confidence, or None if nothing matched"""
+        text = user_message.lower()
+        word_count = len(text.split())
+        if word_count == 0 or word_count > INTENT_MAX_WORDS:
+            return None
+
+        scores = [0.0] * len(self.intents)
+        seen = set()
+        for start, end, keyword_index in self._automaton.find(text):
+            # Whole words only, so "hi" does not fire inside "this"
+            if start > 0 and text[start - 1].isalnum():
+                continue
+            if end < len(text) and text[end].isalnum():
+                continue
+            if keyword_index in seen:
+                continue
+            seen.add(keyword_index)
+            intent_index, weight = self._keyword_targets[keyword_index]
+            scores[intent_index] += weight
+
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        best = ranked[0] if ranked else None
+        if best is None or scores[best] == 0:
+            return None
+
+        intent = self.intents[best]
+        if intent.max_words is not None and word_count > intent.max_words:
+            return None
+
+        # A competing intent makes the turn ambiguous
+        runner_up = min(scores[ranked[1]], 1.0) if len(ranked) > 1 else 0.0
+        confidence = max(0.0, min(scores[best], 1.0) - 0.5 * runner_up)
+        return intent, confidence
+
+    def route(self, user_message: str, lead_state: LeadCollectionState) -> Optional[Dict]:
+        """Templated answer for the turn, or None if it should go to the model"""
+        if not self.enabled or contains_personal_data(user_message) or mentions_name(user_message):
+            return None
+        if NEGATION_PATTERN.search(user_message.lower().replace("\u2019", "'")):
+            return None
+        classified = self.classify(user_message)
+        if classified is None:
+            return None
+        intent, confidence = classified
+        if confidence < self.threshold:
+            return None
+
+        follow_up = DEFAULT_FOLLOW_UP
+        for field in intent.asks:
+            if not lead_state.collected[field]:
+                follow_up = FOLLOW_UPS[field]
+                break
+
+        return {
+            "intent": intent.name,
+            "confidence": confidence,
+            "message": intent.template.format(follow_up=follow_up),
+            "interest": intent.interest
+        }
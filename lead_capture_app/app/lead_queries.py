@@ -0,0 +1,123 @@
+import base64
+import datetime
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, select, tuple_
+
+from .database import ConversationMessage, Lead, LeadProgram
+
+# Largest page /leads will return
+LEADS_MAX_PAGE_SIZE = int(os.getenv("LEADS_MAX_PAGE_SIZE", "500"))
+
+# Columns returned by /leads; conversation is only loaded when asked for
+LEAD_LIST_COLUMNS = (Lead.id, Lead.name, Lead.email, Lead.phone, Lead.interests, Lead.created_at, Lead.conversation_id)
+
+class InvalidCursorError(ValueError):
+    """Raised for a pagination cursor that was not issued by encode_cursor"""
+
+def encode_cursor(created_at: datetime.datetime, lead_id: int) -> str:
+    """Opaque cursor for the position just after this lead"""
+    raw = f"{created_at.isoformat()}|{lead_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, lead_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(created_at), int(lead_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursorError("Invalid cursor") from e
+
+def lead_columns(include_conversation: bool = False):
+    return LEAD_LIST_COLUMNS + ((Lead.conversation,) if include_conversation else ())
+
+def lead_detail_query(lead_id: int, include_conversation: bool = False):
+    return select(*lead_columns(include_conversation)).where(Lead.id == lead_id)
+
+def has_value(column):
+    return and_(column.is_not(None), column != "")
+
+class LeadFilters:
+    """Filters shared by the lead list and its facet counts"""
+    def __init__(self, created_from: Optional[datetime.datetime] = None,
+                 created_to: Optional[datetime.datetime] = None,
+                 has_email: Optional[bool] = None, has_phone: Optional[bool] = None,
+                 interest: Optional[str] = None, programs: Optional[List[str]] = None):
+        self.created_from = created_from
+        self.created_to = created_to
+        self.has_email = has_email
+        self.has_phone = has_phone
+        self.interest = interest
+        self.programs = programs or []
+
+    def conditions(self, include_programs: bool = True) -> List:
+        conditions = []
+        if self.created_from is not None:
+            conditions.append(Lead.created_at >= self.created_from)
+        if self.created_to is not None:
+            conditions.append(Lead.created_at < self.created_to)
+        if self.has_email is not None:
+            conditions.append(has_value(Lead.email) if self.has_email else ~has_value(Lead.email))
+        if self.has_phone is not None:
+            conditions.append(has_value(Lead.phone) if self.has_phone else ~has_value(Lead.phone))
+        if self.interest:
+            conditions.append(func.lower(Lead.interests).contains(self.interest.lower(), autoescape=True))
+        if include_programs and self.programs:
+            # Leads interested in any of the programs, looked up through the program index
+            conditions.append(Lead.id.in_(
+                select(LeadProgram.lead_id).where(LeadProgram.program.in_(self.programs))
+            ))
+        return conditions
+
+def lead_page_query(limit: int, cursor: Optional[str] = None, filters: Optional[LeadFilters] = None,
+                    include_conversation: bool = False):
+    """
+    One page of leads, newest first, keyset-paginated on (created_at, id).
+
+    Seeking past the cursor uses the (created_at, id) index, so every page costs
+    the same however deep into the table it is. One extra row is selected so the
+    caller can tell whether there is a next page.
+    """
+    query = select(*lead_columns(include_conversation))
+
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        query = query.where(tuple_(Lead.created_at, Lead.id) < tuple_(cursor_created_at, cursor_id))
+    if filters is not None:
+        query = query.where(*filters.conditions())
+
+    return query.order_by(Lead.created_at.desc(), Lead.id.desc()).limit(limit + 1)
+
+def program_facet_query(filters: Optional[LeadFilters] = None):
+    """
+    Number of leads per program among the leads matching the filters. The
+    program filter itself is left out, so every program keeps its count.
+    """
+    conditions = filters.conditions(include_programs=False) if filters is not None else []
+    query = select(LeadProgram.program, func.count().label("count"))
+    if conditions:
+        query = query.join(Lead, Lead.id == LeadProgram.lead_id).where(*conditions)
+    return query.group_by(LeadProgram.program).order_by(func.count().desc(), LeadProgram.program)
+
+async def attach_conversations(db, items: List[Dict]):
+    """
+    Fill in `conversation` (a JSON list of messages) for leads selected with
+    include_conversation, with one query for the whole page. Leads written
+    before conversation_messages existed keep their stored JSON.
+    """
+    conversation_ids = {item["conversation_id"] for item in items if item.get("conversation_id")}
+    if not conversation_ids:
+        return
+    result = await db.execute(
+        select(ConversationMessage.conversation_id, ConversationMessage.role, ConversationMessage.content)
+        .where(ConversationMessage.conversation_id.in_(conversation_ids))
+        .order_by(ConversationMessage.conversation_id, ConversationMessage.seq)
+    )
+    messages = {}
+    for conversation_id, role, content in result.all():
+        messages.setdefault(conversation_id, []).append({"role": role, "content": content})
+    for item in items:
+        if item.get("conversation_id") in messages:
+            item["conversation"] = json.dumps(messages[item["conversation_id"]])
@@ -0,0 +1,187 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from .conversation_cache import ConversationCache, message_parts
+
+# Number of per-conversation states kept in memory
+LEAD_STATE_CACHE_SIZE = int(os.getenv("LEAD_STATE_CACHE_SIZE", "5000"))
+
+# Patterns used to spot lead information in user messages, compiled once
+NAME_PATTERNS = [
+    re.compile(r'\b[A-Z][a-z]+ [A-Z][a-z]+\b'),
+    re.compile(r'My name is ([A-Za-z ]+)'),
+    re.compile(r'I\'m ([A-Za-z ]+)'),
+    re.compile(r'call me ([A-Za-z ]+)'),
+]
+NAME_VALUE_PATTERN = re.compile(r'my name is ([A-Za-z ]+)', re.IGNORECASE)
+EMAIL_PATTERN = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+PHONE_PATTERNS = [
+    re.compile(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b'),
+    re.compile(r'\b\+\d{1,3}[-.]?\d{3}[-.]?\d{3}[-.]?\d{4}\b'),
+]
+LEAD_INFO_PATTERN = re.compile(r'\[LEAD_INFO\](.*?)\[\/LEAD_INFO\]', re.DOTALL)
+# Two-word proper nouns of ours that NAME_PATTERNS would take for a visitor's name
+OUR_PROPER_NOUNS = re.compile(
+    r"kura cares|kia ora|south auckland|good morning|good afternoon|auckland council|"
+    r"community fitness|future wahine|positive pathways|whānau hotaka|whanau hotaka",
+    re.IGNORECASE
+)
+
+# Keywords that map conversation text onto our programs
+PROGRAM_KEYWORDS = {
+    "Community Fitness": ["fitness", "exercise", "workout", "bootcamp"],
+    "Whānau Hotaka": ["financial", "finance", "money", "budget", "hotaka"],
+    "Future Wahine": ["wahine", "women", "girl", "female", "young women"],
+    "Positive Pathways": ["youth", "boy", "rangatahi", "risk", "school"],
+    "$20 Boss": ["entrepreneur", "business", "boss", "startup"],
+    "O-Beast": ["health", "weight", "obesity", "nutrition", "gym"]
+}
+
+LEAD_FIELDS = ("name", "email", "phone", "interests")
+
+INTEREST_SEPARATOR = re.compile(r"[,;]")
+
+def match_programs(text: Optional[str]) -> List[str]:
+    """Canonical programs mentioned in free text, in PROGRAM_KEYWORDS order"""
+    lowered = (text or "").lower()
+    return [
+        program for program, terms in PROGRAM_KEYWORDS.items()
+        if program.lower() in lowered or any(term in lowered for term in terms)
+    ]
+
+def interest_items(text: Optional[str]) -> List[str]:
+    """The interests in a comma- or semicolon-separated list, each once, in order"""
+    items = {}
+    for item in INTEREST_SEPARATOR.split(text or ""):
+        item = " ".join(item.split())
+        if item and item.casefold() not in items:
+            items[item.casefold()] = item
+    return list(items.values())
+
+def merge_interests(*texts: Optional[str]) -> Optional[str]:
+    """Union of interest lists, in first-seen order; the same interest in any case appears once"""
+    items = interest_items("; ".join(text for text in texts if text))
+    return ", ".join(items) if items else None
+
+def mentions_name(text: str) -> bool:
+    """True if the text looks like the visitor giving their name"""
+    text = OUR_PROPER_NOUNS.sub(" ", text)
+    return any(p.search(text) for p in NAME_PATTERNS)
+
+class LeadCollectionState:
+    """
+    What we know about a lead so far in one conversation.
+
+    Messages are processed once, in order, via update(); each turn only pays for
+    the messages added since the previous turn.
+    """
+    def __init__(self):
+        self.message_count = 0
+        self.collected = {field: False for field in LEAD_FIELDS}
+        self.name = None
+        self.email = None
+        self.phone = None
+        self.programs = []
+
+    def copy(self) -> "LeadCollectionState":
+        state = LeadCollectionState()
+        state.message_count = self.message_count
+        state.collected = dict(self.collected)
+        state.name = self.name
+        state.email = self.email
+        state.phone = self.phone
+        state.programs = list(self.programs)
+        return state
+
+    @classmethod
+    def from_history(cls, conversation_history: List[Any]) -> "LeadCollectionState":
+        state = cls()
+        state.update(conversation_history)
+        return state
+
+    @property
+    def interests(self) -> Optional[str]:
+        return ", ".join(self.programs) if self.programs else None
+
+    def values(self) -> Dict[str, Optional[str]]:
+        """Extracted lead values, None where nothing was found"""
+        return {
+            "name": self.name,
+            "email": self.email,
+            "phone": self.phone,
+            "interests": self.interests
+        }
+
+    def update(self, messages: List[Any]):
+        """Process messages that follow the ones already seen"""
+        for msg in messages:
+            self._process_message(*message_parts(msg))
+            self.message_count += 1
+
+    def _process_message(self, role: str, content: str):
+        lowered = content.lower()
+
+        if role == "user":
+            if not self.collected["name"]:
+                self.collected["name"] = any(p.search(content) for p in NAME_PATTERNS)
+            if self.name is None:
+                name_match = NAME_VALUE_PATTERN.search(content)
+                if name_match:
+                    self.name = name_match.group(1)
+
+            email_match = EMAIL_PATTERN.search(content)
+            if email_match:
+                self.collected["email"] = True
+                if self.email is None:
+                    self.email = email_match.group(0)
+
+            for pattern in PHONE_PATTERNS:
+                phone_match = pattern.search(content)
+                if phone_match:
+                    self.collected["phone"] = True
+                    if self.phone is None:
+                        self.phone = phone_match.group(0)
+                    break
+
+            # Only the visitor's own mentions are interests; the assistant lists every program
+            for program in match_programs(lowered):
+                if program not in self.programs:
+                    self.programs.append(program)
+
+        # Any mention of interests or programs counts as interests being discussed
+        if "interest" in lowered or "program" in lowered:
+            self.collected["interests"] = True
+
+        # Lead info reported by the model in earlier replies
+        if role == "assistant" and "[LEAD_INFO]" in content:
+            match = LEAD_INFO_PATTERN.search(content)
+            if match:
+                try:
+                    lead_info = json.loads(match.group(1))
+                except json.JSONDecodeError:
+                    lead_info = None
+                if isinstance(lead_info, dict):
+                    for field in LEAD_FIELDS:
+                        if lead_info.get(field):
+                            self.collected[field] = True
+                    self.name = self.name or lead_info.get("name")
+                    self.email = self.email or lead_info.get("email")
+                    self.phone = self.phone or lead_info.get("phone")
+
+class LeadStateCache(ConversationCache):
+    """Cache of LeadCollectionState per conversation"""
+    def __init__(self, max_size: int = LEAD_STATE_CACHE_SIZE):
+        super().__init__(max_size)
+
+    def get_state(self, conversation_history: List[Any], conversation_id: Optional[str] = None,
+                  prefix_keys: Optional[List[str]] = None) -> LeadCollectionState:
+        """Return the state for the whole history, processing only unseen messages"""
+        conversation_history = conversation_history or []
+        key, cached = self.find(conversation_history, len(conversation_history), conversation_id, prefix_keys)
+
+        state = cached.copy() if cached is not None else LeadCollectionState()
+        state.update(conversation_history[state.message_count:])
+        self.store(key, state)
+        return state
@@ -0,0 +1,159 @@
+import datetime
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, func, select
+
+from .database import ConversationMessage, Lead, LeadStat, dialect_insert, engine
+from .lead_state import match_programs
+
+# Counter metrics; each row of lead_stats is one (metric, bucket) count
+TOTAL = "leads_total"
+PER_DAY = "leads_per_day"  # bucket: YYYY-MM-DD
+FIELD = "field_completed"  # bucket: name / email / phone
+PROGRAM = "program"  # bucket: canonical program, see match_programs
+FUNNEL = "funnel"  # bucket: stage
+CONVERSATIONS = "conversations_total"
+# Bumped whenever the counters change meaning, so startup rebuilds them
+VERSION = "stats_version"
+STATS_VERSION = 3
+
+COMPLETION_FIELDS = ("name", "email", "phone")
+# Funnel stages, widest first; conversations are counted separately
+FUNNEL_STAGES = ("captured", "named", "contactable", "qualified")
+
+def lead_counters(lead: Optional[Dict[str, Any]]) -> Counter:
+    """Every counter a lead contributes to; subtract the old state's counters from the new one's for a delta"""
+    counters = Counter()
+    if lead is None:
+        return counters
+    counters[(TOTAL, "")] += 1
+    if lead.get("created_at") is not None:
+        created_at = lead["created_at"]
+        day = created_at.date().isoformat() if isinstance(created_at, datetime.datetime) else str(created_at)[:10]
+        counters[(PER_DAY, day)] += 1
+    for field in COMPLETION_FIELDS:
+        if lead.get(field):
+            counters[(FIELD, field)] += 1
+    programs = match_programs(lead.get("interests"))
+    for program in programs:
+        counters[(PROGRAM, program)] += 1
+
+    contactable = bool(lead.get("email") or lead.get("phone"))
+    stages = {
+        "captured": True,
+        "named": bool(lead.get("name")),
+        "contactable": contactable,
+        "qualified": bool(lead.get("name")) and contactable and bool(programs)
+    }
+    for stage, reached in stages.items():
+        if reached:
+            counters[(FUNNEL, stage)] += 1
+    return counters
+
+def counter_delta(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> Dict:
+    delta = lead_counters(new)
+    delta.subtract(lead_counters(old))
+    return {key: value for key, value in delta.items() if value}
+
+def increment_statement(delta: Dict):
+    """One upsert adding every (metric, bucket) delta to its counter"""
+    rows = [{"metric": metric, "bucket": bucket, "value": value} for (metric, bucket), value in delta.items()]
+    statement = dialect_insert(LeadStat).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[LeadStat.metric, LeadStat.bucket],
+        set_={"value": LeadStat.value + statement.excluded.value}
+    )
+
+async def apply_lead_change(db, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]):
+    """Update the counters for a lead going from `old` (None if new) to `new`, in the caller's transaction"""
+    delta = counter_delta(old, new)
+    if delta:
+        await db.execute(increment_statement(delta))
+
+async def count_new_conversation(db):
+    """Count a conversation starting, whether or not it becomes a lead (see the chat handlers)"""
+    await db.execute(increment_statement({(CONVERSATIONS, ""): 1}))
+
+def recompute_lead_stats(connection, chunk_size: int = 5000):
+    """
+    Rebuild every counter from the leads and conversation_messages tables.
+
+    O(rows), so it is meant for backfills and repairing drift, not for serving
+    dashboards. Runs in the caller's transaction. Client-held conversations are
+    only stored once they become leads, so the conversations counter is kept
+    when it is above the number of stored conversations.
+    """
+    counters = Counter()
+    last_id = 0
+    columns = (Lead.id, Lead.name, Lead.email, Lead.phone, Lead.interests, Lead.created_at)
+    while True:
+        rows = connection.execute(
+            select(*columns).where(Lead.id > last_id).order_by(Lead.id).limit(chunk_size)
+        ).mappings().all()
+        if not rows:
+            break
+        for row in rows:
+            counters.update(lead_counters(row))
+        last_id = rows[-1]["id"]
+
+    conversations = connection.execute(
+        select(func.count(func.distinct(ConversationMessage.conversation_id)))
+    ).scalar() or 0
+    counted = connection.execute(
+        select(LeadStat.value).where(LeadStat.metric == CONVERSATIONS, LeadStat.bucket == "")
+    ).scalar() or 0
+    conversations = max(conversations, counted)
+    if conversations:
+        counters[(CONVERSATIONS, "")] = conversations
+    counters[(VERSION, "")] = STATS_VERSION
+
+    connection.execute(delete(LeadStat))
+    if counters:
+        connection.execute(LeadStat.__table__.insert(), [
+            {"metric": metric, "bucket": bucket, "value": value} for (metric, bucket), value in counters.items()
+        ])
+    print(f"DIAGNOSTIC: Recomputed lead stats ({len(counters)} counters)")
+
+def ensure_lead_stats():
+    """Rebuild the counters if the database has leads but no counters of the current version"""
+    with engine.begin() as connection:
+        version = connection.execute(
+            select(LeadStat.value).where(LeadStat.metric == VERSION, LeadStat.bucket == "")
+        ).scalar()
+        has_leads = connection.execute(select(Lead.id).limit(1)).first() is not None
+        if has_leads and version != STATS_VERSION:
+            recompute_lead_stats(connection)
+
+async def read_lead_stats(db, days: Optional[int] = None) -> Dict[str, Any]:
+    """Dashboard numbers from the counters; cost depends on days and programs, not on leads"""
+    query = select(LeadStat.metric, LeadStat.bucket, LeadStat.value).where(LeadStat.value != 0)
+    if days is not None:
+        since = (datetime.datetime.utcnow().date() - datetime.timedelta(days=days - 1)).isoformat()
+        query = query.where((LeadStat.metric != PER_DAY) | (LeadStat.bucket >= since))
+    counters = {}
+    for metric, bucket, value in (await db.execute(query)).all():
+        counters.setdefault(metric, {})[bucket] = value
+
+    total = counters.get(TOTAL, {}).get("", 0)
+    conversations = counters.get(CONVERSATIONS, {}).get("", 0)
+
+    def rate(count: int, of: int) -> float:
+        return round(count / of, 4) if of else 0.0
+
+    fields = counters.get(FIELD, {})
+    funnel = counters.get(FUNNEL, {})
+    return {
+        "total_leads": total,
+        "total_conversations": conversations,
+        "leads_per_day": dict(sorted(counters.get(PER_DAY, {}).items())),
+        "field_completion": {
+            field: {"count": fields.get(field, 0), "rate": rate(fields.get(field, 0), total)}
+            for field in COMPLETION_FIELDS
+        },
+        "programs": dict(sorted(counters.get(PROGRAM, {}).items(), key=lambda item: -item[1])),
+        "funnel": [{"stage": "conversations", "count": conversations, "rate": 1.0 if conversations else 0.0}] + [
+            {"stage": stage, "count": funnel.get(stage, 0), "rate": rate(funnel.get(stage, 0), conversations or total)}
+            for stage in FUNNEL_STAGES
+        ]
+    }
@@ -0,0 +1,357 @@
+import asyncio
+import datetime
+import os
+import time
+import traceback
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .conversation_store import sync_history
+from .database import AsyncSessionLocal, Lead, LeadProgram, begin_write, dialect_insert, normalize_email, normalize_phone
+from .lead_stats import apply_lead_change
+from . import metrics, tracing
+from .lead_state import match_programs, merge_interests
+from .schemas import LeadCreate
+
+# Pending leads held in memory before submitters have to wait
+LEAD_QUEUE_MAX_PENDING = int(os.getenv("LEAD_QUEUE_MAX_PENDING", "1000"))
+# Flush as soon as this many distinct leads are pending...
+LEAD_FLUSH_BATCH_SIZE = int(os.getenv("LEAD_FLUSH_BATCH_SIZE", "50"))
+# ...or when the oldest pending update is this old
+LEAD_FLUSH_INTERVAL_SECONDS = float(os.getenv("LEAD_FLUSH_INTERVAL_SECONDS", "2.0"))
+
+LEAD_VALUE_FIELDS = ("name", "email", "phone")
+# Lead columns the analytics counters are derived from
+STATS_COLUMNS = (Lead.name, Lead.email, Lead.phone, Lead.interests, Lead.created_at)
+# Lead columns upsert_lead reads and returns
+LEAD_COLUMNS = (Lead.id, Lead.conversation_id, Lead.email_key, Lead.phone_key, *STATS_COLUMNS)
+
+def lead_key(lead_info: Dict, conversation_id: Optional[str] = None) -> Optional[str]:
+    """Identity used to coalesce updates: email, else phone, else the conversation"""
+    if normalize_email(lead_info.get("email")):
+        return "email:" + normalize_email(lead_info["email"])
+    if normalize_phone(lead_info.get("phone")):
+        return "phone:" + normalize_phone(lead_info["phone"])
+    if conversation_id:
+        return "conversation:" + conversation_id
+    return None
+
+class PendingLead:
+    """All not-yet-written updates for one lead, merged"""
+    def __init__(self):
+        self.values = {}
+        self.interests = None
+        self.conversation = None
+        self.conversation_id = None  # Session id, if the conversation has one
+        self.updates = 0
+        self.first_update_at = time.monotonic()
+
+    def merge(self, lead_info: Dict, conversation: List[Dict], conversation_id: Optional[str] = None):
+        # Extraction results are cumulative, so the latest value for a field wins
+        for field in LEAD_VALUE_FIELDS:
+            if lead_info.get(field):
+                self.values[field] = lead_info[field]
+        # Interest lists are cumulative too, but may reword or reorder; keep each interest once
+        self.interests = merge_interests(self.interests, lead_info.get("interests"))
+        self.conversation = conversation
+        self.conversation_id = conversation_id
+        self.updates += 1
+
+class LeadWriteQueue:
+    """
+    Write-behind queue for lead updates.
+
+    Chat turns submit updates without touching the database. Updates for the
+    same lead are coalesced in memory, and a background writer flushes them in
+    batched transactions when LEAD_FLUSH_BATCH_SIZE leads are pending or the
+    oldest update is LEAD_FLUSH_INTERVAL_SECONDS old. stop() drains everything
+    that is still pending.
+    """
+    def __init__(self, max_pending: int = LEAD_QUEUE_MAX_PENDING,
+                 batch_size: int = LEAD_FLUSH_BATCH_SIZE,
+                 flush_interval: float = LEAD_FLUSH_INTERVAL_SECONDS):
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = {}  # lead key -> PendingLead
+        self._wake = None
+        self._space = None
+        self._task = None
+        self._stopping = False
+
+        self.updates_submitted = 0
+        self.updates_coalesced = 0
+        self.updates_dropped = 0
+        self.updates_skipped = 0
+        self.rows_written = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._space = asyncio.Event()
+            self._space.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the writer after flushing every pending update"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+
+    async def submit(self, lead_info: Dict, conversation: List[Dict], conversation_id: Optional[str] = None):
+        """Queue a lead update; waits only when the queue is full"""
+        try:
+            LeadCreate(**{field: lead_info.get(field) for field in ("name", "email", "phone", "interests")})
+        except ValueError as e:
+            self.updates_dropped += 1
+            print(f"Lead update dropped: {str(e)}")
+            return
+
+        key = lead_key(lead_info, conversation_id)
+        if key is None:
+            # No email, phone or session to file it under. Extraction is cumulative,
+            # so these details are written with the first update that has one
+            self.updates_skipped += 1
+            return
+
+        if self._task is None:
+            # No writer running (e.g. outside the app lifespan), write straight through
+            pending = PendingLead()
+            pending.merge(lead_info, conversation, conversation_id)
+            self.updates_submitted += 1
+            with tracing.span("db.lead_write"):
+                await self._write_batch([pending])
+            return
+
+        while key not in self._pending and len(self._pending) >= self.max_pending:
+            self._space.clear()
+            self._wake.set()
+            await self._space.wait()
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = PendingLead()
+        else:
+            self.updates_coalesced += 1
+        pending.merge(lead_info, conversation, conversation_id)
+        self.updates_submitted += 1
+        self.max_depth = max(self.max_depth, len(self._pending))
+
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.depth,
+            "max_queue_depth": self.max_depth,
+            "updates_submitted": self.updates_submitted,
+            "updates_coalesced": self.updates_coalesced,
+            "updates_dropped": self.updates_dropped,
+            "updates_skipped": self.updates_skipped,
+            "rows_written": self.rows_written,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            # Rows written per submitted update; below 1.0 means coalescing is saving writes
+            "write_amplification": round(self.rows_written / self.updates_submitted, 4) if self.updates_submitted else 0.0
+        }
+
+    async def _run(self):
+        while True:
+            timeout = self.flush_interval
+            if self._pending:
+                oldest = min(p.first_update_at for p in self._pending.values())
+                timeout = max(0.0, self.flush_interval - (time.monotonic() - oldest))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            if self._pending:
+                batch = list(self._pending.values())
+                self._pending = {}
+                self._space.set()
+                # Flushes run outside any request, so each one is a trace of its own
+                with tracing.trace("lead_writer.flush", leads=len(batch)):
+                    await self._write_batch(batch)
+
+            if self._stopping and not self._pending:
+                return
+
+    async def _write_batch(self, batch: List[PendingLead]):
+        self.flushes += 1
+        try:
+            async with AsyncSessionLocal() as db:
+                await begin_write(db)
+                for pending in batch:
+                    with tracing.span("db.lead_upsert", updates=pending.updates):
+                        await self._apply(db, pending)
+                with tracing.span("db.commit"):
+                    await db.commit()
+            self.rows_written += len(batch)
+        except Exception as db_error:
+            # Retry lead by lead so one bad row doesn't lose the whole batch
+            self.flush_errors += 1
+            print(f"Database error in batched lead write: {str(db_error)}")
+            print(traceback.format_exc())
+            if len(batch) > 1:
+                for pending in batch:
+                    await self._write_batch([pending])
+
+    async def _apply(self, db, pending: PendingLead):
+        """Insert the lead or merge it into its existing row, then update what depends on it"""
+        started = time.perf_counter()
+        values = pending.values
+        row = {
+            "name": values.get("name"),
+            "email": values.get("email"),
+            "phone": values.get("phone"),
+            "email_key": normalize_email(values.get("email")),
+            "phone_key": normalize_phone(values.get("phone")),
+            "interests": pending.interests,
+            "conversation_id": pending.conversation_id,
+            "created_at": datetime.datetime.utcnow()
+        }
+        if row["conversation_id"] and not row["email_key"] and not row["phone_key"]:
+            # The conversation's lead may have contact details already; merge into it
+            owner = (await db.execute(
+                select(Lead.email_key, Lead.phone_key)
+                .where(Lead.conversation_id == row["conversation_id"], ~keyless_lead(row["conversation_id"]))
+                .order_by(Lead.id.desc()).limit(1)
+            )).first()
+            if owner is not None:
+                row["email_key"], row["phone_key"] = owner
+        old, new = await upsert_lead(db, row)
+        if new["conversation_id"] and (new["email_key"] or new["phone_key"]):
+            new = await absorb_keyless_lead(db, new)
+        await link_programs(db, new["id"], new["interests"])
+        await apply_lead_change(db, old, new)
+        await self._store_conversation(db, new["id"], new["conversation_id"], pending)
+        metrics.DB_UPSERT.observe(time.perf_counter() - started)
+    
+    async def _store_conversation(self, db, lead_id: int, conversation_id: Optional[str], pending: PendingLead):
+        """Append the turns of the lead's conversation that are not stored yet"""
+        history = pending.conversation or []
+        if not history or pending.conversation_id is not None:
+            # Session messages are appended by the session store as each turn happens
+            return
+        # A client-held conversation continues under the lead's conversation id, so
+        # each flush appends only the new turns
+        if conversation_id is not None and await sync_history(db, conversation_id, history):
+            return
+        # Seen for the first time (or a fresh one from a returning lead): give it an id
+        conversation_id = uuid.uuid4().hex
+        await db.execute(update(Lead).where(Lead.id == lead_id).values(conversation_id=conversation_id))
+        await sync_history(db, conversation_id, history)
+
+async def link_programs(db, lead_id: int, interests: Optional[str]):
+    """Record the canonical programs in a lead's interests; pairs already linked are skipped"""
+    programs = match_programs(interests)
+    if programs:
+        statement = dialect_insert(LeadProgram).on_conflict_do_nothing(
+            index_elements=[LeadProgram.lead_id, LeadProgram.program]
+        )
+        await db.execute(statement, [{"lead_id": lead_id, "program": program} for program in programs])
+
+async def absorb_keyless_lead(db, lead):
+    """
+    Merge the lead recorded for `lead`'s conversation before it gave an email or
+    phone into `lead`, and delete it. Returns `lead` as updated.
+    """
+    # Deleted first, so a concurrent absorb of the same lead finds nothing and counts nothing
+    keyless = (await db.execute(
+        delete(Lead).where(keyless_lead(lead["conversation_id"]), Lead.id != lead["id"])
+        .returning(Lead.id, *STATS_COLUMNS)
+    )).mappings().first()
+    if keyless is None:
+        return lead
+    await db.execute(delete(LeadProgram).where(LeadProgram.lead_id == keyless["id"]))
+    result = await db.execute(
+        update(Lead).where(Lead.id == lead["id"]).values(
+            name=func.coalesce(Lead.name, keyless["name"]),
+            phone=func.coalesce(Lead.phone, keyless["phone"]),
+            interests=merge_interests(keyless["interests"], lead["interests"]),
+            created_at=min(lead["created_at"], keyless["created_at"])
+        ).returning(*LEAD_COLUMNS)
+    )
+    await apply_lead_change(db, keyless, None)
+    return result.mappings().one()
+
+def keyless_lead(conversation_id: str):
+    """Condition for a conversation's lead without email or phone (at most one, see Lead)"""
+    return (Lead.conversation_id == conversation_id) & Lead.email_key.is_(None) & Lead.phone_key.is_(None)
+
+def lead_match(row: Dict):
+    """Condition for the existing lead a row would be merged into"""
+    if row["email_key"]:
+        return Lead.email_key == row["email_key"]
+    if row["phone_key"]:
+        return Lead.phone_key == row["phone_key"]
+    if row["conversation_id"]:
+        return keyless_lead(row["conversation_id"])
+    return None
+
+async def upsert_lead(db, row: Dict) -> Tuple[Optional[Dict], Dict]:
+    """
+    Insert a lead, or merge it into the lead it matches (see lead_match): existing
+    name/email/phone are kept, missing ones are filled in, interests are merged
+    and the lead moves to the latest session. Returns the lead before (None if it
+    is new) and after.
+
+    The existing row is locked before it is read (FOR UPDATE; on SQLite the
+    transaction holds the write lock, see begin_write), so concurrent writers of
+    one lead can't lose each other's interests or both count it as new.
+    """
+    while True:
+        # A conflict means the lead exists (or the phone of a new email belongs to another lead)
+        new = (await db.execute(
+            dialect_insert(Lead).values(**row).on_conflict_do_nothing().returning(*LEAD_COLUMNS)
+        )).mappings().first()
+        if new is not None:
+            return None, new
+        old = (await db.execute(select(*LEAD_COLUMNS).where(lead_match(row)).with_for_update())).mappings().first()
+        if old is not None:
+            break
+        if row["phone_key"] is None:
+            raise RuntimeError("Lead insert conflicted but no lead matches it")
+        # Nothing to merge into, so the conflict was the phone key: it belongs to a different
+        # lead than this email. Keep the number on this lead but leave the phone key with its owner
+        row = {**row, "phone_key": None}
+
+    values = {
+        "name": old["name"] or row["name"],
+        "email": old["email"] or row["email"],
+        "phone": old["phone"] or row["phone"],
+        "email_key": old["email_key"] or row["email_key"],
+        "phone_key": old["phone_key"] or row["phone_key"],
+        "interests": merge_interests(old["interests"], row["interests"]),
+        "conversation_id": row["conversation_id"] or old["conversation_id"]
+    }
+    statement = update(Lead).where(Lead.id == old["id"]).returning(*LEAD_COLUMNS)
+    if values["phone_key"] == old["phone_key"]:
+        return old, (await db.execute(statement.values(**values))).mappings().one()
+    try:
+        # Savepoint, so a phone key conflict doesn't take the rest of the batch down with it
+        async with db.begin_nested():
+            return old, (await db.execute(statement.values(**values))).mappings().one()
+    except IntegrityError:
+        # The phone already belongs to a different lead; keep the number on this lead
+        # but leave the phone key with its current owner
+        values["phone_key"] = old["phone_key"]
+        return old, (await db.execute(statement.values(**values))).mappings().one()
+
+lead_writer = LeadWriteQueue()
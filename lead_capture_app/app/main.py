@@ -1,9 +1,14 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+import asyncio
+import datetime
 import json
 import traceback
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import os
 from dotenv import load_dotenv
 import time
@@ -11,12 +16,59 @@ import time
 # Load environment variables from .env file
 load_dotenv()
 
-from .database import get_db, create_tables, Lead
-from .schemas import ChatRequest, ChatResponse, LeadCreate, LeadResponse
-from .ai_service import LeadCaptureAgent, get_openai_client
+from .database import AsyncSessionLocal, async_engine, get_async_db, create_tables
+from .schemas import ChatRequest, ChatResponse, LeadPage, LeadResponse, LeadStatsResponse, MessagePage, ProgramFacet, SessionResponse
+from .sessions import session_store
+from .lead_writer import lead_writer
+from .lead_queries import (LEADS_MAX_PAGE_SIZE, InvalidCursorError, LeadFilters, attach_conversations,
+                           encode_cursor, lead_detail_query, lead_page_query, program_facet_query)
+from .lead_state import PROGRAM_KEYWORDS, LeadCollectionState
+from .conversation_store import MESSAGE_PAGE_MAX_SIZE, message_page_query
+from .lead_stats import count_new_conversation, ensure_lead_stats, read_lead_stats, recompute_lead_stats
+from .health import HEALTH_DB_INTERVAL_SECONDS, HEALTH_OPENAI_INTERVAL_SECONDS, check_database, health_prober
+from .ai_service import LeadCaptureAgent, close_openai_client, warm_up_openai_client
+from .history import count_tokens, summarize_message
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, openai_breaker
+from . import metrics, tracing
+
+# Set to false when the launcher has already prepared the database (see run.py),
+# so that workers starting together don't all migrate it at once
+RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+# The AI service, created at startup by the lifespan
+lead_agent: Optional[LeadCaptureAgent] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global lead_agent
+    # Startup work runs here rather than at import, so importing the app stays cheap
+    if RUN_MIGRATIONS_ON_STARTUP:
+        create_tables()
+        ensure_lead_stats()
+    # An agent set before startup (e.g. by the load test) is kept
+    created_agent = lead_agent is None
+    if created_agent:
+        lead_agent = LeadCaptureAgent()
+    
+    # Background writer for lead updates; drained on shutdown so nothing is lost
+    lead_writer.start()
+    if tracing.TRACE_SAMPLE_RATE > 0:
+        tracing.trace_exporter.start()
+    # Connect to OpenAI before the first user request needs it
+    await warm_up_openai_client(lead_agent.client)
+    # Dependency checks for /readyz, kept current in the background
+    health_prober.start()
+    yield
+    await health_prober.stop()
+    await lead_writer.stop()
+    # After the writer, so the spans of its final flush are written too
+    tracing.trace_exporter.stop()
+    await close_openai_client()
+    if created_agent:
+        lead_agent = None
 
 # Initialize FastAPI app
-app = FastAPI(title="Charity Lead Capture API")
+app = FastAPI(title="Charity Lead Capture API", lifespan=lifespan)
 
 # Get allowed origins from environment or use defaults
 def get_allowed_origins():
@@ -44,11 +96,63 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize database tables
-create_tables()
+# Outside CORS, so the count covers the whole request
+app.add_middleware(metrics.InFlightMiddleware)
+# Outermost: request ids and the root span of each sampled request
+app.add_middleware(tracing.RequestTracingMiddleware)
+
+# The database is required to serve traffic; without OpenAI the agent still answers from its fallback
+health_prober.add_check("database", check_database, HEALTH_DB_INTERVAL_SECONDS, required=True)
+health_prober.add_check("openai_api", lambda: lead_agent.check_openai(), HEALTH_OPENAI_INTERVAL_SECONDS, required=False)
+
+def cache_lookups():
+    lookups = {}
+    if lead_agent is not None:
+        lookups[("response", "hit")] = lead_agent.response_cache.hits
+        lookups[("response", "miss")] = lead_agent.response_cache.misses
+    for name, cached in (("token_count", count_tokens), ("message_summary", summarize_message)):
+        info = cached.cache_info()
+        lookups[(name, "hit")] = info.hits
+        lookups[(name, "miss")] = info.misses
+    return lookups
 
-# Initialize AI service
-lead_agent = LeadCaptureAgent()
+# State kept elsewhere, read only when /metrics is scraped
+metrics.Counter("cache_lookups_total", "Cache lookups by cache and result", ("cache", "result"), callback=cache_lookups)
+metrics.Gauge("lead_queue_depth", "Lead updates waiting for the lead writer",
+              callback=lambda: {(): lead_writer.depth})
+metrics.Counter("lead_writer_rows_written_total", "Lead rows written by the lead writer",
+                callback=lambda: {(): lead_writer.rows_written})
+metrics.Gauge("openai_circuit_state", "1 for the current state of the OpenAI circuit breaker", ("state",),
+              callback=lambda: {(state,): int(openai_breaker.state == state) for state in (CLOSED, HALF_OPEN, OPEN)})
+
+# Turns answered without the model. They never carry contact details (see IntentRouter and
+# ResponseCache), so the local scan, plus the routed interest, is all extraction would find
+LOCALLY_ANSWERED_PATHS = ("intent", "cache")
+
+# How often (in seconds) to check whether a chat client has gone away
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+class ClientDisconnected(Exception):
+    """Raised when the HTTP client disconnects before the agent has answered"""
+
+async def run_until_disconnected(http_request: Request, coro):
+    """
+    Await a coroutine, cancelling it if the client disconnects first.
+    This stops abandoned chats from holding OpenAI connections and retry sleeps.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                print("DIAGNOSTIC: Client disconnected, cancelling chat processing")
+                task.cancel()
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
 
 # Helper function to convert ChatMessage objects to dict for JSON serialization
 def convert_chat_messages_to_dict(messages):
@@ -62,133 +166,361 @@ def convert_chat_messages_to_dict(messages):
             result.append(msg)
     return result
 
+async def resolve_conversation_history(request: ChatRequest) -> List[Any]:
+    """Return the history for a chat turn, from the session store if a session id was given"""
+    if request.session_id is None:
+        return request.conversation_history or []
+    history = await session_store.get(request.session_id)
+    if history is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return history
+
+async def record_session_turn(request: ChatRequest, assistant_message: str):
+    """Append the user message and the assistant reply to the request's session, if any"""
+    if request.session_id is None:
+        return
+    try:
+        await session_store.append(request.session_id, [
+            {"role": "user", "content": request.message},
+            {"role": "assistant", "content": assistant_message}
+        ])
+    except Exception as e:
+        print(f"Session error: {str(e)}")
+        print(traceback.format_exc())
+
+async def record_conversation_start(conversation_history: List[Any]):
+    """Count a conversation on its first turn, so the funnel sees it whether or not it becomes a lead"""
+    if conversation_history:
+        return
+    try:
+        async with AsyncSessionLocal() as db:
+            await count_new_conversation(db)
+            await db.commit()
+    except Exception as e:
+        print(f"Stats error: {str(e)}")
+
+async def extract_and_save_lead_info(user_message: str, assistant_message: str,
+                                    conversation_history: List[Any], conversation_id: str = None,
+                                    lead_state: Optional[LeadCollectionState] = None):
+    """
+    Background step run after a reply has been sent: extract lead information for
+    the turn with a separate structured call and queue it for the lead writer.
+    """
+    try:
+        with metrics.LEAD_EXTRACTION.time(), tracing.span("lead_extraction"):
+            lead_info = await lead_agent.extract_lead_info(
+                user_message, assistant_message, conversation_history, conversation_id, lead_state
+            )
+    except Exception as e:
+        print(f"Lead extraction error: {str(e)}")
+        print(traceback.format_exc())
+        return
+    await save_lead_info(lead_info, user_message, assistant_message, conversation_history, conversation_id)
+
+async def save_lead_info(lead_info: Optional[Dict], user_message: str, assistant_message: str,
+                         conversation_history: List[Any], conversation_id: str = None):
+    """Queue a turn's lead information, if it has any, for the lead writer"""
+    if lead_info and any(lead_info.values()):
+        # Convert conversation history to JSON-serializable format, including this turn
+        serializable_history = convert_chat_messages_to_dict(conversation_history) + [
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": assistant_message}
+        ]
+        await lead_writer.submit(lead_info, serializable_history, conversation_id)
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Charity Lead Capture API"}
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_with_agent(request: ChatRequest, db: Session = Depends(get_db)):
+async def chat_with_agent(request: ChatRequest, http_request: Request, background_tasks: BackgroundTasks):
     """
     Chat with the lead capture agent and store captured lead information.
+    
+    Clients either send the full conversation_history each turn, or a session_id
+    from POST /sessions and only the new message. Lead extraction and storage run
+    in the background once the reply has been sent.
     """
+    with metrics.TOTAL.time():
+        return await _chat_with_agent(request, http_request, background_tasks)
+
+async def _chat_with_agent(request: ChatRequest, http_request: Request, background_tasks: BackgroundTasks):
+    conversation_history = await resolve_conversation_history(request)
+    background_tasks.add_task(record_conversation_start, conversation_history)
     try:
-        # Process message with OpenAI
-        result = lead_agent.chat(
-            user_message=request.message,
-            conversation_history=request.conversation_history
+        # Process message with OpenAI without blocking the event loop
+        result = await run_until_disconnected(
+            http_request,
+            lead_agent.chat(
+                user_message=request.message,
+                conversation_history=conversation_history,
+                conversation_id=request.session_id
+            )
         )
         
         # If we got a fallback message due to API errors, return it without trying to process lead info
         if "I'm having trouble connecting right now" in result["message"]:
             return ChatResponse(
                 message=result["message"],
-                captured_lead_info=None
+                captured_lead_info=None,
+                session_id=request.session_id
             )
             
-        # Extract captured lead info if available
+        # Lead info found so far by the cheap local scan
         lead_info = result.get("captured_lead_info")
         
-        # If lead info was captured, store or update in database
-        if lead_info and any(lead_info.values()):
-            try:
-                # Create a new lead or update existing one
-                
-                # Convert conversation history to JSON-serializable format
-                serializable_history = convert_chat_messages_to_dict(request.conversation_history)
-                
-                lead_data = LeadCreate(
-                    name=lead_info.get("name"),
-                    email=lead_info.get("email"),
-                    phone=lead_info.get("phone"),
-                    interests=lead_info.get("interests"),
-                    # Store the conversation for context
-                    conversation=json.dumps(serializable_history)
-                )
-                
-                # Check if we already have this lead in the database
-                existing_lead = None
-                if lead_info.get("email"):
-                    existing_lead = db.query(Lead).filter(Lead.email == lead_info.get("email")).first()
-                elif lead_info.get("phone"):
-                    existing_lead = db.query(Lead).filter(Lead.phone == lead_info.get("phone")).first()
-                    
-                if existing_lead:
-                    # Update existing lead with new information
-                    if lead_info.get("name") and not existing_lead.name:
-                        existing_lead.name = lead_info.get("name")
-                    if lead_info.get("email") and not existing_lead.email:
-                        existing_lead.email = lead_info.get("email")
-                    if lead_info.get("phone") and not existing_lead.phone:
-                        existing_lead.phone = lead_info.get("phone")
-                    if lead_info.get("interests"):
-                        if existing_lead.interests:
-                            existing_lead.interests += f"; {lead_info.get('interests')}"
-                        else:
-                            existing_lead.interests = lead_info.get("interests")
-                    existing_lead.conversation = json.dumps(serializable_history)
-                    db.commit()
-                else:
-                    # Create new lead
-                    db_lead = Lead(**lead_data.dict())
-                    db.add(db_lead)
-                    db.commit()
-                    db.refresh(db_lead)
-            except Exception as db_error:
-                # If database operations fail, log the error but still return the chat response
-                print(f"Database error: {str(db_error)}")
-                print(traceback.format_exc())
-                # Continue execution to return the chat response
+        # Extract and store lead info off the response path
+        if result.get("path") in LOCALLY_ANSWERED_PATHS:
+            background_tasks.add_task(
+                save_lead_info,
+                lead_info, request.message, result["message"], conversation_history, request.session_id
+            )
+        else:
+            background_tasks.add_task(
+                extract_and_save_lead_info,
+                request.message, result["message"], conversation_history, request.session_id, result.get("lead_state")
+            )
+        
+        await record_session_turn(request, result["message"])
         
         return ChatResponse(
             message=result["message"],
-            captured_lead_info=lead_info
+            captured_lead_info=lead_info,
+            session_id=request.session_id
         )
         
+    except ClientDisconnected:
+        # Nobody is listening any more; 499 mirrors nginx's "client closed request"
+        return Response(status_code=499)
     except Exception as e:
         print(f"Chat error: {str(e)}")
         print(traceback.format_exc())
         # Return a more user-friendly error
         return ChatResponse(
             message="I'm sorry, I'm having trouble responding right now. Please try again in a moment.",
-            captured_lead_info=None
+            captured_lead_info=None,
+            session_id=request.session_id
+        )
+
+@app.post("/sessions", response_model=SessionResponse)
+async def create_session():
+    """
+    Start a server-side conversation. Pass the returned session_id to /chat or
+    /chat/stream and send only the new message each turn.
+    """
+    return SessionResponse(session_id=await session_store.create())
+
+@app.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str):
+    """
+    Get the stored history of a conversation session.
+    """
+    history = await session_store.get(session_id)
+    if history is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return SessionResponse(session_id=session_id, conversation_history=history)
+
+def format_sse(event: str, data: Any) -> str:
+    """Encode a single server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_with_agent_stream(request: ChatRequest):
+    """
+    Chat with the lead capture agent, streaming the reply as server-sent events.
+    
+    Emits `token` events with visible text as it is generated, then a `lead_info`
+    event with the lead information found so far and a final `done` event. Any
+    [LEAD_INFO] trailer is stripped server-side and never reaches the client.
+    Lead extraction and storage run in the background after the stream ends.
+    """
+    conversation_history = await resolve_conversation_history(request)
+    completed_turn = {}
+    
+    async def persist_completed_turn():
+        await record_conversation_start(conversation_history)
+        if "message" not in completed_turn:
+            return
+        if completed_turn["path"] in LOCALLY_ANSWERED_PATHS:
+            await save_lead_info(
+                completed_turn["lead_info"], request.message, completed_turn["message"],
+                conversation_history, request.session_id
+            )
+        else:
+            await extract_and_save_lead_info(
+                request.message, completed_turn["message"], conversation_history, request.session_id,
+                completed_turn["lead_state"]
+            )
+    
+    async def event_stream():
+        started = time.perf_counter()
+        try:
+            async for event, data in lead_agent.chat_stream(
+                user_message=request.message,
+                conversation_history=conversation_history,
+                conversation_id=request.session_id
+            ):
+                if event == "lead_info":
+                    completed_turn["lead_info"] = data
+                if event == "done":
+                    # The answer path and lead state are for the server only
+                    completed_turn["path"] = data.pop("path")
+                    completed_turn["lead_state"] = data.pop("lead_state")
+                    completed_turn["message"] = data["message"]
+                    await record_session_turn(request, data["message"])
+                    metrics.TOTAL.observe(time.perf_counter() - started)
+                yield format_sse(event, data)
+        except Exception as e:
+            print(f"Chat stream error: {str(e)}")
+            print(traceback.format_exc())
+            yield format_sse("error", {
+                "message": "I'm sorry, I'm having trouble responding right now. Please try again in a moment."
+            })
+    
+    # Starlette cancels the generator if the client disconnects mid-stream
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(persist_completed_turn)
+    )
+
+def lead_filters(
+    created_from: Optional[datetime.datetime] = None,
+    created_to: Optional[datetime.datetime] = None,
+    has_email: Optional[bool] = None,
+    has_phone: Optional[bool] = None,
+    interest: Optional[str] = None,
+    program: Optional[List[str]] = Query(None)
+) -> LeadFilters:
+    """Lead filters from the query string; `program` may be repeated and matches any of them"""
+    unknown = [name for name in program or [] if name not in PROGRAM_KEYWORDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown program(s): {', '.join(unknown)}. Programs: {', '.join(PROGRAM_KEYWORDS)}"
         )
+    return LeadFilters(created_from, created_to, has_email, has_phone, interest, program)
+
+@app.get("/leads", response_model=LeadPage, response_model_exclude_unset=True)
+async def get_leads(
+    limit: int = Query(50, ge=1, le=LEADS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include_conversation: bool = False,
+    filters: LeadFilters = Depends(lead_filters),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get captured leads, newest first, one page at a time.
+    
+    Pass the returned next_cursor back as `cursor` for the following page.
+    """
+    try:
+        query = lead_page_query(limit, cursor, filters, include_conversation)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    rows = (await db.execute(query)).mappings().all()
+    items = [dict(row) for row in rows[:limit]]
+    if include_conversation:
+        await attach_conversations(db, items)
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/leads/facets", response_model=List[ProgramFacet])
+async def get_lead_facets(filters: LeadFilters = Depends(lead_filters), db: AsyncSession = Depends(get_async_db)):
+    """
+    Number of leads interested in each program, among the leads matching the
+    same filters as /leads (the program filter itself is ignored).
+    """
+    result = await db.execute(program_facet_query(filters))
+    return [{"program": program, "count": count} for program, count in result.all()]
+
+@app.get("/leads/stats", response_model=LeadStatsResponse)
+async def get_lead_stats(days: Optional[int] = Query(None, ge=1), db: AsyncSession = Depends(get_async_db)):
+    """
+    Lead analytics: leads per day (the last `days` days if given), field
+    completion, interest distribution and the conversion funnel. Served from
+    counters maintained on write, so the cost doesn't grow with the table.
+    """
+    return await read_lead_stats(db, days)
 
-@app.get("/leads", response_model=List[LeadResponse])
-def get_leads(db: Session = Depends(get_db)):
+@app.post("/leads/stats/recompute", response_model=LeadStatsResponse)
+async def recompute_stats(db: AsyncSession = Depends(get_async_db)):
     """
-    Get all captured leads.
+    Rebuild the analytics counters from the leads table, e.g. after importing
+    leads directly into the database.
     """
-    leads = db.query(Lead).all()
-    return leads
+    async with async_engine.begin() as connection:
+        await connection.run_sync(recompute_lead_stats)
+    return await read_lead_stats(db)
 
-@app.get("/leads/{lead_id}", response_model=LeadResponse)
-def get_lead(lead_id: int, db: Session = Depends(get_db)):
+@app.get("/leads/{lead_id}", response_model=LeadResponse, response_model_exclude_unset=True)
+async def get_lead(lead_id: int, include_conversation: bool = False, db: AsyncSession = Depends(get_async_db)):
     """
     Get a specific lead by ID.
     """
-    lead = db.query(Lead).filter(Lead.id == lead_id).first()
-    if lead is None:
+    row = (await db.execute(lead_detail_query(lead_id, include_conversation))).mappings().first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Lead not found")
+    lead = dict(row)
+    if include_conversation:
+        await attach_conversations(db, [lead])
     return lead
 
+@app.get("/leads/{lead_id}/messages", response_model=MessagePage)
+async def get_lead_messages(
+    lead_id: int,
+    after_seq: int = -1,
+    limit: int = Query(50, ge=1, le=MESSAGE_PAGE_MAX_SIZE),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Page through the messages of a lead's conversation, oldest first.
+    
+    Pass the returned next_after_seq back as `after_seq` for the following page.
+    """
+    row = (await db.execute(lead_detail_query(lead_id))).mappings().first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Lead not found")
+    conversation_id = row["conversation_id"]
+    if conversation_id is None:
+        return MessagePage()
+    
+    rows = (await db.execute(message_page_query(conversation_id, after_seq, limit))).mappings().all()
+    items = [dict(message) for message in rows[:limit]]
+    next_after_seq = items[-1]["seq"] if len(rows) > limit else None
+    return MessagePage(conversation_id=conversation_id, items=items, next_after_seq=next_after_seq)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Metrics in the Prometheus text format: per-stage chat latency histograms,
+    retries, answer paths, token usage, cache lookups and in-flight requests.
+    """
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/test-openai")
 async def test_openai_connection():
     """Test the OpenAI connection directly"""
     try:
-        client = get_openai_client()
-        print("DIAGNOSTIC: OpenAI client created successfully")
+        # The shared client, so this also exercises its connection pool
+        client = lead_agent.client
         
         # First, try a simple models list call
         try:
             print("DIAGNOSTIC: Testing models endpoint")
-            models = client.models.list()
+            models = await client.models.list()
             print(f"DIAGNOSTIC: Models endpoint successful, found {len(models.data)} models")
         except Exception as e:
             print(f"DIAGNOSTIC: Models endpoint failed: {str(e)}")
         
         # Then try a chat completion
         print("DIAGNOSTIC: Testing chat completions endpoint")
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": "Say 'Connection successful'"}],
             max_tokens=20
@@ -211,29 +543,33 @@ async def test_openai_connection():
             "api_key_prefix": os.getenv("OPENAI_API_KEY")[:5] + "..." if os.getenv("OPENAI_API_KEY") else "None"
         }
 
+@app.get("/livez")
+async def liveness():
+    """
+    Liveness probe: the process is up and its event loop is serving requests.
+    Never touches a dependency, so a database outage doesn't get the process restarted.
+    """
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness(response: Response):
+    """
+    Readiness probe: 200 while every required dependency passed its latest
+    background check, 503 otherwise. Reads stored results only.
+    """
+    ready = health_prober.ready
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "ready" if ready else "unavailable", "checks": health_prober.snapshot()}
+
 @app.get("/health")
 async def health_check():
     """
     Health check endpoint that provides detailed backend status information.
-    This helps the frontend determine if the backend is operational.
+    This helps the frontend determine if the backend is operational. Dependency
+    status comes from the background prober, so this makes no calls of its own.
     """
-    try:
-        # Check basic API functionality
-        client = get_openai_client()
-        openai_status = "healthy"
-    except Exception as e:
-        openai_status = f"error: {str(e)}"
-    
-    # Check database connection
-    db_status = "unknown"
-    try:
-        # Get DB session
-        db = next(get_db())
-        # Test a simple query
-        db.execute("SELECT 1").fetchall()
-        db_status = "healthy"
-    except Exception as e:
-        db_status = f"error: {str(e)}"
+    checks = health_prober.snapshot()
     
     # Deployment information
     env = os.getenv("ENVIRONMENT", "development")
@@ -244,7 +580,11 @@ async def health_check():
         "version": "1.0.0",
         "timestamp": time.time(),
         "components": {
-            "database": db_status,
-            "openai_api": openai_status
-        }
-    } 
\ No newline at end of file
+            name: "healthy" if check["healthy"] else check["detail"] for name, check in checks.items()
+        },
+        "checks": checks,
+        "traces": tracing.trace_exporter.stats(),
+        "openai_circuit": lead_agent.breaker.snapshot(),
+        "response_cache": lead_agent.response_cache.stats(),
+        "lead_writer": lead_writer.stats()
+    }
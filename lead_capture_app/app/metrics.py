@@ -0,0 +1,223 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from sub-millisecond local work up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+_registry = []
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            # Exported from the start, at zero
+            self.labels()
+        _registry.append(self)
+
+    def labels(self, *values):
+        """Child metric for these label values; keep a reference on hot paths to skip the lookup"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+class Counter(_Metric):
+    """
+    Monotonic count; call inc() on the metric itself or on .labels(...). With a
+    callback, the values are read at scrape time instead, for counts another
+    object already keeps: the callback returns {label values tuple: value}.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        if self.callback is not None:
+            values = self.callback().items()
+        else:
+            values = ((labels, child.value) for labels, child in self._children.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in values]
+
+class Gauge(Counter):
+    """Value that goes up and down; also takes a scrape-time callback"""
+    kind = "gauge"
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+class Histogram(_Metric):
+    """Distribution over fixed buckets; observe() is a bisect and three additions"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _samples(self):
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+def render() -> str:
+    """Every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Chat turn instrumentation, shared across the app
+CHAT_STAGE_SECONDS = Histogram(
+    "chat_stage_duration_seconds",
+    "Time spent in each stage of a chat turn",
+    ("stage",)
+)
+CHAT_TURNS = Counter(
+    "chat_turns_total",
+    "Chat turns by how they were answered (llm, intent, cache, fallback)",
+    ("path",)
+)
+OPENAI_RETRIES = Counter("openai_retries_total", "OpenAI calls retried after a failed attempt")
+OPENAI_TOKENS = Counter(
+    "openai_tokens_total",
+    "Tokens reported in the usage field of OpenAI responses (cached_prompt is the part of prompt served from the prompt cache)",
+    ("kind",)
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+
+# Stage timers, resolved once so the hot path skips the label lookup
+PROMPT_ASSEMBLY = CHAT_STAGE_SECONDS.labels("prompt_assembly")
+LLM_CALL = CHAT_STAGE_SECONDS.labels("llm_call")
+LEAD_PARSE = CHAT_STAGE_SECONDS.labels("lead_parse")
+LEAD_EXTRACTION = CHAT_STAGE_SECONDS.labels("lead_extraction")
+DB_UPSERT = CHAT_STAGE_SECONDS.labels("db_upsert")
+TOTAL = CHAT_STAGE_SECONDS.labels("total")
+
+def record_usage(usage) -> Tuple[int, int]:
+    """
+    Add an OpenAI `usage` object to the token counters and return its prompt
+    tokens as (cached, uncached); cached ones came from the provider's prompt cache.
+    """
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = min(getattr(details, "cached_tokens", 0) or 0, prompt_tokens)
+    OPENAI_TOKENS.labels("prompt").inc(prompt_tokens)
+    OPENAI_TOKENS.labels("cached_prompt").inc(cached)
+    OPENAI_TOKENS.labels("completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+    return cached, prompt_tokens - cached
+
+class InFlightMiddleware:
+    """Pure ASGI middleware tracking in-flight HTTP requests (cheaper than BaseHTTPMiddleware)"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            HTTP_IN_FLIGHT.dec()
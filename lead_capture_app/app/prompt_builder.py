@@ -0,0 +1,80 @@
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+from .history import MESSAGE_TOKEN_OVERHEAD, count_message_tokens, count_tokens
+
+# OpenAI only caches prompt prefixes of at least this many tokens
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# What to ask for while each lead field is still missing, in asking order
+MISSING_FIELD_HINTS = (
+    ("name", "name (try to ask for their name naturally)"),
+    ("email", "email address (ask when discussing updates or newsletter)"),
+    ("phone", "phone number (ask when discussing volunteer opportunities)"),
+    ("interests", "areas of interest (ask what programs they're most interested in)"),
+)
+
+def collection_reminder(missing: Tuple[str, ...]) -> str:
+    """Reminder telling the model which lead fields it still has to collect"""
+    if not missing:
+        return ""
+    hints = [hint for field, hint in MISSING_FIELD_HINTS if field in missing]
+    return f"""
+Remember to collect the following information in your response if appropriate:
+{', '.join(hints)}
+
+Ask for just ONE piece of missing information in your next response, in a natural and conversational way.
+"""
+
+class PromptSegment:
+    """A message that is built once and reused verbatim, with its token count"""
+    __slots__ = ("message", "tokens")
+
+    def __init__(self, role: str, content: str):
+        self.message = {"role": role, "content": content}
+        self.tokens = count_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+
+class PromptBuilder:
+    """
+    Lays out chat prompts for provider-side prompt caching.
+
+    Providers cache the longest prompt prefix they have seen recently, so the
+    layout is: the static system prompt, byte-identical on every request; then
+    the history window; then the per-turn part (the user message and the
+    collection reminder). Nothing that changes per turn comes before the
+    window, so each request can reuse the cached prefix of the one before.
+    Once older turns are summarized, the window only grows at the end between
+    the turns where HistoryManager moves its split (every SUMMARY_BLOCK_MESSAGES
+    messages) or pins a newly captured lead detail; on those turns only the
+    system prompt is reused. The static segments and every reminder variant
+    are built once, with their token counts.
+    """
+    def __init__(self, system_prompt: str):
+        self.prefix = PromptSegment("system", system_prompt)
+        # One reminder per non-empty combination of missing fields; only 15, so all are built up front
+        fields = [field for field, _ in MISSING_FIELD_HINTS]
+        self.reminders = {}
+        for size in range(1, len(fields) + 1):
+            for missing in itertools.combinations(fields, size):
+                self.reminders[missing] = PromptSegment("system", collection_reminder(missing))
+        if self.prefix.tokens < PROMPT_CACHE_MIN_TOKENS:
+            print(f"DIAGNOSTIC: Static prompt prefix is {self.prefix.tokens} tokens, "
+                  f"below the {PROMPT_CACHE_MIN_TOKENS} needed for prompt caching")
+
+    def reminder(self, collected_info: Dict[str, bool]) -> Optional[PromptSegment]:
+        missing = tuple(field for field, _ in MISSING_FIELD_HINTS if not collected_info[field])
+        return self.reminders.get(missing)
+
+    def build(self, window: List[Dict], user_message: str, collected_info: Dict[str, bool]) -> List[Dict]:
+        """The messages for one turn"""
+        messages = [self.prefix.message]
+        messages.extend(window)
+        messages.append({"role": "user", "content": user_message})
+        reminder = self.reminder(collected_info)
+        if reminder is not None:
+            messages.append(reminder.message)
+        return messages
+
+    def count_tokens(self, messages: List[Dict]) -> int:
+        """Estimated prompt tokens of messages from build(); the static prefix is already counted"""
+        return self.prefix.tokens + sum(count_message_tokens(msg) for msg in messages[1:])
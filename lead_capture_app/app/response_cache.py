@@ -0,0 +1,92 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from .conversation_cache import history_prefix_keys
+from .lead_state import EMAIL_PATTERN, LeadCollectionState
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+# Only early turns repeat across visitors, so longer histories are never cached
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("RESPONSE_CACHE_MAX_HISTORY", "4"))
+
+NON_WORD = re.compile(r"[^\w\s]")
+# Seven or more digits however they are grouped, e.g. "021 555 0142"; looser than
+# PHONE_PATTERNS, since a missed number here is served to other visitors
+PHONE_LIKE = re.compile(r"(?:\d[\s().-]?){7,}")
+
+def normalize_message(message: str) -> str:
+    """Case-fold, drop punctuation and collapse whitespace: "Hi!!" and "hi" share an entry"""
+    return " ".join(NON_WORD.sub(" ", message.lower()).split())
+
+def contains_personal_data(text: str) -> bool:
+    return bool(EMAIL_PATTERN.search(text)) or bool(PHONE_LIKE.search(text))
+
+class ResponseCache:
+    """
+    TTL + LRU cache of assistant replies for repeat FAQ turns.
+
+    Entries are keyed on the normalized user message, a hash of the history so
+    far and the lead-collection flags. Turns that involve personal data are
+    never cached.
+    """
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL_SECONDS,
+                 max_history: int = RESPONSE_CACHE_MAX_HISTORY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_history = max_history
+        self._entries = OrderedDict()  # key -> (expires_at, message)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0  # Turns not eligible for caching
+        self.evictions = 0
+
+    def make_key(self, user_message: str, conversation_history: List[Any],
+                 lead_state: LeadCollectionState) -> Optional[str]:
+        """Cache key for a turn, or None if the turn must not be cached"""
+        history = conversation_history or []
+        if (len(history) > self.max_history
+                or contains_personal_data(user_message)
+                or lead_state.name or lead_state.email or lead_state.phone):
+            self.skipped += 1
+            return None
+        flags = "".join("1" if lead_state.collected[field] else "0" for field in sorted(lead_state.collected))
+        return f"{normalize_message(user_message)}|{history_prefix_keys(history)[-1]}|{flags}"
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, message: str):
+        # A reply that echoes contact details stays out of the cache too
+        if contains_personal_data(message):
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, message)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
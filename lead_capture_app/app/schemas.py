@@ -10,10 +10,17 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     conversation_history: Optional[List[ChatMessage]] = []
+    # When set, history is loaded server-side and conversation_history is ignored
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     message: str
     captured_lead_info: Optional[Dict] = None
+    session_id: Optional[str] = None
+
+class SessionResponse(BaseModel):
+    session_id: str
+    conversation_history: List[ChatMessage] = []
     
 class LeadCreate(BaseModel):
     name: Optional[str] = None
@@ -49,6 +56,49 @@ class LeadResponse(BaseModel):
     phone: Optional[str] = None
     interests: Optional[str] = None
     created_at: datetime.datetime
+    conversation_id: Optional[str] = None
+    # Only present when requested with include_conversation
+    conversation: Optional[str] = None
     
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+class LeadPage(BaseModel):
+    items: List[LeadResponse]
+    # Pass as `cursor` to fetch the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+class ConversationMessageResponse(BaseModel):
+    seq: int
+    role: str
+    content: str
+    token_count: int
+    created_at: datetime.datetime
+
+class MessagePage(BaseModel):
+    conversation_id: Optional[str] = None
+    items: List[ConversationMessageResponse] = []
+    # Pass as `after_seq` to fetch the next page; None on the last page
+    next_after_seq: Optional[int] = None
+
+class FieldCompletion(BaseModel):
+    count: int
+    rate: float
+
+class FunnelStage(BaseModel):
+    stage: str
+    count: int
+    rate: float
+
+class LeadStatsResponse(BaseModel):
+    total_leads: int
+    total_conversations: int
+    leads_per_day: Dict[str, int]
+    field_completion: Dict[str, FieldCompletion]
+    # Leads per canonical program
+    programs: Dict[str, int]
+    funnel: List[FunnelStage]
+
+class ProgramFacet(BaseModel):
+    program: str
+    count: int
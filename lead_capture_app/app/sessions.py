@@ -0,0 +1,135 @@
+import datetime
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from .conversation_store import append_messages, last_message, load_messages
+from .database import AsyncSessionLocal, ChatSession
+from . import tracing
+
+# Number of sessions kept in memory and how long an idle one stays there
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+# Tries at an append that keeps losing the race for the next position to concurrent appends
+SESSION_APPEND_ATTEMPTS = 5
+
+class SessionStore:
+    """
+    Keeps chat histories server-side.
+    
+    conversation_messages is the store of record. Recently used sessions are
+    also kept in an in-memory LRU with idle-time (TTL) eviction, so a turn only
+    reads the messages added since this process last saw the session (by
+    another worker or a concurrent request), not the whole history.
+    """
+    def __init__(self, max_size: int = SESSION_CACHE_SIZE, ttl: float = SESSION_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache = OrderedDict()  # session_id -> (last_used, history)
+        self._lock = threading.Lock()
+    
+    async def create(self) -> str:
+        """Start a new, empty session and return its id"""
+        session_id = uuid.uuid4().hex
+        async with AsyncSessionLocal() as db:
+            db.add(ChatSession(id=session_id))
+            await db.commit()
+        self._remember(session_id, [])
+        return session_id
+    
+    async def get(self, session_id: str) -> Optional[List[Dict]]:
+        """Return a copy of the session history, or None if the session does not exist"""
+        history = None
+        with self._lock:
+            entry = self._cache.get(session_id)
+            if entry is not None:
+                last_used, cached = entry
+                if time.monotonic() - last_used <= self.ttl:
+                    history = cached
+                else:
+                    del self._cache[session_id]
+        
+        if history is not None:
+            # The copy may be behind the database; fetch only the messages it is missing
+            with tracing.span("db.session_refresh") as refresh_span:
+                async with AsyncSessionLocal() as db:
+                    newer = await load_messages(db, session_id, len(history))
+                refresh_span.set_attribute("messages", len(newer))
+            history = history + newer
+            self._remember(session_id, history)
+            return list(history)
+        
+        # Cache miss or expired entry, load the whole session
+        with tracing.span("db.session_load") as load_span:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(select(ChatSession.id).where(ChatSession.id == session_id))
+                if result.scalar_one_or_none() is None:
+                    return None
+                history = await load_messages(db, session_id)
+            load_span.set_attribute("messages", len(history))
+        self._remember(session_id, history)
+        return list(history)
+    
+    async def append(self, session_id: str, messages: List[Dict]):
+        """
+        Add messages to the end of a session's history.
+        
+        The position is read inside the write transaction, so messages appended
+        meanwhile by another worker or request are never overwritten or skipped;
+        if two appends race for the same position, the loser retries.
+        """
+        history = await self.get(session_id)
+        if history is None:
+            raise KeyError(session_id)
+        
+        # Only the new messages are written, however long the session is
+        with tracing.span("db.session_append", messages=len(messages)) as append_span:
+            for attempt in range(1, SESSION_APPEND_ATTEMPTS + 1):
+                try:
+                    async with AsyncSessionLocal() as db:
+                        start_seq, _ = await last_message(db, session_id)
+                        await append_messages(db, session_id, messages, start_seq, skip_existing=False)
+                        await db.execute(
+                            update(ChatSession)
+                            .where(ChatSession.id == session_id)
+                            .values(updated_at=datetime.datetime.utcnow())
+                        )
+                        await db.commit()
+                    break
+                except IntegrityError:
+                    if attempt == SESSION_APPEND_ATTEMPTS:
+                        raise
+                    append_span.set_attribute("retries", attempt)
+            
+            if start_seq == len(history):
+                history.extend(messages)
+            else:
+                # Other messages landed in between; reload so our copy matches the stored order
+                async with AsyncSessionLocal() as db:
+                    history = await load_messages(db, session_id)
+        self._remember(session_id, history)
+    
+    def _remember(self, session_id: str, history: List[Dict]):
+        with self._lock:
+            self._cache[session_id] = (time.monotonic(), history)
+            self._cache.move_to_end(session_id)
+            self._evict()
+    
+    def _evict(self):
+        # Drop expired sessions from the cold end, then enforce the size bound
+        now = time.monotonic()
+        while self._cache:
+            oldest_id, (last_used, _) = next(iter(self._cache.items()))
+            if now - last_used <= self.ttl:
+                break
+            del self._cache[oldest_id]
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+session_store = SessionStore()
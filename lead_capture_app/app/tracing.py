@@ -0,0 +1,240 @@
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# Fraction of requests (and lead writer flushes) that are traced, decided when the trace starts; off by default
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# JSON lines file the finished spans are appended to
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+# Past this size the file is moved to TRACE_FILE.1 (replacing the previous one) and a new one started
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(50 * 1024 * 1024)))
+# Finished spans waiting for the exporter thread; more than this and spans are dropped
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+
+REQUEST_ID_HEADER = "x-request-id"
+# Client-supplied request ids are echoed back, so keep them short and printable
+REQUEST_ID_PATTERN = re.compile(r"^[\w.:-]{1,64}$")
+
+# Innermost open span of the current task; None when the task is not being traced
+_current_span = contextvars.ContextVar("current_span", default=None)
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+class Span:
+    """One timed operation of a trace"""
+    recording = True
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start", "_started", "duration", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, attributes: Optional[Dict] = None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration = time.perf_counter() - self._started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+class _NoopSpan:
+    """Stand-in yielded when the current task is not sampled, so callers never branch"""
+    recording = False
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class TraceExporter:
+    """
+    Writes finished spans to a JSON lines file from a background thread.
+
+    export() only puts the span on a bounded queue, so request handlers never
+    wait on file I/O; if the writer falls behind, spans are dropped and counted
+    rather than queued without limit. The file is rotated at max_bytes, so at
+    most two files' worth of spans is kept on disk.
+    """
+    def __init__(self, path: str = TRACE_FILE, max_queue: int = TRACE_QUEUE_SIZE,
+                 max_bytes: int = TRACE_FILE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self.exported = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Write out the queued spans and stop the thread"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def export(self, span: Span):
+        if self._thread is None:
+            return
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": self._queue.qsize(), "exported": self.exported, "dropped": self.dropped,
+                "rotations": self.rotations}
+
+    def _run(self):
+        try:
+            f = open(self.path, "a", encoding="utf-8")
+        except OSError as e:
+            print(f"DIAGNOSTIC: Trace exporter disabled, can't open {self.path}: {str(e)}")
+            self._thread = None
+            return
+        try:
+            while True:
+                # Block for one span, then take whatever else is queued as a batch
+                batch = [self._queue.get()]
+                while len(batch) < 500:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stopping = None in batch
+                lines = [json.dumps(span.to_dict(), default=str) for span in batch if span is not None]
+                if lines:
+                    f.write("\n".join(lines) + "\n")
+                    f.flush()
+                    self.exported += len(lines)
+                    if self.max_bytes > 0 and f.tell() >= self.max_bytes:
+                        f = self._rotate(f)
+                if stopping:
+                    return
+        finally:
+            f.close()
+
+    def _rotate(self, f):
+        f.close()
+        os.replace(self.path, self.path + ".1")
+        self.rotations += 1
+        return open(self.path, "a", encoding="utf-8")
+
+trace_exporter = TraceExporter()
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+@contextmanager
+def trace(name: str, sample_rate: Optional[float] = None, **attributes):
+    """
+    Start a new trace with `name` as its root span. Whether the trace is recorded
+    is decided here, once (head sampling): spans opened under an unsampled root
+    cost a context variable lookup and nothing else.
+    """
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or random.random() >= rate:
+        token = _current_span.set(None)
+        try:
+            yield NOOP_SPAN
+        finally:
+            _current_span.reset(token)
+        return
+    root = Span(name, uuid.uuid4().hex, attributes=attributes)
+    with _recording(root):
+        yield root
+
+@contextmanager
+def span(name: str, **attributes):
+    """Child span of the innermost open span; a no-op outside a sampled trace"""
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    child = Span(name, parent.trace_id, parent.span_id, attributes)
+    with _recording(child):
+        yield child
+
+@contextmanager
+def _recording(current: Span):
+    token = _current_span.set(current)
+    try:
+        yield
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+        trace_exporter.export(current)
+
+class RequestTracingMiddleware:
+    """
+    Pure ASGI middleware giving every HTTP request an id and a root span.
+
+    The id is taken from an incoming X-Request-ID header if it looks sane, else
+    generated, and is returned in the X-Request-ID response header either way.
+    The root span covers the whole request, including background tasks that run
+    after the response has been sent.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope["headers"]:
+            if key == REQUEST_ID_HEADER.encode():
+                candidate = value.decode("latin-1")
+                if REQUEST_ID_PATTERN.match(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = _request_id.set(request_id)
+
+        with trace("http.request", request_id=request_id, method=scope["method"], path=scope["path"]) as root:
+            async def send_with_request_id(message):
+                if message["type"] == "http.response.start":
+                    root.set_attribute("status_code", message["status"])
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (REQUEST_ID_HEADER.encode(), request_id.encode())
+                    ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_request_id)
+            finally:
+                _request_id.reset(token)
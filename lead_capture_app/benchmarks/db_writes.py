@@ -0,0 +1,117 @@
+"""
+SQLite write throughput with the default journal settings vs the tuned pragmas.
+
+Concurrent writers each commit lead upserts plus a two-message conversation
+append (what the lead writer and session store do per turn) while readers
+page through /leads. Each mode runs against a fresh database file.
+
+Run from lead_capture_app/:
+    python -m benchmarks.db_writes --writers 8 --transactions 200 --readers 2
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.conversation_store import append_messages
+from app.database import Base, SQLITE_PRAGMAS, apply_sqlite_pragmas, begin_write
+from app.lead_queries import lead_page_query
+from app.lead_writer import upsert_lead
+
+# SQLite's own defaults, as the app ran before the pragmas were added
+DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+async def run_mode(name, pragmas, writers, transactions, readers):
+    directory = tempfile.mkdtemp(prefix="leads-bench-")
+    url = f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.db')}"
+    engine = create_async_engine(url)
+    event.listen(engine.sync_engine, "connect", lambda connection, record: apply_sqlite_pragmas(connection, pragmas))
+    sessions = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+    latencies = []
+    errors = 0
+    reads = 0
+    writing = True
+
+    async def writer(worker):
+        nonlocal errors
+        for n in range(transactions):
+            row = {
+                "name": f"Lead {worker}-{n}", "email": f"lead{worker}-{n}@example.org", "phone": None,
+                "email_key": f"lead{worker}-{n}@example.org", "phone_key": None,
+                "interests": "Community Fitness", "conversation_id": f"c{worker}-{n}",
+                "created_at": datetime.datetime.utcnow()
+            }
+            started = time.perf_counter()
+            try:
+                async with sessions() as db:
+                    await begin_write(db)
+                    await upsert_lead(db, row)
+                    await append_messages(db, row["conversation_id"], [
+                        {"role": "user", "content": "Tell me about the fitness programme"},
+                        {"role": "assistant", "content": "Our Community Fitness Programme offers free boot camps."}
+                    ], 0)
+                    await db.commit()
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+
+    async def reader():
+        nonlocal reads
+        while writing:
+            async with sessions() as db:
+                await db.execute(lead_page_query(50))
+            reads += 1
+            await asyncio.sleep(0)
+
+    reader_tasks = [asyncio.create_task(reader()) for _ in range(readers)]
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(worker) for worker in range(writers)))
+    elapsed = time.perf_counter() - started
+    writing = False
+    await asyncio.gather(*reader_tasks)
+    await engine.dispose()
+
+    return {
+        "mode": name,
+        "transactions_per_s": len(latencies) / elapsed,
+        "reads_per_s": reads / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": (statistics.mean(latencies) * 1000) if latencies else 0.0,
+        "errors": errors,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--transactions", type=int, default=200, help="Transactions per writer")
+    parser.add_argument("--readers", type=int, default=2)
+    args = parser.parse_args()
+
+    results = []
+    for name, pragmas in (("default", DEFAULT_PRAGMAS), ("tuned", SQLITE_PRAGMAS)):
+        results.append(await run_mode(name, pragmas, args.writers, args.transactions, args.readers))
+
+    print(f"{'mode':<8} {'tx/s':>9} {'reads/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for result in results:
+        print(f"{result['mode']:<8} {result['transactions_per_s']:>9.1f} {result['reads_per_s']:>9.1f} "
+              f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['errors']:>7}")
+    baseline, tuned = results
+    if baseline["transactions_per_s"]:
+        print(f"Write throughput: {tuned['transactions_per_s'] / baseline['transactions_per_s']:.2f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,207 @@
+"""
+Microbenchmarks for the CPU-side work LeadCaptureAgent does per turn.
+
+Each benchmark runs over synthetic conversations of 1 to 500 turns, so you can
+see how per-turn cost scales with conversation length. "cold" variants clear
+the agent's per-conversation caches (and the token/summary memo caches) before
+every call, the cost of a conversation the process hasn't seen; "warm"
+variants repeat the call with the caches populated, the cost of a turn in an
+ongoing conversation. No network calls are made; _process_chat gets a canned
+completion.
+
+Run from lead_capture_app/:
+    python -m benchmarks.hot_paths                       # print results
+    python -m benchmarks.hot_paths --save baseline.json  # save a baseline
+    python -m benchmarks.hot_paths --compare baseline.json --threshold 0.2
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+DEFAULT_SIZES = (1, 10, 50, 100, 250, 500)
+
+USER_LINES = [
+    "Kia ora, what programs do you run?",
+    "My name is Aroha Ngata",
+    "Tell me more about the Future Wahine mentoring programme for my daughter.",
+    "You can email me at aroha.ngata@example.org",
+    "Is the fitness boot camp free? I want to get healthier with my whānau.",
+    "My number is 021-555-0142 if you need it.",
+    "How do I volunteer with the financial literacy course?",
+]
+ASSISTANT_LINES = [
+    "Kia ora! We run six free programs for Māori and Pacific communities in South Auckland. May I know your name?",
+    "Nice to meet you, Aroha! Which of our programs interests you the most?\n[LEAD_INFO]{\"name\": \"Aroha Ngata\"}[/LEAD_INFO]",
+    "Future Wahine supports young wahine aged 15-18 with mentorship that builds leadership and resilience. Would you like updates by email?",
+    "Thank you! I've noted your email.\n[LEAD_INFO]{\"email\": \"aroha.ngata@example.org\", \"interests\": \"Future Wahine\"}[/LEAD_INFO]",
+    "Yes, our Community Fitness boot camps are free and open to all fitness levels. Sessions run in Papakura, Manurewa and Henderson.",
+    "Thanks, we'll text you about volunteer opportunities.\n[LEAD_INFO]{\"phone\": \"021-555-0142\"}[/LEAD_INFO]",
+    "Whānau Hotaka always welcomes volunteers. Is there anything else you'd like to know?",
+]
+REPLY_WITH_TRAILER = (
+    "Thanks for sharing that! Our Community Fitness Programme runs free seasonal boot camps. "
+    "Would you like me to add your email to our newsletter?\n"
+    "[LEAD_INFO]{\"name\": \"Aroha Ngata\", \"interests\": \"Community Fitness\"}[/LEAD_INFO]"
+)
+NEXT_USER_MESSAGE = "What time do the sessions start in Manurewa?"
+
+def synthetic_history(turns: int):
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": USER_LINES[turn % len(USER_LINES)]})
+        history.append({"role": "assistant", "content": ASSISTANT_LINES[turn % len(ASSISTANT_LINES)]})
+    return history
+
+class CannedCompletion:
+    """Just enough of an OpenAI completion for _process_chat"""
+    class _Message:
+        content = REPLY_WITH_TRAILER
+    class _Choice:
+        pass
+
+    def __init__(self):
+        choice = self._Choice()
+        choice.message = self._Message()
+        self.choices = [choice]
+
+def make_agent():
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    from app.ai_service import LeadCaptureAgent
+
+    agent = LeadCaptureAgent()
+
+    async def canned_completion(**kwargs):
+        return CannedCompletion()
+    agent._create_completion = canned_completion
+    return agent
+
+def clear_caches(agent):
+    from app.history import HistoryManager, count_tokens, summarize_message
+    from app.lead_state import LeadStateCache
+
+    agent.lead_states = LeadStateCache()
+    agent.history_manager = HistoryManager()
+    count_tokens.cache_clear()
+    summarize_message.cache_clear()
+
+def benchmarks(agent, loop):
+    from app.ai_service import LEAD_INFO_PATTERN, LeadInfoStreamFilter
+
+    def lead_info_trailer(history):
+        # What a streamed reply costs: the trailer filter fed in small chunks, then the regex strip
+        stream_filter = LeadInfoStreamFilter()
+        for start in range(0, len(REPLY_WITH_TRAILER), 8):
+            stream_filter.feed(REPLY_WITH_TRAILER[start:start + 8])
+        stream_filter.close()
+        match = LEAD_INFO_PATTERN.search(REPLY_WITH_TRAILER)
+        json.loads(match.group(1))
+        LEAD_INFO_PATTERN.sub("", REPLY_WITH_TRAILER).strip()
+
+    return {
+        "build_messages": lambda history: agent._build_messages(NEXT_USER_MESSAGE, history),
+        "process_chat": lambda history: loop.run_until_complete(agent._process_chat(NEXT_USER_MESSAGE, history)),
+        # A whole turn (routing, cache lookup, prompt and local scan), as a stateless client sends it
+        "chat": lambda history: loop.run_until_complete(agent.chat(NEXT_USER_MESSAGE, history)),
+        "analyze_conversation": lambda history: agent._analyze_conversation(history),
+        "lead_info_trailer": lead_info_trailer,
+        "fallback_response": lambda history: agent._get_fallback_response(NEXT_USER_MESSAGE, history),
+        "find_name": lambda history: agent._find_name_in_conversation(history),
+        "find_email": lambda history: agent._find_email_in_conversation(history),
+        "find_phone": lambda history: agent._find_phone_in_conversation(history),
+        "find_interests": lambda history: agent._find_interests_in_conversation(history),
+    }
+
+def time_call(function, history, agent, cold: bool, min_time: float, repeats: int) -> float:
+    """Median microseconds per call over `repeats` rounds of at least min_time seconds each"""
+    # Warm the caches once so warm rounds measure the steady state
+    function(history)
+    rounds = []
+    for _ in range(repeats):
+        elapsed = 0.0
+        calls = 0
+        while elapsed < min_time or calls == 0:
+            if cold:
+                clear_caches(agent)
+            started = time.perf_counter()
+            function(history)
+            elapsed += time.perf_counter() - started
+            calls += 1
+        rounds.append(elapsed / calls * 1e6)
+    return statistics.median(rounds)
+
+def run(sizes, selected, min_time: float, repeats: int):
+    agent = make_agent()
+    loop = asyncio.new_event_loop()
+    results = {}
+    try:
+        for name, function in benchmarks(agent, loop).items():
+            if selected and not any(part in name for part in selected):
+                continue
+            # The trailer filter only sees the new reply, so there is no cache to be cold
+            for cold in ((False,) if name == "lead_info_trailer" else (True, False)):
+                for turns in sizes:
+                    history = synthetic_history(turns)
+                    key = f"{name}/{'cold' if cold else 'warm'}/{turns}"
+                    results[key] = round(time_call(function, history, agent, cold, min_time, repeats), 3)
+                    print(f"{key:<40} {results[key]:>12.1f} us", flush=True)
+    finally:
+        loop.close()
+    return results
+
+def compare(results, baseline_path: str, threshold: float) -> int:
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    slower = []
+    print(f"\n{'benchmark':<40} {'baseline us':>12} {'now us':>12} {'change':>8}")
+    for key, value in results.items():
+        if key not in baseline:
+            continue
+        change = value / baseline[key] - 1 if baseline[key] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  SLOWER"
+            slower.append(key)
+        print(f"{key:<40} {baseline[key]:>12.1f} {value:>12.1f} {change:>+7.0%}{flag}")
+    if slower:
+        print(f"\n{len(slower)} benchmark(s) more than {threshold:.0%} slower than {baseline_path}")
+        return 1
+    print(f"\nNo benchmark more than {threshold:.0%} slower than {baseline_path}")
+    return 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma-separated conversation lengths in turns")
+    parser.add_argument("--only", default="", help="Comma-separated benchmark name fragments to run")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Seconds per measurement round")
+    parser.add_argument("--repeats", type=int, default=5, help="Rounds per benchmark; the median is reported")
+    parser.add_argument("--save", help="Write the results to this JSON baseline")
+    parser.add_argument("--compare", help="Compare against this JSON baseline and exit 1 on slowdowns")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    selected = [part for part in args.only.split(",") if part]
+    results = run(sizes, selected, args.min_time, args.repeats)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "created_at": datetime.datetime.utcnow().isoformat(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "results": results
+            }, f, indent=2)
+        print(f"\nSaved {len(results)} results to {args.save}")
+    if args.compare:
+        return compare(results, args.compare, args.threshold)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+End-to-end load test of the chat API against a stub LLM, with no network access.
+
+The FastAPI app runs in-process (httpx ASGI transport, lifespan included) on a
+fresh SQLite database. Every OpenAI call is answered by a stub behind
+httpx.MockTransport with configurable latency and error rate. N synthetic
+conversations of varying length are driven with fixed concurrency, and the
+run reports request latency percentiles, requests/s and database write rates.
+
+Run from lead_capture_app/:
+    python -m benchmarks.load_test --conversations 200 --concurrency 20 --turns 2-8 \\
+        --llm-latency-ms 300 --llm-error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+EMAIL_IN_TEXT = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+NAME_IN_TEXT = re.compile(r"my name is ([A-Z][a-z]+ [A-Z][a-z]+)")
+
+USER_TURNS = [
+    "Kia ora",
+    "What programs do you offer for young people in South Auckland?",
+    "My name is {name}",
+    "How does the Future Wahine mentoring work and who can join?",
+    "You can reach me at {email}",
+    "Is the fitness boot camp suitable for beginners, and where is it held?",
+    "My number is 021 {phone}",
+    "Can my whole whānau come along to the financial literacy course?",
+    "What would I need to bring to the first session?",
+    "Thanks, that is really helpful!",
+]
+FIRST_NAMES = ["Aroha", "Tama", "Mere", "Sione", "Ana", "Wiremu", "Losa", "Hemi"]
+LAST_NAMES = ["Ngata", "Tuilagi", "Parata", "Faleolo", "Walker", "Smith"]
+
+class StubLLM:
+    """OpenAI chat completions stand-in with lognormal latency and random failures"""
+    def __init__(self, latency_ms: float, jitter: float, error_rate: float, error_status: int, seed: int):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/models"):
+            # The app's background OpenAI health check
+            return httpx.Response(200, json={"object": "list", "data": []})
+        self.calls += 1
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.latency_ms / 1000 * self.random.lognormvariate(0, self.jitter))
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            return httpx.Response(self.error_status, json={"error": {"message": "stub failure", "type": "server_error"}})
+
+        body = json.loads(request.content or b"{}")
+        prompt = " ".join(str(message.get("content", "")) for message in body.get("messages", []))
+        if body.get("response_format"):
+            return self._completion(json.dumps(self._extract(prompt)))
+        reply = ("Thanks for your question! Our programs are free and open to the community. "
+                 "May I know your name so I can address you properly?")
+        if body.get("stream"):
+            return self._stream(reply)
+        return self._completion(reply)
+
+    def _extract(self, prompt: str):
+        email = EMAIL_IN_TEXT.search(prompt)
+        name = NAME_IN_TEXT.search(prompt)
+        return {
+            "name": name.group(1) if name else None,
+            "email": email.group(0) if email else None,
+            "phone": None,
+            "interests": "Future Wahine" if "Wahine" in prompt else None
+        }
+
+    def _completion(self, content: str) -> httpx.Response:
+        return httpx.Response(200, json={
+            "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(content) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": len(content) // 2}
+        })
+
+    def _stream(self, content: str) -> httpx.Response:
+        events = []
+        for start in range(0, len(content), 12):
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                     "choices": [{"index": 0, "delta": {"content": content[start:start + 12]}, "finish_reason": None}]}
+            events.append(f"data: {json.dumps(chunk)}\n\n")
+        events.append("data: [DONE]\n\n")
+        return httpx.Response(200, content="".join(events).encode(), headers={"content-type": "text/event-stream"})
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def parse_range(text: str):
+    low, _, high = text.partition("-")
+    return int(low), int(high or low)
+
+async def run_conversation(client, number, turns, args, results):
+    name = f"{FIRST_NAMES[number % len(FIRST_NAMES)]} {LAST_NAMES[number % len(LAST_NAMES)]}"
+    values = {"name": name, "email": f"visitor{number}@example.org", "phone": f"{5550000 + number}"[-7:]}
+    history = []
+    session_id = None
+    if args.mode == "session":
+        session_id = (await client.post("/sessions")).json()["session_id"]
+
+    for turn in range(turns):
+        message = USER_TURNS[turn % len(USER_TURNS)].format(**values)
+        payload = {"message": message}
+        if session_id:
+            payload["session_id"] = session_id
+        else:
+            payload["conversation_history"] = history
+
+        started = time.perf_counter()
+        try:
+            if args.endpoint == "stream":
+                reply = ""
+                async with client.stream("POST", "/chat/stream", json=payload) as response:
+                    status = response.status_code
+                    async for line in response.aiter_lines():
+                        if line.startswith("data: "):
+                            data = json.loads(line[6:])
+                            if isinstance(data, dict) and "message" in data:
+                                reply = data["message"]
+            else:
+                response = await client.post("/chat", json=payload)
+                status = response.status_code
+                reply = response.json().get("message", "") if status == 200 else ""
+        except Exception:
+            status = None
+            reply = ""
+        results["latencies"].append(time.perf_counter() - started)
+        if status != 200:
+            results["errors"] += 1
+        history = history + [{"role": "user", "content": message}, {"role": "assistant", "content": reply}]
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--turns", default="2-6", help="Turns per conversation, e.g. 4 or 2-8")
+    parser.add_argument("--endpoint", choices=("chat", "stream"), default="chat")
+    parser.add_argument("--mode", choices=("history", "session"), default="history",
+                        help="Send the full history each turn, or use server-side sessions")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Median stub LLM latency")
+    parser.add_argument("--llm-jitter", type=float, default=0.5, help="Lognormal sigma of the stub latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-error-status", type=int, default=500)
+    parser.add_argument("--sdk-retries", type=int, default=2, help="OpenAI SDK retries, as in production")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+    parser.add_argument("--max-p95-ms", type=float, help="Exit with status 1 if p95 latency is above this")
+    parser.add_argument("--max-error-rate", type=float, help="Exit with status 1 if the request error rate is above this")
+    args = parser.parse_args()
+
+    # The app reads its configuration at import time, so point it at a scratch database first
+    directory = tempfile.mkdtemp(prefix="leads-load-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'load.db')}"
+    os.environ.setdefault("TRACE_FILE", os.path.join(directory, "traces.jsonl"))
+    os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+
+    import openai
+    from sqlalchemy import func, select
+    from app import main as app_main
+    from app.ai_service import LeadCaptureAgent
+    from app.database import AsyncSessionLocal, ConversationMessage, Lead
+    from app.lead_writer import lead_writer
+
+    stub = StubLLM(args.llm_latency_ms, args.llm_jitter, args.llm_error_rate, args.llm_error_status, args.seed)
+    # The lifespan keeps an agent that is already set, so this one talks to the stub
+    app_main.lead_agent = LeadCaptureAgent(client=openai.AsyncOpenAI(
+        api_key="sk-stub", max_retries=args.sdk_retries,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(stub.handle))
+    ))
+
+    low, high = parse_range(args.turns)
+    rng = random.Random(args.seed)
+    plan = [rng.randint(low, high) for _ in range(args.conversations)]
+    results = {"latencies": [], "errors": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(number, turns):
+        async with semaphore:
+            await run_conversation(client, number, turns, args, results)
+
+    transport = httpx.ASGITransport(app=app_main.app)
+    async with app_main.lifespan(app_main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=300) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(limited(number, turns) for number, turns in enumerate(plan)))
+            elapsed = time.perf_counter() - started
+    # Leaving the lifespan drained the lead writer, so every queued write is in the database now
+    writer_stats = lead_writer.stats()
+
+    async with AsyncSessionLocal() as db:
+        leads = (await db.execute(select(func.count()).select_from(Lead))).scalar()
+        messages = (await db.execute(select(func.count()).select_from(ConversationMessage))).scalar()
+
+    latencies = results["latencies"]
+    report = {
+        "requests": len(latencies),
+        "errors": results["errors"],
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "mean": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+            "max": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        },
+        "llm": {"calls": stub.calls, "injected_errors": stub.errors},
+        "db": {
+            "leads": leads,
+            "messages": messages,
+            "lead_rows_written_per_s": round(writer_stats["rows_written"] / elapsed, 2),
+            "messages_per_s": round(messages / elapsed, 2),
+            "lead_writer": writer_stats,
+        },
+        "config": {key: value for key, value in vars(args).items() if key != "json_path"},
+    }
+
+    print(f"{report['requests']} requests in {report['elapsed_s']}s "
+          f"({report['requests_per_s']} req/s, {report['errors']} errors)")
+    print("latency ms: " + ", ".join(f"{key} {value}" for key, value in report["latency_ms"].items()))
+    print(f"llm: {stub.calls} calls, {stub.errors} injected errors")
+    print(f"db: {leads} leads, {messages} messages, "
+          f"{report['db']['lead_rows_written_per_s']} lead rows/s, {report['db']['messages_per_s']} messages/s")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.max_p95_ms is not None and report["latency_ms"]["p95"] > args.max_p95_ms:
+        failures.append(f"p95 {report['latency_ms']['p95']}ms > {args.max_p95_ms}ms")
+    error_rate = report["errors"] / report["requests"] if report["requests"] else 0.0
+    if args.max_error_rate is not None and error_rate > args.max_error_rate:
+        failures.append(f"error rate {error_rate:.4f} > {args.max_error_rate}")
+    if failures:
+        print("FAILED: " + "; ".join(failures))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
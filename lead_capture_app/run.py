@@ -1,5 +1,6 @@
 import uvicorn
 import os
+import importlib.util
 from dotenv import load_dotenv
 
 # Load environment variables from .env file if it exists
@@ -11,12 +12,56 @@ if api_key:
     print(f"OpenAI API key loaded (starts with {api_key[:5]}...)")
 else:
     print("WARNING: OpenAI API key not found in environment variables!")
-    
+
+# "production" runs worker processes without the reloader; anything else is the development server
+ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
+# Worker processes in production; defaults to one per core
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+# Idle keep-alive connections stay open this long; keep it above the load balancer's idle timeout
+KEEPALIVE_TIMEOUT_SECONDS = int(os.getenv("KEEPALIVE_TIMEOUT_SECONDS", "75"))
+# On shutdown, how long in-flight chats (and their background lead writes) get to finish
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "25"))
+
+def module_available(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+def prepare_database():
+    """Migrate the database once, before the workers start, instead of in every worker"""
+    from app.database import create_tables
+    from app.lead_stats import ensure_lead_stats
+
+    create_tables()
+    ensure_lead_stats()
+    os.environ["RUN_MIGRATIONS_ON_STARTUP"] = "false"
+
+def server_options() -> dict:
+    if ENVIRONMENT != "production":
+        return {"reload": True}
+
+    # uvloop and httptools come with uvicorn[standard]; without them uvicorn's defaults still work
+    loop = "uvloop" if module_available("uvloop") else "asyncio"
+    http = "httptools" if module_available("httptools") else "h11"
+    if loop == "asyncio" or http == "h11":
+        print("WARNING: uvloop/httptools not installed, install uvicorn[standard] for the faster event loop and parser")
+    return {
+        "workers": WEB_CONCURRENCY,
+        "loop": loop,
+        "http": http,
+        "timeout_keep_alive": KEEPALIVE_TIMEOUT_SECONDS,
+        "timeout_graceful_shutdown": GRACEFUL_SHUTDOWN_SECONDS
+    }
+
 if __name__ == "__main__":
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
-    
-    print(f"Starting Charity Lead Capture API on {host}:{port}")
+
+    options = server_options()
+    if ENVIRONMENT == "production":
+        prepare_database()
+        print(f"Starting Charity Lead Capture API on {host}:{port} "
+              f"({options['workers']} workers, {options['loop']} loop, {options['http']} parser)")
+    else:
+        print(f"Starting Charity Lead Capture API on {host}:{port} (development, auto-reload)")
     print("Make sure to set your OPENAI_API_KEY in the environment variables")
-    
-    uvicorn.run("app.main:app", host=host, port=port, reload=True) 
\ No newline at end of file
+
+    uvicorn.run("app.main:app", host=host, port=port, **options)
@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+# Point the app at a throwaway database before app.database creates its engines
+_data_dir = tempfile.mkdtemp(prefix="lead_capture_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_data_dir, 'leads.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["TRACE_SAMPLE_RATE"] = "0"
+
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from app.database import Base, async_engine, create_tables, engine
+from benchmarks.load_test import StubLLM
+
+@pytest.fixture
+def database():
+    """A freshly created, empty database"""
+    Base.metadata.drop_all(bind=engine)
+    create_tables()
+    yield engine
+
+@pytest.fixture
+def run():
+    """Run a coroutine on a fresh event loop; pooled connections belong to the loop, so they go with it"""
+    def run_coroutine(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await async_engine.dispose()
+        return asyncio.run(main())
+    return run_coroutine
+
+@pytest.fixture
+def stub_llm():
+    return StubLLM(latency_ms=0, jitter=0, error_rate=0, error_status=500, seed=1)
+
+@pytest.fixture
+def serve(database, run, stub_llm, monkeypatch):
+    """Run `scenario(client)` against the app, lifespan included, with the stub LLM behind the agent"""
+    from app import main as app_main
+    from app.ai_service import LeadCaptureAgent
+
+    def serve_scenario(scenario):
+        async def main():
+            monkeypatch.setattr(app_main, "lead_agent", LeadCaptureAgent(client=openai.AsyncOpenAI(
+                api_key="test", max_retries=0,
+                http_client=httpx.AsyncClient(transport=httpx.MockTransport(stub_llm.handle))
+            )))
+            async with app_main.lifespan(app_main.app):
+                transport = httpx.ASGITransport(app=app_main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    return await scenario(client)
+        return run(main())
+    return serve_scenario
@@ -0,0 +1,206 @@
+import asyncio
+import time
+
+import openai
+import pytest
+
+from app import ai_service, conversation_cache
+from app.ai_service import LeadCaptureAgent, LeadInfoStreamFilter
+
+class CannedCompletion:
+    def __init__(self, content):
+        message = type("Message", (), {"content": content})()
+        self.choices = [type("Choice", (), {"message": message})()]
+        self.usage = None
+
+@pytest.fixture
+def agent():
+    agent = LeadCaptureAgent(client=openai.AsyncOpenAI(api_key="test"))
+    agent.calls = []
+
+    async def create_completion(**kwargs):
+        agent.calls.append(kwargs)
+        return CannedCompletion("Our sessions start at 6pm. May I know your name?")
+    agent._create_completion = create_completion
+    return agent
+
+def conversation(turns):
+    history = []
+    for n in range(turns):
+        history.append({"role": "user", "content": f"Tell me more about the sessions, question {n}"})
+        history.append({"role": "assistant", "content": f"Here are the details for question {n}."})
+    return history
+
+def test_stateless_turn_hashes_history_once(agent, run, monkeypatch):
+    hashed = []
+    original = conversation_cache.history_prefix_keys
+
+    def counting_prefix_keys(history):
+        hashed.append(len(history))
+        return original(history)
+    monkeypatch.setattr(conversation_cache, "history_prefix_keys", counting_prefix_keys)
+    monkeypatch.setattr(ai_service, "history_prefix_keys", counting_prefix_keys)
+    # A small budget, so the turn also needs the rolling summary
+    agent.history_manager.token_budget = 200
+
+    history = conversation(40)
+    result = run(agent.chat("What time do the sessions start in Manurewa?", history))
+
+    assert len(agent.calls) == 1
+    assert result["message"].startswith("Our sessions start")
+    assert hashed == [len(history)]
+
+    # Extraction for the turn reuses its lead state instead of hashing the history again
+    run(agent.extract_lead_info("What time do the sessions start in Manurewa?", result["message"],
+                                history, lead_state=result["lead_state"]))
+    assert len(agent.calls) == 2
+    assert hashed == [len(history)]
+
+def test_local_lead_info_ignores_programs_the_assistant_listed(agent):
+    history = [
+        {"role": "user", "content": "What programs do you offer?"},
+        {"role": "assistant", "content": "We offer Community Fitness, Future Wahine, O-Beast and $20 Boss."},
+    ]
+    assert agent._local_lead_info("Thanks, my name is Tama", history) == {"name": "Tama"}
+    assert agent._local_lead_info("Tell me about O-Beast", history) == {"interests": "O-Beast"}
+
+QUESTION = "What time do the sessions start in Manurewa?"
+
+def test_failed_attempts_are_retried_with_backoff(agent, run, monkeypatch):
+    attempts, delays = [], []
+
+    async def flaky_completion(**kwargs):
+        attempts.append(kwargs)
+        if len(attempts) < 3:
+            raise ConnectionError("reset by peer")
+        return CannedCompletion("Our sessions start at 6pm.")
+
+    async def no_sleep(seconds):
+        delays.append(seconds)
+    agent._create_completion = flaky_completion
+    monkeypatch.setattr(ai_service.asyncio, "sleep", no_sleep)
+
+    result = run(agent.chat(QUESTION))
+    assert result["message"] == "Our sessions start at 6pm."
+    assert result["path"] == "llm"
+    assert delays == [agent.retry_delay, agent.retry_delay * 2]
+
+def test_turn_falls_back_once_every_attempt_fails(agent, run):
+    async def failing_completion(**kwargs):
+        agent.calls.append(kwargs)
+        raise ConnectionError("reset by peer")
+    agent._create_completion = failing_completion
+    agent.retry_delay = 0
+
+    result = run(agent.chat(QUESTION))
+    assert len(agent.calls) == agent.max_retries
+    assert result["path"] == "fallback"
+
+def test_slow_completions_do_not_block_other_turns(agent, run):
+    async def slow_completion(**kwargs):
+        await asyncio.sleep(0.2)
+        return CannedCompletion("Our sessions start at 6pm.")
+    agent._create_completion = slow_completion
+
+    async def scenario():
+        started = time.monotonic()
+        await asyncio.gather(*(agent.chat(f"{QUESTION} Asking for friend {n}") for n in range(5)))
+        return time.monotonic() - started
+    assert run(scenario()) < 0.6
+
+def test_cancelling_a_turn_abandons_its_retry_sleep(agent, run):
+    async def failing_completion(**kwargs):
+        raise ConnectionError("reset by peer")
+    agent._create_completion = failing_completion
+    agent.retry_delay = 30
+
+    async def scenario():
+        task = asyncio.create_task(agent.chat(QUESTION))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        started = time.monotonic()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return time.monotonic() - started
+    assert run(scenario()) < 1
+
+REPLY_WITH_TRAILER = 'Kia ora Tama! [LEAD_INFO]{"name": "Tama", "email": null}[/LEAD_INFO] See you at 6pm.'
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 11, 12, len(REPLY_WITH_TRAILER)])
+def test_stream_filter_strips_the_trailer_however_it_is_split(chunk_size):
+    lead_filter = LeadInfoStreamFilter()
+    visible = "".join(
+        lead_filter.feed(REPLY_WITH_TRAILER[start:start + chunk_size])
+        for start in range(0, len(REPLY_WITH_TRAILER), chunk_size)
+    ) + lead_filter.close()
+    assert visible == "Kia ora Tama!  See you at 6pm."
+    assert lead_filter.message == visible
+    assert lead_filter.lead_info == {"name": "Tama", "email": None}
+
+def test_stream_filter_releases_text_that_only_looks_like_the_marker():
+    lead_filter = LeadInfoStreamFilter()
+    assert lead_filter.feed("Fees are [LEAD") == "Fees are "
+    assert lead_filter.feed("ING] free") == "[LEADING] free"
+    assert lead_filter.feed(" [") == " "
+    assert lead_filter.close() == "["
+    assert lead_filter.lead_info is None
+
+def test_stream_filter_drops_an_unterminated_trailer():
+    lead_filter = LeadInfoStreamFilter()
+    visible = lead_filter.feed('See you soon. [LEAD_INFO]{"name": "Ta') + lead_filter.close()
+    assert visible == "See you soon. "
+    assert lead_filter.lead_info is None
+
+class StreamedChunk:
+    def __init__(self, content):
+        delta = type("Delta", (), {"content": content})()
+        self.choices = [type("Choice", (), {"delta": delta})()]
+
+class CannedStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield StreamedChunk(chunk)
+
+    async def close(self):
+        self.closed = True
+
+def test_streamed_turn_never_shows_the_trailer(agent, run):
+    stream = CannedStream([REPLY_WITH_TRAILER[start:start + 3] for start in range(0, len(REPLY_WITH_TRAILER), 3)])
+
+    async def create_completion(**kwargs):
+        return stream
+    agent._create_completion = create_completion
+
+    async def scenario():
+        return [event async for event in agent.chat_stream(QUESTION)]
+    events = run(scenario())
+    tokens = "".join(data["content"] for event, data in events if event == "token")
+    assert "LEAD_INFO" not in tokens and "Tama\"" not in tokens
+    assert ("lead_info", {"name": "Tama", "email": None}) in events
+    assert events[-1][0] == "done" and events[-1][1]["message"] == "Kia ora Tama!  See you at 6pm."
+    assert stream.closed
+
+def test_extraction_adds_what_the_model_found_to_the_local_scan(agent, run):
+    async def create_completion(**kwargs):
+        agent.calls.append(kwargs)
+        return CannedCompletion('{"name": "Tama", "email": null, "phone": " 021 555 0142 ", "interests": ""}')
+    agent._create_completion = create_completion
+
+    lead_info = run(agent.extract_lead_info("It's Tama, reach me on 021 555 0142 or tama@example.com",
+                                            "Thanks Tama!", conversation(30)))
+    assert lead_info == {"name": "Tama", "email": "tama@example.com", "phone": "021 555 0142"}
+    # Only the latest exchange is sent, however long the conversation
+    excerpt = agent.calls[0]["messages"][-1]["content"]
+    assert "question 29" in excerpt and "question 28" not in excerpt
+
+def test_extraction_falls_back_to_the_local_scan(agent, run):
+    async def failing_completion(**kwargs):
+        raise ConnectionError("reset by peer")
+    agent._create_completion = failing_completion
+
+    lead_info = run(agent.extract_lead_info("Hi, my name is Tama", "Kia ora Tama!", []))
+    assert lead_info == {"name": "Tama"}
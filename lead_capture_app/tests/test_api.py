@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from app import main
+
+def test_routed_turn_makes_no_llm_calls(serve, stub_llm):
+    async def scenario(client):
+        response = await client.post("/chat", json={"message": "Hi"})
+        return response.json()
+
+    reply = serve(scenario)
+    assert reply["message"].startswith("Kia ora!")
+    # Neither the reply nor the background lead extraction called the model
+    assert stub_llm.calls == 0
+
+def test_turn_giving_a_name_is_answered_and_extracted_by_the_model(serve, stub_llm):
+    async def scenario(client):
+        response = await client.post("/chat", json={"message": "Hi, I'm Tama"})
+        return response.json()
+
+    reply = serve(scenario)
+    assert not reply["message"].startswith("Kia ora!")
+    # The reply, then the background extraction
+    assert stub_llm.calls == 2
+
+def test_streamed_routed_turn_makes_no_llm_calls(serve, stub_llm):
+    async def scenario(client):
+        response = await client.post("/chat/stream", json={"message": "How can I donate?"})
+        return response.text
+
+    body = serve(scenario)
+    assert "event: done" in body
+    assert '"path"' not in body and '"lead_state"' not in body
+    assert stub_llm.calls == 0
+
+def test_streamed_model_turn_extracts_without_leaking_server_fields(serve, stub_llm):
+    async def scenario(client):
+        response = await client.post("/chat/stream", json={"message": "Hi, I'm Tama"})
+        return response.text
+
+    body = serve(scenario)
+    assert "event: done" in body
+    assert '"lead_state"' not in body
+    # The streamed reply, then the extraction call once the stream has ended
+    assert stub_llm.calls == 2
+
+def test_every_conversation_is_counted_once_whether_or_not_it_becomes_a_lead(serve):
+    async def scenario(client):
+        # A stateless conversation of two turns that never gives contact details
+        first = {"message": "Hi"}
+        reply = (await client.post("/chat", json=first)).json()["message"]
+        await client.post("/chat", json={"message": "How can I donate?", "conversation_history": [
+            {"role": "user", "content": "Hi"}, {"role": "assistant", "content": reply}
+        ]})
+        # A streamed stateless conversation and a two-turn session
+        await client.post("/chat/stream", json={"message": "Hello"})
+        session_id = (await client.post("/sessions")).json()["session_id"]
+        for message in ("Hi", "How can I donate?"):
+            await client.post("/chat", json={"message": message, "session_id": session_id})
+        return (await client.get("/leads/stats")).json()
+
+    stats = serve(scenario)
+    assert stats["total_conversations"] == 3
+    assert stats["total_leads"] == 0
+
+def test_extracted_lead_is_stored_after_the_reply(serve, database):
+    async def scenario(client):
+        response = await client.post("/chat", json={"message": "You can reach me at tama@example.com"})
+        return response.json()
+
+    reply = serve(scenario)
+    assert reply["captured_lead_info"] == {"email": "tama@example.com"}
+    with database.connect() as connection:
+        assert connection.execute(text("SELECT email FROM leads")).scalars().all() == ["tama@example.com"]
+
+class DisconnectedRequest:
+    async def is_disconnected(self):
+        return True
+
+def test_chat_is_cancelled_when_the_client_disconnects(run, monkeypatch):
+    monkeypatch.setattr(main, "DISCONNECT_POLL_INTERVAL", 0.01)
+    cancelled = []
+
+    async def slow_chat():
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        with pytest.raises(main.ClientDisconnected):
+            await main.run_until_disconnected(DisconnectedRequest(), slow_chat())
+        # Let the cancellation reach the coroutine
+        await asyncio.sleep(0)
+    run(scenario())
+    assert cancelled == [True]
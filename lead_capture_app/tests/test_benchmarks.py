@@ -0,0 +1,55 @@
+import json
+import sys
+
+import pytest
+
+from app import ai_service, main as app_main
+from app.circuit_breaker import CircuitBreaker
+from benchmarks import hot_paths, load_test
+
+@pytest.fixture
+def load(database, run, monkeypatch, tmp_path):
+    """Run the load test with the given arguments; returns its exit status and report"""
+    # It swaps in its own agent and sets environment variables; undo all of it afterwards
+    monkeypatch.setattr(app_main, "lead_agent", app_main.lead_agent)
+    monkeypatch.setattr(ai_service, "openai_breaker", CircuitBreaker("load-test"))
+    monkeypatch.setenv("DATABASE_URL", "unused")
+    monkeypatch.setenv("TRACE_FILE", str(tmp_path / "traces.jsonl"))
+    report_path = tmp_path / "report.json"
+
+    def run_load_test(*args):
+        monkeypatch.setattr(sys, "argv", ["load_test", "--llm-latency-ms", "0", "--json", str(report_path), *args])
+        status = run(load_test.main())
+        return status, json.loads(report_path.read_text())
+    return run_load_test
+
+@pytest.mark.parametrize("mode, endpoint", [("history", "chat"), ("session", "chat"), ("session", "stream")])
+def test_load_test_drives_conversations_end_to_end(load, mode, endpoint):
+    status, report = load("--conversations", "6", "--concurrency", "3", "--turns", "5",
+                          "--mode", mode, "--endpoint", endpoint)
+    assert status == 0
+    assert report["requests"] == 30
+    assert report["errors"] == 0
+    assert report["llm"]["calls"] > 0
+    assert report["db"]["leads"] > 0
+    assert report["db"]["lead_writer"]["flush_errors"] == 0
+
+def test_load_test_fails_past_its_latency_budget(load):
+    status, report = load("--conversations", "2", "--turns", "3", "--max-p95-ms", "0")
+    assert report["latency_ms"]["p95"] > 0
+    assert status == 1
+
+
+def test_hot_path_benchmarks_run_cold_and_warm():
+    results = hot_paths.run([1, 5], ["chat", "trailer"], min_time=0, repeats=1)
+    assert set(results) == {
+        f"{name}/{temperature}/{turns}"
+        for name in ("process_chat", "chat") for temperature in ("cold", "warm") for turns in (1, 5)
+    } | {"lead_info_trailer/warm/1", "lead_info_trailer/warm/5"}
+    assert all(value > 0 for value in results.values())
+
+def test_compare_flags_only_slowdowns_past_the_threshold(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps({"results": {"chat/warm/1": 100.0, "chat/warm/5": 100.0}}))
+    assert hot_paths.compare({"chat/warm/1": 115.0, "chat/warm/5": 50.0, "new/warm/1": 1.0}, str(baseline), 0.2) == 0
+    assert hot_paths.compare({"chat/warm/1": 125.0}, str(baseline), 0.2) == 1
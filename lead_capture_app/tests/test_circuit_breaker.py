@@ -0,0 +1,92 @@
+import openai
+import pytest
+
+from app import circuit_breaker
+from app.ai_service import LeadCaptureAgent
+from app.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    return now
+
+def breaker(**options):
+    settings = dict(window_seconds=60, min_calls=4, error_rate=0.5, slow_call_seconds=10,
+                    slow_call_rate=0.8, open_seconds=30, half_open_max_calls=1)
+    settings.update(options)
+    return CircuitBreaker("test", **settings)
+
+def test_opens_once_the_error_rate_is_reached(clock):
+    upstream = breaker()
+    for _ in range(2):
+        upstream.record_success(0.1)
+    upstream.record_failure(0.1)
+    assert upstream.state == CLOSED
+    upstream.record_failure(0.1)
+    assert upstream.state == OPEN
+    assert not upstream.allow_request()
+    assert upstream.snapshot()["rejected_calls"] == 1
+
+def test_too_few_calls_never_open_it(clock):
+    upstream = breaker()
+    for _ in range(3):
+        upstream.record_failure(0.1)
+    assert upstream.state == CLOSED
+
+def test_slow_calls_open_it(clock):
+    upstream = breaker()
+    for _ in range(4):
+        upstream.record_success(12)
+    assert upstream.state == OPEN
+
+def test_failures_outside_the_window_are_forgotten(clock):
+    upstream = breaker()
+    for _ in range(3):
+        upstream.record_failure(0.1)
+    clock[0] += 61
+    upstream.record_failure(0.1)
+    assert upstream.state == CLOSED
+
+def test_successful_probe_closes_it(clock):
+    upstream = breaker(min_calls=1)
+    upstream.record_failure(0.1)
+    clock[0] += 30
+    assert upstream.state == HALF_OPEN
+    assert upstream.allow_request()
+    # Only one probe at a time
+    assert not upstream.allow_request()
+    upstream.record_success(0.1)
+    assert upstream.state == CLOSED
+    assert upstream.allow_request()
+
+def test_failed_probe_opens_it_again(clock):
+    upstream = breaker(min_calls=1)
+    upstream.record_failure(0.1)
+    clock[0] += 30
+    assert upstream.allow_request()
+    upstream.record_failure(0.1)
+    assert upstream.state == OPEN
+    assert upstream.snapshot()["times_opened"] == 2
+
+def test_cancelled_probe_frees_its_slot(clock):
+    upstream = breaker(min_calls=1)
+    upstream.record_failure(0.1)
+    clock[0] += 30
+    assert upstream.allow_request()
+    upstream.release()
+    assert upstream.allow_request()
+
+def test_open_circuit_skips_the_model(run):
+    agent = LeadCaptureAgent(client=openai.AsyncOpenAI(api_key="test"))
+    agent.breaker = breaker(min_calls=1)
+    agent.breaker.record_failure(0.1)
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+    agent.client.chat.completions.create = create
+
+    result = run(agent.chat("What time do the sessions start in Manurewa?"))
+    assert result["path"] == "fallback"
+    assert calls == []
@@ -0,0 +1,29 @@
+from app.conversation_store import load_messages, sync_history
+from app.database import AsyncSessionLocal
+
+def history(turns):
+    messages = []
+    for n in range(turns):
+        messages += [{"role": "user", "content": f"question {n}"}, {"role": "assistant", "content": f"answer {n}"}]
+    return messages
+
+def synced(run, conversation_id, messages):
+    async def sync():
+        async with AsyncSessionLocal() as db:
+            in_sync = await sync_history(db, conversation_id, messages)
+            await db.commit()
+            return in_sync, await load_messages(db, conversation_id)
+    return run(sync())
+
+def test_only_missing_messages_are_appended(database, run):
+    assert synced(run, "c1", history(1)) == (True, history(1))
+    assert synced(run, "c1", history(3)) == (True, history(3))
+    # Resending what is already stored is a no-op
+    assert synced(run, "c1", history(3)) == (True, history(3))
+
+def test_history_that_does_not_continue_the_stored_one_is_refused(database, run):
+    synced(run, "c1", history(2))
+    edited = history(3)
+    edited[3] = {"role": "assistant", "content": "a different answer"}
+    assert synced(run, "c1", edited) == (False, history(2))
+    assert synced(run, "c1", history(1)) == (False, history(2))
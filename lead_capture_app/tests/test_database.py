@@ -0,0 +1,165 @@
+import types
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects.sqlite import Insert as SQLiteInsert
+
+from app import database
+from app.database import (
+    Base, Lead, AsyncSessionLocal, async_database_url, begin_write, create_tables, dialect_insert, engine_options,
+    normalize_email, normalize_phone
+)
+from app.lead_stats import STATS_VERSION, ensure_lead_stats
+
+@pytest.mark.parametrize("phone, key", [
+    ("+64 21 555 0142", "+64215550142"),
+    ("0064 21 555 0142", "+64215550142"),
+    ("021 555 0142", "+64215550142"),
+    ("(09) 555-0142", "+6495550142"),
+    # No country code and no trunk prefix: the digits, not a made-up international number
+    ("555-0142", "5550142"),
+    ("555.123.4567", "5551234567"),
+    ("", None),
+    ("call me", None),
+    (None, None),
+])
+def test_normalize_phone(phone, key):
+    assert normalize_phone(phone) == key
+
+def test_normalize_email():
+    assert normalize_email("  Tama@Example.COM ") == "tama@example.com"
+    assert normalize_email(" ") is None
+
+def test_phone_keys_with_a_made_up_prefix_are_rekeyed(database):
+    with database.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO leads (name, phone, phone_key) VALUES "
+            "('Local', '555-0142', '+5550142'), ('Intl', '+64 21 555 0142', '+64215550142')"
+        ))
+    create_tables()
+    with database.connect() as connection:
+        keys = dict(connection.execute(text("SELECT name, phone_key FROM leads")).all())
+    assert keys == {"Local": "5550142", "Intl": "+64215550142"}
+
+@pytest.fixture
+def baseline_database(database):
+    """The schema and data of a deployment from before any migration"""
+    Base.metadata.drop_all(bind=database)
+    with database.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE leads (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(100), email VARCHAR(100), "
+            "phone VARCHAR(20), interests TEXT, created_at DATETIME, conversation TEXT)"
+        ))
+        connection.execute(text(
+            "CREATE TABLE chat_sessions (id VARCHAR(32) NOT NULL PRIMARY KEY, history TEXT, "
+            "created_at DATETIME, updated_at DATETIME)"
+        ))
+        connection.execute(text(
+            "INSERT INTO leads (id, name, email, phone, interests, created_at, conversation) VALUES "
+            "(1, 'Tama', 'Tama@Example.com', '555-0142', 'fitness, budget', '2024-03-01 09:00:00', "
+            "'[{\"role\": \"user\", \"content\": \"Hi\"}, {\"role\": \"assistant\", \"content\": \"Kia ora\"}]'), "
+            "(2, 'Tama again', 'tama@example.com ', '555 0142', NULL, '2024-03-02 09:00:00', NULL), "
+            "(3, 'Aroha', NULL, NULL, 'youth', '2024-03-03 09:00:00', 'not json')"
+        ))
+        connection.execute(text(
+            "INSERT INTO chat_sessions (id, history) VALUES "
+            "('session1', '[{\"role\": \"user\", \"content\": \"Hello\"}]')"
+        ))
+    yield database
+    # Later tests start from create_tables, which would copy these sessions again
+    with database.begin() as connection:
+        connection.execute(text("DROP TABLE chat_sessions"))
+
+def test_baseline_database_is_migrated(baseline_database):
+    database = baseline_database
+    create_tables()
+    ensure_lead_stats()
+    with database.connect() as connection:
+        keys = connection.execute(text("SELECT id, email_key, phone_key FROM leads ORDER BY id")).all()
+        # Duplicates keep their key on the oldest row
+        assert [tuple(row) for row in keys] == [
+            (1, "tama@example.com", "5550142"), (2, None, None), (3, None, None)
+        ]
+        conversation_id = connection.execute(text("SELECT conversation_id FROM leads WHERE id = 1")).scalar()
+        messages = connection.execute(text(
+            "SELECT conversation_id, seq, role, content FROM conversation_messages ORDER BY conversation_id, seq"
+        )).all()
+        assert sorted(tuple(row) for row in messages) == sorted([
+            (conversation_id, 0, "user", "Hi"), (conversation_id, 1, "assistant", "Kia ora"),
+            ("session1", 0, "user", "Hello"),
+        ])
+        programs = connection.execute(text("SELECT lead_id, program FROM lead_programs ORDER BY lead_id, program")).all()
+        assert [tuple(row) for row in programs] == [
+            (1, "Community Fitness"), (1, "Whānau Hotaka"), (3, "Positive Pathways")
+        ]
+        indexes = {index["name"] for index in inspect(connection).get_indexes("leads")}
+        assert {"ix_leads_email_key", "ix_leads_phone_key", "ux_leads_keyless_conversation"} <= indexes
+        stats = dict(connection.execute(text(
+            "SELECT metric, value FROM lead_stats WHERE bucket = ''"
+        )).all())
+    assert stats["leads_total"] == 3
+    assert stats["stats_version"] == STATS_VERSION
+
+def test_migrating_twice_changes_nothing(baseline_database):
+    database = baseline_database
+    create_tables()
+    ensure_lead_stats()
+
+    def snapshot():
+        with database.connect() as connection:
+            return [
+                connection.execute(text(f"SELECT * FROM {table} ORDER BY 1, 2")).all()
+                for table in ("leads", "conversation_messages", "lead_programs", "lead_stats")
+            ]
+    migrated = snapshot()
+    create_tables()
+    ensure_lead_stats()
+    assert snapshot() == migrated
+
+@pytest.mark.parametrize("url, async_url", [
+    ("sqlite:///./leads.db", "sqlite+aiosqlite:///./leads.db"),
+    ("postgresql://lead:s3cret@db/leads", "postgresql+asyncpg://lead:s3cret@db/leads"),
+    ("postgresql+psycopg2://db/leads", "postgresql+asyncpg://db/leads"),
+])
+def test_async_database_url(url, async_url):
+    assert async_database_url(url) == async_url
+
+def test_async_database_url_rejects_unknown_backends():
+    with pytest.raises(ValueError):
+        async_database_url("mysql://db/leads")
+
+def test_dialect_insert_rejects_unknown_backends(monkeypatch):
+    assert isinstance(dialect_insert(Lead), SQLiteInsert)
+    monkeypatch.setattr(database, "async_engine", types.SimpleNamespace(dialect=types.SimpleNamespace(name="mysql")))
+    with pytest.raises(ValueError):
+        dialect_insert(Lead)
+
+def test_server_databases_get_a_pool_and_sqlite_does_not():
+    assert engine_options("sqlite:///./leads.db") == {"connect_args": {"check_same_thread": False}}
+    options = engine_options("postgresql+asyncpg://db/leads")
+    assert options["pool_pre_ping"] is True
+    assert {"pool_size", "max_overflow", "pool_timeout", "pool_recycle"} <= set(options)
+
+def test_sqlite_connections_are_tuned(database, run):
+    with database.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+    async def async_busy_timeout():
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(text("PRAGMA busy_timeout"))).scalar()
+    assert run(async_busy_timeout()) == 5000
+
+def test_write_transactions_take_the_sqlite_lock_up_front(database, run):
+    async def scenario():
+        async with AsyncSessionLocal() as first, AsyncSessionLocal() as second:
+            await begin_write(first)
+            with database.connect() as reader:
+                # Readers are not blocked by the writer
+                reader.execute(text("SELECT COUNT(*) FROM leads")).scalar()
+            await second.execute(text("PRAGMA busy_timeout=0"))
+            with pytest.raises(Exception, match="locked"):
+                await begin_write(second)
+            await first.rollback()
+    run(scenario())
@@ -0,0 +1,83 @@
+import asyncio
+
+from app import health
+from app.health import HealthProber
+
+async def passing():
+    return None
+
+async def failing():
+    raise ConnectionError("connection refused")
+
+async def hanging():
+    await asyncio.sleep(30)
+
+def test_ready_once_every_required_check_passes(run):
+    prober = HealthProber()
+    prober.add_check("database", passing, interval=10)
+    prober.add_check("openai_api", failing, interval=10, required=False)
+    assert not prober.ready
+
+    async def check_all():
+        for dependency in prober.checks.values():
+            await prober.run_check(dependency)
+    run(check_all())
+    assert prober.ready
+    snapshot = prober.snapshot()
+    assert snapshot["database"]["healthy"] and snapshot["database"]["detail"] == "healthy"
+    assert snapshot["openai_api"] == {**snapshot["openai_api"], "healthy": False, "required": False,
+                                      "detail": "error: connection refused"}
+
+def test_failing_or_hanging_required_check_is_not_ready(run, monkeypatch):
+    monkeypatch.setattr(health, "HEALTH_CHECK_TIMEOUT_SECONDS", 0.01)
+    for check, detail in ((failing, "error: connection refused"), (hanging, "timed out after 0.01s")):
+        prober = HealthProber()
+        prober.add_check("database", check, interval=10)
+        run(prober.run_check(prober.checks["database"]))
+        assert not prober.ready
+        assert prober.snapshot()["database"]["detail"] == detail
+
+def test_stale_result_is_not_ready(run):
+    prober = HealthProber()
+    prober.add_check("database", passing, interval=10)
+    run(prober.run_check(prober.checks["database"]))
+    # The prober stopped updating this check three intervals ago
+    prober.checks["database"].checked_at -= 31
+    assert not prober.ready
+    assert prober.snapshot()["database"]["detail"] == "stale: healthy"
+
+def test_background_prober_checks_until_stopped(run):
+    calls = []
+
+    async def counting():
+        calls.append(1)
+
+    async def scenario():
+        prober = HealthProber()
+        prober.add_check("database", counting, interval=0.01)
+        prober.start()
+        await asyncio.sleep(0.05)
+        ready = prober.ready
+        await prober.stop()
+        stopped_at = len(calls)
+        await asyncio.sleep(0.03)
+        return ready, stopped_at
+    ready, stopped_at = run(scenario())
+    assert ready
+    assert stopped_at > 1
+    assert len(calls) == stopped_at
+
+def test_probes_read_the_stored_results(serve):
+    async def scenario(client):
+        # The first checks run as the app starts
+        for _ in range(100):
+            ready = await client.get("/readyz")
+            if ready.status_code == 200:
+                break
+            await asyncio.sleep(0.01)
+        return ready, await client.get("/livez")
+
+    ready, alive = serve(scenario)
+    assert ready.status_code == 200
+    assert ready.json()["checks"]["database"]["healthy"]
+    assert alive.json() == {"status": "alive"}
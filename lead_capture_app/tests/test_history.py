@@ -0,0 +1,64 @@
+from app import history as history_module
+from app.history import HistoryManager, count_message_tokens, summarize_message
+
+def conversation(turns: int):
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"Question {turn} about the programs. " + "word " * 10})
+        history.append({"role": "assistant", "content": f"Answer {turn} about the programs. " + "word " * 10})
+    return history
+
+def test_window_prefix_is_stable_between_split_moves():
+    manager = HistoryManager(token_budget=600, summary_budget=200, min_recent=4, summary_block=8)
+    windows = [manager.build_window(conversation(turns)) for turns in range(5, 45)]
+    assert windows[-1][0]["content"].startswith("Summary of the earlier conversation")
+
+    # A turn reuses the previous turn's whole window unless the split moved
+    moves = sum(1 for before, after in zip(windows, windows[1:]) if after[:len(before)] != before)
+    assert moves <= len(windows) // 4 + 1
+
+def test_window_keeps_min_recent_messages_verbatim():
+    manager = HistoryManager(token_budget=300, summary_budget=100, min_recent=4, summary_block=8)
+    history = conversation(20)
+    window = manager.build_window(history)
+    assert window[-4:] == history[-4:]
+
+def test_short_history_is_sent_as_is():
+    history = conversation(3)
+    assert HistoryManager(token_budget=3000).build_window(history) == history
+
+def test_window_fits_the_budget():
+    manager = HistoryManager(token_budget=400, summary_budget=100, min_recent=4, summary_block=8)
+    window = manager.build_window(conversation(30))
+    verbatim = window[1:]
+    assert sum(count_message_tokens(msg) for msg in verbatim) <= 400 - 100
+    assert len(verbatim) >= 4
+
+def test_captured_lead_details_are_pinned_into_the_summary():
+    manager = HistoryManager(token_budget=300, summary_budget=100, min_recent=4, summary_block=8)
+    window = manager.build_window(conversation(20), {"name": "Tama", "email": None, "phone": "021 555 0142"})
+    summary = window[0]["content"]
+    assert "- name: Tama" in summary
+    assert "- phone: 021 555 0142" in summary
+    assert "email" not in summary
+
+def test_summary_is_extended_not_rebuilt(monkeypatch):
+    summarized = []
+    original = history_module.RollingSummary.update
+
+    def counting_update(self, messages):
+        summarized.extend(messages)
+        original(self, messages)
+    monkeypatch.setattr(history_module.RollingSummary, "update", counting_update)
+
+    manager = HistoryManager(token_budget=300, summary_budget=100, min_recent=4, summary_block=8)
+    history = conversation(40)
+    for turns in range(20, 41):
+        manager.build_window(history[:turns * 2], conversation_id="session-1")
+    # Every message before the final split was summarized exactly once
+    assert manager._split_point(history) > manager._split_point(history[:40])
+    assert [id(msg) for msg in summarized] == [id(msg) for msg in history[:manager._split_point(history)]]
+
+def test_summary_lines_leave_out_the_lead_info_trailer():
+    line = summarize_message("assistant", 'Kia ora Tama! See you Saturday. [LEAD_INFO]{"name": "Tama"}[/LEAD_INFO]')
+    assert line == "Assistant: Kia ora Tama!"
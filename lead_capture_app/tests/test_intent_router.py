@@ -0,0 +1,69 @@
+import pytest
+
+from app.intent_router import IntentRouter
+from app.lead_state import LeadCollectionState, mentions_name
+
+@pytest.fixture
+def router():
+    return IntentRouter(enabled=True, disabled_intents=set())
+
+def routed_intent(router, message, state=None):
+    routed = router.route(message, state or LeadCollectionState())
+    return routed["intent"] if routed else None
+
+def test_routes_plain_faq_turns(router):
+    assert routed_intent(router, "Hi") == "greeting"
+    assert routed_intent(router, "How can I donate?") == "donation"
+    assert routed_intent(router, "Tell me about Future Wahine") == "program_future_wahine"
+    assert routed_intent(router, "Kia Ora") == "greeting"
+
+@pytest.mark.parametrize("message", [
+    "Hi, I'm Tama",
+    "Hello, my name is Mere Walker",
+    "hey, call me Sione",
+])
+def test_turns_giving_a_name_go_to_the_model(router, message):
+    assert mentions_name(message)
+    assert routed_intent(router, message) is None
+
+@pytest.mark.parametrize("message", [
+    "I don't want to donate",
+    "I do not want to donate",
+    "I won’t be donating",
+    "Can you stop asking me to volunteer?",
+    "No volunteering for me",
+])
+def test_negated_turns_go_to_the_model(router, message):
+    assert routed_intent(router, message) is None
+
+def test_follow_up_skips_fields_already_collected(router):
+    state = LeadCollectionState.from_history([{"role": "user", "content": "My name is Tama"}])
+    routed = router.route("Hello", state)
+    assert routed["intent"] == "greeting"
+    assert "your name" not in routed["message"]
+
+@pytest.mark.parametrize("message", [
+    "Hi, my email is tama@example.com",
+    "Hi, call me back on 021 555 0142",
+])
+def test_turns_with_contact_details_go_to_the_model(router, message):
+    assert routed_intent(router, message) is None
+
+def test_keywords_match_whole_words_only(router):
+    assert routed_intent(router, "this") is None
+    assert routed_intent(router, "hi") == "greeting"
+
+def test_long_or_ambiguous_turns_go_to_the_model(router):
+    assert routed_intent(router, "How can I donate? " + "Please tell me everything in detail " * 4) is None
+    # Donating and volunteering score the same, so neither is confident
+    assert routed_intent(router, "Should I donate or volunteer?") is None
+
+def test_disabled_router_and_intents_route_nothing():
+    assert routed_intent(IntentRouter(enabled=False, disabled_intents=set()), "Hi") is None
+    assert routed_intent(IntentRouter(enabled=True, disabled_intents={"greeting"}), "Hi") is None
+
+def test_program_turn_reports_its_interest(router):
+    routed = router.route("Tell me about the community fitness boot camp", LeadCollectionState())
+    assert routed["intent"] == "program_community_fitness"
+    assert routed["interest"] == "Community Fitness"
+    assert routed["confidence"] >= router.threshold
@@ -0,0 +1,73 @@
+from app import lead_state
+from app.intent_router import IntentRouter
+from app.lead_state import LeadCollectionState, LeadStateCache
+
+def test_programs_listed_by_the_assistant_are_not_interests():
+    router = IntentRouter(enabled=True, disabled_intents=set())
+    question = "What programs do you offer?"
+    routed = router.route(question, LeadCollectionState())
+    history = [{"role": "user", "content": question}, {"role": "assistant", "content": routed["message"]}]
+
+    state = LeadCollectionState.from_history(history)
+    assert state.interests is None
+    # The visitor did ask about programs, so the topic has come up
+    assert state.collected["interests"]
+
+def test_programs_the_visitor_mentions_are_interests():
+    history = [
+        {"role": "user", "content": "My daughter might like Future Wahine"},
+        {"role": "assistant", "content": "Future Wahine and Positive Pathways both run on Saturdays."},
+        {"role": "user", "content": "And the boxing one, O-Beast?"},
+    ]
+    assert LeadCollectionState.from_history(history).interests == "Future Wahine, O-Beast"
+
+def test_cached_state_matches_a_full_scan():
+    cache = LeadStateCache()
+    history = [
+        {"role": "user", "content": "Hi, my name is Tama"},
+        {"role": "assistant", "content": "Kia ora Tama! We run Community Fitness and $20 Boss."},
+    ]
+    cache.get_state(history, "session-1")
+    history += [{"role": "user", "content": "Community Fitness please, tama@example.com"}]
+    state = cache.get_state(history, "session-1")
+    assert state.values() == LeadCollectionState.from_history(history).values()
+    assert state.values() == {"name": "Tama", "email": "tama@example.com", "phone": None,
+                              "interests": "Community Fitness"}
+
+def counting_processed(monkeypatch):
+    processed = []
+    original = LeadCollectionState._process_message
+
+    def process_message(self, role, content):
+        processed.append(content)
+        original(self, role, content)
+    monkeypatch.setattr(lead_state.LeadCollectionState, "_process_message", process_message)
+    return processed
+
+def test_stateless_history_only_processes_new_messages(monkeypatch):
+    processed = counting_processed(monkeypatch)
+    cache = LeadStateCache()
+    history = [
+        {"role": "user", "content": "Hi, my name is Tama"},
+        {"role": "assistant", "content": "Kia ora Tama!"},
+    ]
+    cache.get_state(history)
+    # The client resends the whole history plus the new turn
+    history = history + [{"role": "user", "content": "tama@example.com"}]
+    state = cache.get_state(history)
+    assert processed == ["Hi, my name is Tama", "Kia ora Tama!", "tama@example.com"]
+    assert (state.name, state.email, state.message_count) == ("Tama", "tama@example.com", 3)
+
+def test_edited_history_is_not_served_a_stale_state():
+    cache = LeadStateCache()
+    cache.get_state([{"role": "user", "content": "Hi, my name is Tama"}])
+    state = cache.get_state([{"role": "user", "content": "Hi, my name is Aroha"}])
+    assert state.name == "Aroha"
+
+def test_later_turns_do_not_change_a_cached_state():
+    cache = LeadStateCache()
+    history = [{"role": "user", "content": "Hi, my name is Tama"}]
+    first = cache.get_state(history, "session-1")
+    cache.get_state(history + [{"role": "user", "content": "I like fitness"}], "session-1")
+    assert first.values()["interests"] is None
+    assert first.message_count == 1
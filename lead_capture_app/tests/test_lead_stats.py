@@ -0,0 +1,78 @@
+import asyncio
+import datetime
+
+from sqlalchemy import text
+
+from app.lead_stats import counter_delta, recompute_lead_stats
+from app.lead_writer import LeadWriteQueue
+
+CREATED_AT = datetime.datetime(2026, 3, 2, 9, 30)
+
+def counters(database):
+    with database.connect() as connection:
+        return {
+            (metric, bucket): value
+            for metric, bucket, value in connection.execute(text("SELECT metric, bucket, value FROM lead_stats"))
+            if value and metric != "stats_version"
+        }
+
+def recomputed(database):
+    with database.begin() as connection:
+        recompute_lead_stats(connection)
+    return counters(database)
+
+def test_delta_for_a_new_lead():
+    delta = counter_delta(None, {"name": "Tama", "email": None, "phone": None,
+                                 "interests": "O-Beast", "created_at": CREATED_AT})
+    assert delta == {
+        ("leads_total", ""): 1,
+        ("leads_per_day", "2026-03-02"): 1,
+        ("field_completed", "name"): 1,
+        ("program", "O-Beast"): 1,
+        ("funnel", "captured"): 1,
+        ("funnel", "named"): 1,
+    }
+
+def test_delta_for_an_updated_lead_only_has_what_changed():
+    old = {"name": "Tama", "email": None, "phone": None, "interests": "O-Beast", "created_at": CREATED_AT}
+    new = dict(old, email="tama@example.com", interests="O-Beast, Future Wahine")
+    assert counter_delta(old, new) == {
+        ("field_completed", "email"): 1,
+        ("program", "Future Wahine"): 1,
+        ("funnel", "contactable"): 1,
+        ("funnel", "qualified"): 1,
+    }
+    assert counter_delta(old, old) == {}
+
+def test_delta_for_a_removed_lead_undoes_it():
+    lead = {"name": None, "email": None, "phone": None, "interests": None, "created_at": CREATED_AT}
+    assert counter_delta(lead, None) == {key: -value for key, value in counter_delta(None, lead).items()}
+
+def test_counters_kept_on_write_match_a_recompute(database, run):
+    writer = LeadWriteQueue()
+    run(writer.submit({"name": "Tama", "interests": "Future Wahine"}, [], "session-1"))
+    run(writer.submit({"name": "Tama", "email": "tama@example.com"}, [], "session-1"))
+    run(writer.submit({"phone": "021 555 0142", "interests": "O-Beast"}, []))
+    run(writer.submit({"email": "Tama@Example.com", "phone": "021 555 0142"}, []))
+    kept = counters(database)
+    assert kept[("leads_total", "")] == 2
+    assert kept == recomputed(database)
+
+def test_concurrent_writers_count_a_new_lead_once(database, run):
+    async def scenario():
+        await asyncio.gather(*(
+            LeadWriteQueue().submit({"email": "tama@example.com", "name": name}, [])
+            for name in ["Tama"] * 8
+        ))
+    run(scenario())
+    kept = counters(database)
+    assert kept[("leads_total", "")] == 1
+    assert kept[("field_completed", "name")] == 1
+    assert kept == recomputed(database)
+
+def test_recompute_keeps_conversations_that_were_never_stored(database, run):
+    run(LeadWriteQueue().submit({"email": "tama@example.com"}, [{"role": "user", "content": "tama@example.com"}]))
+    with database.begin() as connection:
+        # Five conversations counted by the chat handlers, one of them stored with its lead
+        connection.execute(text("INSERT INTO lead_stats (metric, bucket, value) VALUES ('conversations_total', '', 5)"))
+    assert recomputed(database)[("conversations_total", "")] == 5
@@ -0,0 +1,235 @@
+import asyncio
+
+from sqlalchemy import text
+
+from app.lead_state import interest_items, merge_interests
+from app.lead_writer import LeadWriteQueue, PendingLead
+
+# What extraction reports over four turns: cumulative, reworded and reordered
+CUMULATIVE_INTERESTS = [
+    "Future Wahine",
+    "Future Wahine, Community Fitness",
+    "Community Fitness, Future Wahine",
+    "Future Wahine, Community Fitness, O-Beast",
+]
+
+def leads(database):
+    with database.connect() as connection:
+        return [dict(row) for row in connection.execute(
+            text("SELECT id, name, email, phone, interests, conversation_id FROM leads ORDER BY id")
+        ).mappings()]
+
+def test_interest_items_split_and_deduplicate():
+    assert interest_items(" Future Wahine;future wahine , O-Beast,, ") == ["Future Wahine", "O-Beast"]
+    assert interest_items(None) == []
+
+def test_merge_interests_keeps_first_seen_order():
+    assert merge_interests("Future Wahine; O-Beast", "o-beast, $20 Boss") == "Future Wahine, O-Beast, $20 Boss"
+    assert merge_interests(None, None) is None
+
+def test_pending_lead_merges_interests_as_a_set():
+    pending = PendingLead()
+    for interests in CUMULATIVE_INTERESTS:
+        pending.merge({"interests": interests}, [])
+    assert pending.interests == "Future Wahine, Community Fitness, O-Beast"
+
+def test_upsert_keeps_each_interest_once(database, run):
+    writer = LeadWriteQueue()
+    for interests in CUMULATIVE_INTERESTS:
+        # No writer task running, so each update is written (and merged in the database) on its own
+        run(writer.submit({"email": "tama@example.com", "interests": interests}, []))
+    rows = leads(database)
+    assert len(rows) == 1
+    assert rows[0]["interests"] == "Future Wahine, Community Fitness, O-Beast"
+
+def test_upsert_cleans_up_interests_stored_with_repeats(database, run):
+    with database.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO leads (email, email_key, interests) VALUES "
+            "('tama@example.com', 'tama@example.com', 'Future Wahine; Future Wahine, Community Fitness')"
+        ))
+    run(LeadWriteQueue().submit({"email": "Tama@example.com", "interests": "Community Fitness, O-Beast"}, []))
+    assert leads(database)[0]["interests"] == "Future Wahine, Community Fitness, O-Beast"
+
+def test_stateless_details_wait_for_contact_details(database, run):
+    writer = LeadWriteQueue()
+    history = [{"role": "user", "content": "Kia ora, I'm Tama"}]
+    run(writer.submit({"name": "Tama"}, history))
+    assert leads(database) == []
+    history += [{"role": "assistant", "content": "Kia ora Tama!"}, {"role": "user", "content": "tama@example.com"}]
+    for _ in range(3):
+        run(writer.submit({"name": "Tama", "email": "tama@example.com"}, history))
+    rows = leads(database)
+    assert len(rows) == 1
+    assert (rows[0]["name"], rows[0]["email"]) == ("Tama", "tama@example.com")
+    assert writer.stats()["updates_skipped"] == 1
+
+def test_session_lead_is_upserted_on_its_conversation(database, run):
+    writer = LeadWriteQueue()
+    for interests in CUMULATIVE_INTERESTS:
+        run(writer.submit({"name": "Tama", "interests": interests}, [], "session-1"))
+    rows = leads(database)
+    assert len(rows) == 1
+    assert (rows[0]["name"], rows[0]["conversation_id"]) == ("Tama", "session-1")
+    assert rows[0]["interests"] == "Future Wahine, Community Fitness, O-Beast"
+
+def test_session_lead_is_merged_once_contact_details_arrive(database, run):
+    writer = LeadWriteQueue()
+    run(writer.submit({"name": "Tama", "interests": "Future Wahine"}, [], "session-1"))
+    run(writer.submit({"email": "tama@example.com", "interests": "O-Beast"}, [], "session-1"))
+    # A later update without contact details still goes to the same lead
+    run(writer.submit({"phone": None, "interests": "Community Fitness"}, [], "session-1"))
+    rows = leads(database)
+    assert len(rows) == 1
+    assert (rows[0]["name"], rows[0]["email"]) == ("Tama", "tama@example.com")
+    assert rows[0]["interests"] == "Future Wahine, O-Beast, Community Fitness"
+    with database.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM lead_programs")).scalar() == 3
+        total = connection.execute(text("SELECT value FROM lead_stats WHERE metric = 'leads_total'")).scalar()
+    assert total == 1
+
+def test_duplicate_keyless_leads_are_merged_on_startup(database):
+    from app.database import create_tables
+    with database.begin() as connection:
+        connection.execute(text("DROP INDEX ux_leads_keyless_conversation"))
+        connection.execute(text(
+            "INSERT INTO leads (name, interests, conversation_id) VALUES "
+            "('Tama', 'Future Wahine', 'session-1'), (NULL, 'O-Beast', 'session-1'), ('Aroha', NULL, 'session-2')"
+        ))
+    create_tables()
+    rows = leads(database)
+    assert [(row["name"], row["interests"], row["conversation_id"]) for row in rows] == [
+        ("Tama", "Future Wahine, O-Beast", "session-1"),
+        ("Aroha", None, "session-2"),
+    ]
+
+def test_stateless_conversation_is_appended_not_copied(database, run):
+    writer = LeadWriteQueue()
+    history = []
+    for turn in range(5):
+        history += [{"role": "user", "content": f"message {turn}"}, {"role": "assistant", "content": f"reply {turn}"}]
+        lead_info = {"name": "Tama"} if turn < 2 else {"name": "Tama", "email": "tama@example.com"}
+        run(writer.submit(lead_info, list(history)))
+    rows = leads(database)
+    assert len(rows) == 1
+    with database.connect() as connection:
+        stored = connection.execute(text(
+            "SELECT conversation_id, COUNT(*) FROM conversation_messages GROUP BY conversation_id"
+        )).all()
+    assert stored == [(rows[0]["conversation_id"], len(history))]
+
+def test_session_messages_are_left_to_the_session_store(database, run):
+    history = [{"role": "user", "content": "tama@example.com"}]
+    run(LeadWriteQueue().submit({"email": "tama@example.com"}, history, "session-1"))
+    with database.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM conversation_messages")).scalar() == 0
+
+def test_concurrent_writers_keep_each_others_interests(database, run):
+    programs = ["Future Wahine", "O-Beast", "Community Fitness", "$20 Boss"]
+
+    async def scenario():
+        # Separate queues write through in separate transactions, like separate workers
+        await asyncio.gather(*(
+            LeadWriteQueue().submit({"email": "tama@example.com", "interests": program}, [])
+            for program in programs
+        ))
+    run(scenario())
+    rows = leads(database)
+    assert len(rows) == 1
+    assert sorted(interest_items(rows[0]["interests"])) == sorted(programs)
+
+def test_running_queue_coalesces_updates_until_stop_drains_them(database, run):
+    queue = LeadWriteQueue(batch_size=10, flush_interval=60)
+
+    async def scenario():
+        queue.start()
+        for interests in CUMULATIVE_INTERESTS:
+            await queue.submit({"email": "tama@example.com", "interests": interests}, [])
+        await queue.submit({"email": "tama@example.com", "name": "Tama"}, [])
+        # Nothing is written until the batch fills or the interval passes
+        assert leads(database) == []
+        await queue.stop()
+    run(scenario())
+    rows = leads(database)
+    assert [(row["name"], row["email"]) for row in rows] == [("Tama", "tama@example.com")]
+    assert interest_items(rows[0]["interests"]) == ["Future Wahine", "Community Fitness", "O-Beast"]
+    stats = queue.stats()
+    assert stats["updates_submitted"] == 5
+    assert stats["updates_coalesced"] == 4
+    assert stats["rows_written"] == 1
+    assert stats["queue_depth"] == 0
+
+def test_full_batch_is_flushed_without_waiting_for_the_interval(database, run):
+    queue = LeadWriteQueue(batch_size=3, flush_interval=60)
+
+    async def scenario():
+        queue.start()
+        for number in range(3):
+            await queue.submit({"email": f"lead{number}@example.com"}, [])
+        for _ in range(100):
+            if len(leads(database)) == 3:
+                break
+            await asyncio.sleep(0.01)
+        written = len(leads(database))
+        await queue.stop()
+        return written
+    assert run(scenario()) == 3
+    assert queue.flushes == 1
+
+def test_running_queues_flushing_the_same_lead_write_one_row(database, run):
+    programs = ["Future Wahine", "O-Beast", "Community Fitness", "$20 Boss"]
+    queues = [LeadWriteQueue(batch_size=1, flush_interval=60) for _ in programs]
+
+    async def scenario():
+        # One queue per worker, each flushing its own update for the same lead
+        for queue in queues:
+            queue.start()
+        await asyncio.gather(*(
+            queue.submit({"email": "Tama@Example.com", "phone": "021 555 0142", "interests": program}, [])
+            for queue, program in zip(queues, programs)
+        ))
+        await asyncio.gather(*(queue.stop() for queue in queues))
+    run(scenario())
+    rows = leads(database)
+    assert len(rows) == 1
+    assert sorted(interest_items(rows[0]["interests"])) == sorted(programs)
+    assert sum(queue.flush_errors for queue in queues) == 0
+    with database.connect() as connection:
+        assert connection.execute(text("SELECT value FROM lead_stats WHERE metric = 'leads_total'")).scalar() == 1
+
+def lead_keys(database):
+    with database.connect() as connection:
+        return [tuple(row) for row in connection.execute(
+            text("SELECT name, email, phone, email_key, phone_key FROM leads ORDER BY id")
+        )]
+
+def test_email_written_differently_updates_the_same_lead(database, run):
+    writer = LeadWriteQueue()
+    run(writer.submit({"name": "Tama", "email": "tama@example.com"}, []))
+    run(writer.submit({"name": "Tama Ngata", "email": " Tama@Example.COM", "phone": "021 555 0142"}, []))
+    # Existing values are kept, missing ones filled in
+    assert lead_keys(database) == [
+        ("Tama", "tama@example.com", "021 555 0142", "tama@example.com", "+64215550142")
+    ]
+
+def test_phone_written_differently_updates_the_same_lead(database, run):
+    writer = LeadWriteQueue()
+    run(writer.submit({"name": "Tama", "phone": "021 555 0142"}, []))
+    run(writer.submit({"phone": "+64 21 555 0142", "interests": "O-Beast"}, []))
+    rows = leads(database)
+    assert len(rows) == 1
+    assert (rows[0]["name"], rows[0]["interests"]) == ("Tama", "O-Beast")
+
+def test_phone_of_another_lead_is_stored_without_its_key(database, run):
+    writer = LeadWriteQueue()
+    run(writer.submit({"email": "tama@example.com", "phone": "021 555 0142"}, []))
+    run(writer.submit({"email": "aroha@example.com"}, []))
+    # A new lead, and an existing one, each giving a number that is already taken
+    run(writer.submit({"email": "mere@example.com", "phone": "021 555 0142"}, []))
+    run(writer.submit({"email": "aroha@example.com", "phone": "0215550142"}, []))
+    assert lead_keys(database) == [
+        (None, "tama@example.com", "021 555 0142", "tama@example.com", "+64215550142"),
+        (None, "aroha@example.com", "0215550142", "aroha@example.com", None),
+        (None, "mere@example.com", "021 555 0142", "mere@example.com", None),
+    ]
+    assert writer.flush_errors == 0
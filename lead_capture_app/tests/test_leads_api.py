@@ -0,0 +1,147 @@
+from app.lead_writer import LeadWriteQueue
+
+def conversation(name):
+    return [
+        {"role": "user", "content": f"Hi, my name is {name}"},
+        {"role": "assistant", "content": f"Kia ora {name}!"},
+    ]
+
+def seed(run, leads):
+    """Write leads through the lead writer, oldest first"""
+    async def write():
+        writer = LeadWriteQueue()
+        for lead_info in leads:
+            await writer.submit(lead_info, conversation(lead_info["name"]))
+    run(write())
+
+def test_lead_is_fetched_by_id(serve, run):
+    seed(run, [{"name": "Tama", "email": "tama@example.com"}])
+
+    async def scenario(client):
+        leads = (await client.get("/leads")).json()["items"]
+        lead_id = leads[0]["id"]
+        plain = (await client.get(f"/leads/{lead_id}")).json()
+        full = (await client.get(f"/leads/{lead_id}", params={"include_conversation": "true"})).json()
+        missing = await client.get(f"/leads/{lead_id + 1}")
+        return plain, full, missing.status_code
+
+    plain, full, missing_status = serve(scenario)
+    assert (plain["name"], plain["email"]) == ("Tama", "tama@example.com")
+    assert "conversation" not in plain
+    assert "my name is Tama" in full["conversation"]
+    assert missing_status == 404
+
+LEADS = [
+    {"name": "Tama", "email": "tama@example.com", "interests": "Community Fitness"},
+    {"name": "Aroha", "phone": "021 555 0142"},
+    {"name": "Mere", "email": "mere@example.com", "phone": "021 555 0143", "interests": "Future Wahine"},
+    {"name": "Sione", "email": "sione@example.com"},
+    {"name": "Ana", "email": "ana@example.com", "interests": "O-Beast, Future Wahine"},
+]
+
+def names(page):
+    return [lead["name"] for lead in page["items"]]
+
+def test_pages_walk_every_lead_newest_first(serve, run):
+    seed(run, LEADS)
+
+    async def scenario(client):
+        pages, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            page = (await client.get("/leads", params=params)).json()
+            pages.append(page)
+            cursor = page.get("next_cursor")
+            if cursor is None:
+                return pages
+
+    pages = serve(scenario)
+    assert [names(page) for page in pages] == [["Ana", "Sione"], ["Mere", "Aroha"], ["Tama"]]
+    assert "conversation" not in pages[0]["items"][0]
+
+def test_filters_narrow_the_page(serve, run):
+    seed(run, LEADS)
+
+    async def scenario(client):
+        async def page(**params):
+            return names((await client.get("/leads", params=params)).json())
+        return {
+            "email_and_phone": await page(has_email="true", has_phone="true"),
+            "no_email": await page(has_email="false"),
+            "interest": await page(interest="wahine"),
+            "future": await page(created_from="2999-01-01T00:00:00"),
+        }
+
+    pages = serve(scenario)
+    assert pages == {
+        "email_and_phone": ["Mere"],
+        "no_email": ["Aroha"],
+        "interest": ["Ana", "Mere"],
+        "future": [],
+    }
+
+def test_bad_cursor_and_page_size_are_rejected(serve):
+    async def scenario(client):
+        return [
+            (await client.get("/leads", params={"cursor": "not-a-cursor"})).status_code,
+            (await client.get("/leads", params={"limit": 0})).status_code,
+            (await client.get("/leads", params={"limit": 100000})).status_code,
+        ]
+    assert serve(scenario) == [400, 422, 422]
+
+def test_lead_messages_are_paged_oldest_first(serve, run):
+    async def write():
+        writer = LeadWriteQueue()
+        messages = []
+        for n in range(3):
+            messages += [{"role": "user", "content": f"question {n}"}, {"role": "assistant", "content": f"answer {n}"}]
+        await writer.submit({"email": "tama@example.com"}, messages)
+    run(write())
+
+    async def scenario(client):
+        lead_id = (await client.get("/leads")).json()["items"][0]["id"]
+        pages, after_seq = [], -1
+        while after_seq is not None:
+            page = (await client.get(f"/leads/{lead_id}/messages", params={"limit": 4, "after_seq": after_seq})).json()
+            pages.append(page)
+            after_seq = page["next_after_seq"]
+        missing = await client.get(f"/leads/{lead_id + 1}/messages")
+        return pages, missing.status_code
+
+    pages, missing_status = serve(scenario)
+    assert [[message["seq"] for message in page["items"]] for page in pages] == [[0, 1, 2, 3], [4, 5]]
+    assert pages[1]["items"][-1]["content"] == "answer 2"
+    assert all(message["token_count"] > 0 for page in pages for message in page["items"])
+    assert missing_status == 404
+
+def test_stats_are_served_from_the_counters_and_match_a_recompute(serve, run):
+    seed(run, LEADS)
+
+    async def scenario(client):
+        stats = (await client.get("/leads/stats")).json()
+        recomputed = (await client.post("/leads/stats/recompute")).json()
+        today = (await client.get("/leads/stats", params={"days": 1})).json()
+        return stats, recomputed, today
+
+    stats, recomputed, today = serve(scenario)
+    assert stats == recomputed
+    assert stats["total_leads"] == 5
+    assert stats["field_completion"]["email"] == {"count": 4, "rate": 0.8}
+    assert stats["field_completion"]["phone"] == {"count": 2, "rate": 0.4}
+    assert stats["programs"] == {"Future Wahine": 2, "Community Fitness": 1, "O-Beast": 1}
+    assert sum(today["leads_per_day"].values()) == 5
+
+def test_program_filter_and_facets(serve, run):
+    seed(run, LEADS)
+
+    async def scenario(client):
+        by_program = names((await client.get("/leads", params=[("program", "O-Beast"), ("program", "Community Fitness")])).json())
+        facets = (await client.get("/leads/facets", params={"has_phone": "true", "program": "O-Beast"})).json()
+        unknown = await client.get("/leads", params={"program": "Knitting"})
+        return by_program, facets, unknown.status_code
+
+    by_program, facets, unknown_status = serve(scenario)
+    assert by_program == ["Ana", "Tama"]
+    # Facets follow the other filters but ignore the program filter
+    assert facets == [{"program": "Future Wahine", "count": 1}]
+    assert unknown_status == 400
@@ -0,0 +1,58 @@
+import pytest
+
+from app import metrics
+
+@pytest.fixture
+def registry(monkeypatch):
+    """An empty registry, so test metrics stay out of /metrics"""
+    monkeypatch.setattr(metrics, "_registry", [])
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = metrics.Histogram("stage_seconds", "Stage time", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.labels("llm_call").observe(value)
+    assert metrics.render().splitlines() == [
+        "# HELP stage_seconds Stage time",
+        "# TYPE stage_seconds histogram",
+        'stage_seconds_bucket{stage="llm_call",le="0.1"} 2',
+        'stage_seconds_bucket{stage="llm_call",le="1.0"} 3',
+        'stage_seconds_bucket{stage="llm_call",le="+Inf"} 4',
+        'stage_seconds_sum{stage="llm_call"} 3.65',
+        'stage_seconds_count{stage="llm_call"} 4',
+    ]
+
+def test_counters_gauges_and_callbacks_render(registry):
+    counter = metrics.Counter("turns_total", "Turns", ("path",))
+    counter.labels('say "hi"\n').inc(2)
+    gauge = metrics.Gauge("in_flight", "In flight")
+    gauge.labels().inc()
+    gauge.labels().dec()
+    metrics.Counter("hits_total", "Hits", ("cache",), callback=lambda: {("response",): 7})
+    lines = metrics.render().splitlines()
+    assert 'turns_total{path="say \\"hi\\"\\n"} 2' in lines
+    # Unlabelled metrics are exported from the start
+    assert "in_flight 0" in lines
+    assert 'hits_total{cache="response"} 7' in lines
+
+def test_usage_splits_cached_prompt_tokens():
+    details = type("Details", (), {"cached_tokens": 1024})()
+    usage = type("Usage", (), {"prompt_tokens": 1500, "completion_tokens": 40, "prompt_tokens_details": details})()
+    assert metrics.record_usage(usage) == (1024, 476)
+
+def sample(text, line_prefix):
+    """A sample's value; labelled samples only appear once used, so missing is zero"""
+    return next((float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(line_prefix)), 0.0)
+
+def test_metrics_endpoint_counts_chat_turns(serve):
+    async def scenario(client):
+        before = (await client.get("/metrics")).text
+        await client.post("/chat", json={"message": "Hi"})
+        response = await client.get("/metrics")
+        return before, response
+
+    before, response = serve(scenario)
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    after = response.text
+    assert sample(after, 'chat_turns_total{path="intent"}') == sample(before, 'chat_turns_total{path="intent"}') + 1
+    total = 'chat_stage_duration_seconds_count{stage="total"}'
+    assert sample(after, total) == sample(before, total) + 1
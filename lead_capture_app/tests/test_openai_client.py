@@ -0,0 +1,72 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from app import ai_service
+from app.ai_service import LeadCaptureAgent
+
+@pytest.fixture
+def http_clients(monkeypatch):
+    """Keyword arguments of every httpx.AsyncClient the app creates"""
+    created = []
+
+    class RecordingClient(httpx.AsyncClient):
+        def __init__(self, **kwargs):
+            created.append(kwargs)
+            super().__init__(**kwargs)
+    monkeypatch.setattr(ai_service.httpx, "AsyncClient", RecordingClient)
+    return created
+
+@pytest.fixture
+def shared_client(monkeypatch):
+    """Start from no shared client and close whatever the test created"""
+    monkeypatch.setattr(ai_service, "_openai_client", None)
+    yield
+    if ai_service._openai_client is not None:
+        asyncio.run(ai_service.close_openai_client())
+
+def test_agents_share_one_pooled_client(shared_client, http_clients, run):
+    first, second = LeadCaptureAgent(), LeadCaptureAgent()
+    assert first.client is second.client
+    assert len(http_clients) == 1
+    limits = http_clients[0]["limits"]
+    assert (limits.max_connections, limits.max_keepalive_connections, limits.keepalive_expiry) == (
+        ai_service.OPENAI_MAX_CONNECTIONS, ai_service.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        ai_service.OPENAI_KEEPALIVE_EXPIRY_SECONDS)
+    assert http_clients[0]["timeout"].connect == ai_service.OPENAI_CONNECT_TIMEOUT_SECONDS
+    assert first.client.max_retries == ai_service.OPENAI_SDK_MAX_RETRIES
+
+    # Closing it (at shutdown) means the next user gets a fresh pool
+    run(ai_service.close_openai_client())
+    assert LeadCaptureAgent().client is not first.client
+
+def test_http2_falls_back_without_h2(shared_client, http_clients, monkeypatch):
+    monkeypatch.setattr(ai_service, "OPENAI_HTTP2", True)
+    monkeypatch.setattr(ai_service, "http2_available", lambda: False)
+    ai_service.get_async_openai_client()
+    assert http_clients[0]["http2"] is False
+
+def test_client_needs_an_api_key(shared_client, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY")
+    with pytest.raises(ValueError):
+        ai_service.create_openai_client()
+
+def mock_client(handler):
+    return openai.AsyncOpenAI(api_key="test", http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+def test_warm_up_lists_models_once(run):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"object": "list", "data": []})
+    run(ai_service.warm_up_openai_client(mock_client(handler)))
+    assert [request.url.path for request in requests] == ["/v1/models"]
+
+def test_failed_warm_up_is_only_logged(run):
+    def handler(request):
+        return httpx.Response(500, json={"error": {"message": "down"}})
+    # No retries and no exception: the app starts anyway and connects on first use
+    run(ai_service.warm_up_openai_client(mock_client(handler)))
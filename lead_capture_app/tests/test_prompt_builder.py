@@ -0,0 +1,44 @@
+from app.ai_service import SYSTEM_PROMPT, LeadCaptureAgent
+from app.history import count_message_tokens
+from app.prompt_builder import PromptBuilder
+
+NOTHING_COLLECTED = {"name": False, "email": False, "phone": False, "interests": False}
+
+def test_turn_specific_parts_come_after_the_window():
+    builder = PromptBuilder(SYSTEM_PROMPT)
+    window = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Kia ora!"}]
+    messages = builder.build(window, "Where are you based?", NOTHING_COLLECTED)
+    assert messages[0] is builder.prefix.message
+    assert messages[1:3] == window
+    assert messages[3] == {"role": "user", "content": "Where are you based?"}
+    assert "name" in messages[4]["content"] and messages[4]["role"] == "system"
+
+def test_reminder_names_only_missing_fields_and_goes_once_all_are_collected():
+    builder = PromptBuilder(SYSTEM_PROMPT)
+    collected_info = {"name": True, "email": False, "phone": True, "interests": False}
+    # Every reminder is built once, up front
+    assert builder.reminder(collected_info) is builder.reminder(dict(collected_info))
+    reminder = builder.reminder(collected_info).message["content"]
+    assert "email address" in reminder and "areas of interest" in reminder
+    assert "phone number" not in reminder and "their name" not in reminder
+    collected = dict.fromkeys(NOTHING_COLLECTED, True)
+    assert builder.build([], "Thanks!", collected)[-1] == {"role": "user", "content": "Thanks!"}
+
+def test_token_estimate_counts_every_message():
+    builder = PromptBuilder(SYSTEM_PROMPT)
+    messages = builder.build([{"role": "user", "content": "Hi"}], "Where are you based?", NOTHING_COLLECTED)
+    assert builder.count_tokens(messages) == sum(count_message_tokens(msg) for msg in messages)
+
+def test_consecutive_turns_share_their_prompt_prefix():
+    agent = LeadCaptureAgent()
+    history = []
+    previous = None
+    for turn in range(6):
+        messages = agent._build_messages(f"Question {turn} about the sessions", history)
+        if previous is not None:
+            # Everything but the last turn's question and reminder is sent again unchanged
+            kept = len(previous) - (2 if previous[-1]["role"] == "system" else 1)
+            assert messages[:kept] == previous[:kept]
+        previous = messages
+        history = history + [{"role": "user", "content": f"Question {turn} about the sessions"},
+                             {"role": "assistant", "content": f"Answer {turn}."}]
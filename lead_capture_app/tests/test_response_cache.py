@@ -0,0 +1,77 @@
+import openai
+
+from app import response_cache
+from app.ai_service import LeadCaptureAgent
+from app.lead_state import LeadCollectionState
+from app.response_cache import ResponseCache
+
+def key(cache, message, history=None, state=None):
+    return cache.make_key(message, history or [], state or LeadCollectionState())
+
+def test_rewordings_of_the_same_message_share_an_entry():
+    cache = ResponseCache()
+    assert key(cache, "Where are you based?!") == key(cache, "  where ARE you based ")
+    assert key(cache, "Where are you based?") != key(cache, "Where are you based?", [{"role": "user", "content": "Hi"}])
+
+def test_turns_with_personal_data_are_not_cached():
+    cache = ResponseCache()
+    assert key(cache, "Email me at tama@example.com") is None
+    assert key(cache, "Call 021 555 0142") is None
+    assert key(cache, "Hi", state=LeadCollectionState.from_history([{"role": "user", "content": "my name is Tama"}])) is None
+
+    cache.put(key(cache, "Who are you?"), "Kia ora, write to tama@example.com")
+    assert cache.get(key(cache, "Who are you?")) is None
+    assert cache.stats()["skipped"] == 3
+
+def test_long_conversations_are_not_cached():
+    cache = ResponseCache(max_history=2)
+    history = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Kia ora"}]
+    assert key(cache, "Where are you?", history) is not None
+    assert key(cache, "Where are you?", history + history) is None
+
+def test_lead_collection_progress_is_part_of_the_key():
+    cache = ResponseCache()
+    asked = LeadCollectionState.from_history([{"role": "user", "content": "What programs are there?"}])
+    assert key(cache, "Tell me more") != key(cache, "Tell me more", state=asked)
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(ttl=60)
+    cache.put("k", "Kia ora")
+    now[0] += 59
+    assert cache.get("k") == "Kia ora"
+    now[0] += 2
+    assert cache.get("k") is None
+    assert cache.stats()["size"] == 0
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_size=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("A", "C")
+    assert cache.stats()["evictions"] == 1
+
+class CannedCompletion:
+    def __init__(self, content):
+        message = type("Message", (), {"content": content})()
+        self.choices = [type("Choice", (), {"message": message})()]
+        self.usage = None
+
+def test_repeat_turn_is_answered_from_the_cache(run):
+    agent = LeadCaptureAgent(client=openai.AsyncOpenAI(api_key="test"))
+    calls = []
+
+    async def create_completion(**kwargs):
+        calls.append(kwargs)
+        return CannedCompletion("Our sessions run in Manurewa.")
+    agent._create_completion = create_completion
+
+    first = run(agent.chat("Which suburb are the sessions held in?"))
+    second = run(agent.chat("which suburb are the sessions held in"))
+    assert (first["path"], second["path"]) == ("llm", "cache")
+    assert second["message"] == first["message"]
+    assert len(calls) == 1
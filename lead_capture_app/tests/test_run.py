@@ -0,0 +1,35 @@
+import os
+
+from sqlalchemy import inspect
+
+import run
+
+def test_development_server_reloads(monkeypatch):
+    monkeypatch.setattr(run, "ENVIRONMENT", "development")
+    assert run.server_options() == {"reload": True}
+
+def test_production_server_uses_workers_and_the_fast_loop(monkeypatch):
+    monkeypatch.setattr(run, "ENVIRONMENT", "production")
+    monkeypatch.setattr(run, "WEB_CONCURRENCY", 4)
+    monkeypatch.setattr(run, "module_available", lambda name: True)
+    assert run.server_options() == {
+        "workers": 4,
+        "loop": "uvloop",
+        "http": "httptools",
+        "timeout_keep_alive": run.KEEPALIVE_TIMEOUT_SECONDS,
+        "timeout_graceful_shutdown": run.GRACEFUL_SHUTDOWN_SECONDS,
+    }
+
+def test_production_server_falls_back_without_uvicorn_standard(monkeypatch, capsys):
+    monkeypatch.setattr(run, "ENVIRONMENT", "production")
+    monkeypatch.setattr(run, "module_available", lambda name: False)
+    options = run.server_options()
+    assert (options["loop"], options["http"]) == ("asyncio", "h11")
+    assert "uvicorn[standard]" in capsys.readouterr().out
+
+def test_database_is_prepared_once_before_the_workers(database, monkeypatch):
+    monkeypatch.setenv("RUN_MIGRATIONS_ON_STARTUP", "true")
+    run.prepare_database()
+    assert {"leads", "conversation_messages", "lead_programs", "lead_stats"} <= set(inspect(database).get_table_names())
+    # Workers skip the migrations the parent already ran
+    assert os.environ["RUN_MIGRATIONS_ON_STARTUP"] == "false"
@@ -0,0 +1,98 @@
+import asyncio
+
+from app.database import AsyncSessionLocal
+from app.conversation_store import load_messages
+from app.sessions import SessionStore
+
+def turn(n):
+    return [{"role": "user", "content": f"t{n}"}, {"role": "assistant", "content": f"r{n}"}]
+
+async def stored(session_id):
+    async with AsyncSessionLocal() as db:
+        return await load_messages(db, session_id)
+
+def test_append_after_another_store_appended(database, run):
+    # Two workers, each with its own in-memory copy of the same session
+    async def scenario():
+        store_a, store_b = SessionStore(), SessionStore()
+        session_id = await store_a.create()
+        await store_a.append(session_id, turn(1))
+        assert await store_b.get(session_id) == turn(1)
+        await store_b.append(session_id, turn(2))
+        # Store A's copy is stale now; it must see turn 2 before answering turn 3
+        assert await store_a.get(session_id) == turn(1) + turn(2)
+        await store_a.append(session_id, turn(3))
+        return session_id, await store_a.get(session_id), await store_b.get(session_id)
+
+    session_id, history_a, history_b = run(scenario())
+    expected = turn(1) + turn(2) + turn(3)
+    assert history_a == expected
+    assert history_b == expected
+    assert run(stored(session_id)) == expected
+
+def test_append_with_stale_copy_is_not_dropped(database, run):
+    async def scenario():
+        store_a, store_b = SessionStore(), SessionStore()
+        session_id = await store_a.create()
+        await store_a.append(session_id, turn(1))
+        await store_b.append(session_id, turn(2))
+        # Pretend store A's refresh raced with store B's append
+        store_a._remember(session_id, turn(1))
+        await store_a.append(session_id, turn(3))
+        return session_id, store_a._cache[session_id][1]
+
+    session_id, cached = run(scenario())
+    expected = turn(1) + turn(2) + turn(3)
+    assert run(stored(session_id)) == expected
+    assert cached == expected
+
+def test_concurrent_appends_keep_every_message(database, run):
+    async def scenario():
+        store = SessionStore()
+        session_id = await store.create()
+        await asyncio.gather(*(store.append(session_id, turn(n)) for n in range(5)))
+        return session_id, await store.get(session_id)
+
+    session_id, history = run(scenario())
+    messages = run(stored(session_id))
+    assert history == messages
+    assert len(messages) == 10
+    assert sorted(msg["content"] for msg in messages) == sorted(
+        msg["content"] for n in range(5) for msg in turn(n)
+    )
+    # Each turn's two messages stay together
+    for index in range(0, 10, 2):
+        assert messages[index]["content"][1:] == messages[index + 1]["content"][1:]
+
+def test_unknown_session_is_none(database, run):
+    assert run(SessionStore().get("missing")) is None
+
+def test_evicted_session_is_reloaded_from_the_database(database, run):
+    async def scenario():
+        store = SessionStore(max_size=2)
+        first = await store.create()
+        await store.append(first, turn(1))
+        for _ in range(2):
+            await store.create()
+        assert first not in store._cache
+        return await store.get(first), len(store._cache)
+
+    history, cached = run(scenario())
+    assert history == turn(1)
+    assert cached == 2
+
+def test_client_sends_only_the_new_message(serve):
+    async def scenario(client):
+        session_id = (await client.post("/sessions")).json()["session_id"]
+        for message in ("Hi", "How can I donate?"):
+            response = await client.post("/chat", json={"message": message, "session_id": session_id})
+            assert response.json()["session_id"] == session_id
+        session = (await client.get(f"/sessions/{session_id}")).json()
+        missing = await client.post("/chat", json={"message": "Hi", "session_id": "missing"})
+        return session, missing.status_code
+
+    session, missing_status = serve(scenario)
+    history = session["conversation_history"]
+    assert [msg["role"] for msg in history] == ["user", "assistant"] * 2
+    assert [msg["content"] for msg in history[::2]] == ["Hi", "How can I donate?"]
+    assert missing_status == 404
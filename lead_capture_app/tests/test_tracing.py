@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from app import tracing
+from app.tracing import Span, TraceExporter
+
+def finished_span(name: str) -> Span:
+    span = Span(name, "trace")
+    span.end()
+    return span
+
+def test_exporter_rotates_the_trace_file(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    exporter = TraceExporter(str(path), max_bytes=2000)
+    exporter.start()
+    for number in range(50):
+        exporter.export(finished_span(f"span {number}"))
+    exporter.stop()
+
+    assert exporter.exported == 50
+    assert exporter.rotations > 0
+    rotated = (tmp_path / "traces.jsonl.1").read_text().splitlines()
+    current = path.read_text().splitlines()
+    assert path.stat().st_size < 2000
+    # Nothing is lost at the rotation itself: the last span of the old file is followed by the first of the new
+    names = [json.loads(line)["name"] for line in rotated + current]
+    assert names[-1] == "span 49"
+    assert names == [f"span {number}" for number in range(50 - len(names), 50)]
+
+@pytest.fixture
+def exported(monkeypatch):
+    """Spans as they are handed to the exporter"""
+    spans = []
+    monkeypatch.setattr(tracing.trace_exporter, "export", spans.append)
+    return spans
+
+def test_sampled_trace_nests_its_spans(exported):
+    with tracing.trace("turn", sample_rate=1.0, path="llm"):
+        with tracing.span("prompt_build") as build:
+            build.set_attribute("messages", 3)
+        with pytest.raises(ValueError):
+            with tracing.span("llm.attempt", attempt=1):
+                raise ValueError("stub failure")
+    build_span, attempt_span, root = exported
+    assert root.parent_id is None and root.attributes == {"path": "llm"}
+    assert {build_span.parent_id, attempt_span.parent_id} == {root.span_id}
+    assert {build_span.trace_id, attempt_span.trace_id} == {root.trace_id}
+    assert build_span.attributes == {"messages": 3}
+    assert attempt_span.error == "ValueError: stub failure"
+    assert root.duration >= build_span.duration
+
+def test_unsampled_trace_records_nothing(exported):
+    with tracing.trace("turn", sample_rate=0.0) as root:
+        with tracing.span("prompt_build") as child:
+            child.set_attribute("messages", 3)
+    assert root is tracing.NOOP_SPAN and child is tracing.NOOP_SPAN
+    assert exported == []
+
+def test_requests_carry_a_request_id(serve, exported, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+
+    async def scenario(client):
+        # A model turn, so the request span has children
+        given = await client.post("/chat", json={"message": "Hi, I'm Tama"}, headers={"X-Request-ID": "req-123"})
+        invalid = await client.get("/livez", headers={"X-Request-ID": "bad id\n"})
+        generated = await client.get("/livez")
+        return given.headers["x-request-id"], invalid.headers["x-request-id"], generated.headers["x-request-id"]
+
+    given, invalid, generated = serve(scenario)
+    assert given == "req-123"
+    assert invalid != "bad id\n" and len(invalid) == 32
+    assert generated != invalid
+    request = next(span for span in exported if span.attributes.get("request_id") == "req-123")
+    assert request.name == "http.request"
+    assert request.attributes["status_code"] == 200
+    assert any(span.trace_id == request.trace_id and span.parent_id == request.span_id for span in exported)